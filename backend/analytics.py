@@ -0,0 +1,366 @@
+"""
+History analytics
+Keeps a columnar in-memory snapshot of the queries table, so aggregates
+over millions of rows take milliseconds instead of a full SQL scan
+"""
+
+import bisect
+import calendar
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional
+
+from config import Config
+from database import Database
+from tracing import traced
+from utils import _numpy
+
+logger = logging.getLogger(__name__)
+
+# Distances below this share the first histogram bucket
+_MIN_BUCKET_KM = 0.01
+
+
+class HistorySnapshot:
+    """
+    Columnar copy of the query history for aggregate statistics
+
+    One array.array per column, in id order: unix seconds ('q'), distance
+    in km ('d'), distance histogram bucket ('h') and an interned
+    source/destination pair code ('i'), about 22 bytes per row plus each
+    distinct pair once. Aggregates run as NumPy reductions over zero-copy
+    views of the arrays (pure Python without NumPy, much slower).
+
+    The snapshot is loaded from the database on first use and then fed by
+    Database listeners as queries are saved. Rows written by other
+    processes (gunicorn workers), or saved while the snapshot was busy,
+    are picked up by refresh(), which costs two primary key seeks when
+    nothing changed.
+
+    Percentiles come from a log-scaled distance histogram with buckets
+    STATS_DISTANCE_RESOLUTION wide, so they are accurate to half of that
+    (0.5% by default); count, min, max and mean are exact.
+    """
+
+    def __init__(self, db: Database):
+        """
+        Args:
+            db: Database to load from and listen to
+        """
+        self.db = db
+        self._lock = threading.Lock()
+        self._log_step = math.log1p(Config.STATS_DISTANCE_RESOLUTION)
+        self._loaded = False
+        self._reset()
+        db.add_listener(self._on_saved)
+
+    def _reset(self):
+        self._seconds = array('q')
+        self._distances = array('d')
+        self._buckets = array('h')
+        self._pairs = array('i')
+        self._pair_codes = {}
+        self._pair_labels = []
+        self._first_id = None
+        self._last_id = 0
+        # Running totals of the whole history, so unfiltered stats skip the columns
+        self._total_km = 0.0
+        self._min_km = math.inf
+        self._max_km = -math.inf
+        self._bucket_counts = Counter()
+        self._pair_counts = Counter()
+        self._hour_counts = Counter()
+        # Rows normally arrive in timestamp order; range filters bisect while they do
+        self._sorted = True
+
+    def __len__(self) -> int:
+        return len(self._seconds)
+
+    def _bucket(self, km: float) -> int:
+        if km < _MIN_BUCKET_KM:
+            return 0
+        return min(1 + int(math.log(km / _MIN_BUCKET_KM) / self._log_step), 32767)
+
+    def _bucket_value(self, bucket: int) -> float:
+        """Geometric middle of a bucket"""
+        if bucket == 0:
+            return 0.0
+        return _MIN_BUCKET_KM * math.exp((bucket - 0.5) * self._log_step)
+
+    def _bucket_column(self, distances: List[float]) -> array:
+        np = _numpy()
+        if np is None:
+            return array('h', map(self._bucket, distances))
+        km = np.asarray(distances, dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            buckets = np.floor(np.log(km / _MIN_BUCKET_KM) / self._log_step) + 1
+        buckets = np.where(km < _MIN_BUCKET_KM, 0, np.minimum(buckets, 32767))
+        return array('h', buckets.astype(np.int16).tobytes())
+
+    def _append(self, first_id: int, sources, destinations, distances, seconds):
+        """Append column values of consecutive rows with ids from first_id"""
+        if not distances:
+            return
+        codes = self._pair_codes
+        labels = self._pair_labels
+        pairs = list(map(codes.get, zip(sources, destinations)))
+        if None in pairs:
+            for i, key in enumerate(zip(sources, destinations)):
+                if pairs[i] is None:
+                    code = codes.get(key)
+                    if code is None:
+                        code = codes[key] = len(labels)
+                        labels.append(key)
+                    pairs[i] = code
+
+        if self._sorted and (
+            (self._seconds and seconds[0] < self._seconds[-1])
+            or any(map(int.__gt__, seconds, seconds[1:]))
+        ):
+            self._sorted = False
+
+        buckets = self._bucket_column(distances)
+        self._seconds.extend(seconds)
+        self._distances.extend(distances)
+        self._buckets.extend(buckets)
+        self._pairs.extend(pairs)
+
+        self._total_km += math.fsum(distances)
+        self._min_km = min(self._min_km, min(distances))
+        self._max_km = max(self._max_km, max(distances))
+        self._bucket_counts.update(buckets)
+        self._pair_counts.update(pairs)
+        self._hour_counts.update(map((3600).__rfloordiv__, seconds))
+        if self._first_id is None:
+            self._first_id = first_id
+        self._last_id = first_id + len(distances) - 1
+
+    def _catch_up(self):
+        """Append rows committed after the last id in the snapshot"""
+        for chunk in self.db.iter_stats_rows(after_id=self._last_id):
+            ids, sources, destinations, distances, seconds = zip(*chunk)
+            # NULL timestamps (never written by the app) count as the epoch
+            if None in seconds:
+                seconds = [value or 0 for value in seconds]
+            self._append(ids[0], sources, destinations, distances, seconds)
+
+    def _on_saved(self, first_id: int, rows: List[tuple]):
+        # Never block the writing thread behind a load or a stats call: rows
+        # skipped here are still in the database and the next refresh() reads them
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if not rows:
+                # History cleared: reload on next use
+                self._loaded = False
+                self._reset()
+                return
+            last_id = first_id + len(rows) - 1
+            if not self._loaded or last_id <= self._last_id:
+                # Not loaded yet, or already read by a catch-up
+                return
+            if first_id > self._last_id + 1:
+                # Another writer's rows are missing in between; refresh() reads them all
+                return
+            rows = rows[self._last_id + 1 - first_id:]
+            self._append(
+                self._last_id + 1,
+                [row[0] for row in rows],
+                [row[1] for row in rows],
+                [row[6] for row in rows],
+                [int(time.time())] * len(rows)
+            )
+        finally:
+            self._lock.release()
+
+    def refresh(self):
+        """
+        Bring the snapshot up to date with the database
+
+        Loads it on first use, reads rows other processes have added, and
+        reloads after history was cleared elsewhere.
+        """
+        min_id, max_id = self.db.get_id_range()
+        with self._lock:
+            if self._loaded and (
+                max_id is None and self._last_id
+                or min_id is not None and self._first_id is not None and min_id > self._first_id
+            ):
+                logger.info("Query history was cleared, reloading analytics snapshot")
+                self._loaded = False
+                self._reset()
+            if not self._loaded:
+                start = time.perf_counter()
+                self._catch_up()
+                self._loaded = True
+                logger.info(f"Loaded {len(self)} queries into the analytics snapshot in {time.perf_counter() - start:.1f}s")
+            elif max_id is not None and max_id > self._last_id:
+                self._catch_up()
+
+    @traced('analytics.stats')
+    def stats(
+        self,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        top: int = 10,
+        percentiles=(50, 90, 95, 99)
+    ) -> Dict:
+        """
+        Aggregate the history, optionally within a time range
+
+        Args:
+            since: Only count queries at or after this timestamp ('YYYY-MM-DD HH:MM:SS')
+            until: Only count queries before this timestamp ('YYYY-MM-DD HH:MM:SS')
+            top: Number of most frequent source/destination pairs
+            percentiles: Distance percentiles to report (0-100)
+
+        Returns:
+            Dictionary with count, distance_km (min, max, mean and
+            percentiles), top_pairs and per_hour counts
+        """
+        self.refresh()
+        with self._lock:
+            np = _numpy()
+            if not len(self):
+                result = self._result(0, None, None, None, {}, [], [])
+            elif since is None and until is None:
+                result = self._stats_totals(top, percentiles)
+            elif np is not None:
+                result = self._stats_numpy(np, *self._range(since, until, np), top, percentiles)
+            else:
+                result = self._stats_python(*self._range(since, until, np), top, percentiles)
+        logger.info(f"Computed stats over {result['count']} queries")
+        return result
+
+    @staticmethod
+    def _epoch(timestamp: Optional[str]) -> Optional[int]:
+        if timestamp is None:
+            return None
+        return calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+
+    def _range(self, since: Optional[str], until: Optional[str], np):
+        """Rows in the time range: a [lo, hi) slice, plus a row mask when timestamps are unordered"""
+        start, end = self._epoch(since), self._epoch(until)
+        lo, hi = 0, len(self)
+        if start is None and end is None:
+            return lo, hi, None
+        if self._sorted:
+            if start is not None:
+                lo = bisect.bisect_left(self._seconds, start)
+            if end is not None:
+                hi = bisect.bisect_left(self._seconds, end)
+            return lo, max(lo, hi), None
+        start = start if start is not None else -2 ** 63
+        end = end if end is not None else 2 ** 63 - 1
+        if np is not None:
+            seconds = np.frombuffer(self._seconds, dtype=np.int64)
+            return lo, hi, (seconds >= start) & (seconds < end)
+        return lo, hi, [start <= value < end for value in self._seconds]
+
+    def _percentiles(self, bucket_counts, count: int, percentiles, low: float, high: float) -> Dict:
+        """Nearest-rank percentiles from histogram bucket counts, clamped to the exact min/max"""
+        cumulative = 0
+        ranks = sorted((max(math.ceil(p / 100 * count), 1), p) for p in percentiles)
+        values = {}
+        position = 0
+        for bucket, bucket_count in enumerate(bucket_counts):
+            cumulative += bucket_count
+            while position < len(ranks) and ranks[position][0] <= cumulative:
+                value = min(max(self._bucket_value(bucket), low), high)
+                values[f"p{ranks[position][1]:g}"] = round(value, 2)
+                position += 1
+            if position == len(ranks):
+                break
+        return {f"p{p:g}": values[f"p{p:g}"] for p in percentiles}
+
+    def _result(self, count: int, low, high, total, percentiles: Dict, top_pairs, per_hour) -> Dict:
+        return {
+            'count': count,
+            'distance_km': {
+                'min': round(low, 2),
+                'max': round(high, 2),
+                'mean': round(total / count, 2),
+                'percentiles': percentiles,
+            } if count else None,
+            'top_pairs': [
+                {'source': self._pair_labels[code][0], 'destination': self._pair_labels[code][1], 'count': n}
+                for code, n in top_pairs
+            ],
+            'per_hour': [
+                {'hour': time.strftime('%Y-%m-%d %H:00:00', time.gmtime(hour * 3600)), 'count': n}
+                for hour, n in per_hour
+            ],
+        }
+
+    def _stats_totals(self, top: int, percentiles) -> Dict:
+        """Whole-history stats from the running totals (no pass over the columns)"""
+        count = len(self)
+        buckets = self._bucket_counts
+        percentile_values = self._percentiles(
+            [buckets.get(bucket, 0) for bucket in range(max(buckets) + 1)],
+            count, percentiles, self._min_km, self._max_km
+        )
+        # Ties keep insertion order, which is pair code order
+        top_pairs = self._pair_counts.most_common(top)
+        per_hour = sorted(self._hour_counts.items())
+        return self._result(count, self._min_km, self._max_km, self._total_km, percentile_values, top_pairs, per_hour)
+
+    def _stats_numpy(self, np, lo: int, hi: int, mask, top: int, percentiles) -> Dict:
+        # Zero-copy views; they must not outlive the lock (arrays cannot grow while viewed)
+        seconds = np.frombuffer(self._seconds, dtype=np.int64)[lo:hi]
+        distances = np.frombuffer(self._distances, dtype=np.float64)[lo:hi]
+        buckets = np.frombuffer(self._buckets, dtype=np.int16)[lo:hi]
+        pairs = np.frombuffer(self._pairs, dtype=np.int32)[lo:hi]
+        if mask is not None:
+            seconds, distances, buckets, pairs = seconds[mask], distances[mask], buckets[mask], pairs[mask]
+
+        count = len(distances)
+        if not count:
+            return self._result(0, None, None, None, {}, [], [])
+
+        low, high = float(distances.min()), float(distances.max())
+        total = float(distances.sum())
+        percentile_values = self._percentiles(np.bincount(buckets).tolist(), count, percentiles, low, high)
+
+        pair_counts = np.bincount(pairs)
+        top = min(top, np.count_nonzero(pair_counts))
+        candidates = []
+        if top:
+            # Ties at the cut go to the pairs seen first, as in the Python path
+            kth = np.partition(pair_counts, -top)[-top]
+            above = np.flatnonzero(pair_counts > kth)
+            candidates = np.concatenate((above, np.flatnonzero(pair_counts == kth)[:top - len(above)]))
+        top_pairs = sorted(((int(code), int(pair_counts[code])) for code in candidates), key=lambda item: (-item[1], item[0]))
+
+        hours = seconds // 3600
+        if self._sorted:
+            # Sorted: one pass over run boundaries instead of a sort
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(hours)) + 1))
+            per_hour = zip(hours[starts].tolist(), np.diff(np.append(starts, len(hours))).tolist())
+        else:
+            unique, counts = np.unique(hours, return_counts=True)
+            per_hour = zip(unique.tolist(), counts.tolist())
+
+        return self._result(count, low, high, total, percentile_values, top_pairs, per_hour)
+
+    def _stats_python(self, lo: int, hi: int, mask, top: int, percentiles) -> Dict:
+        rows = range(lo, hi) if mask is None else [i for i in range(lo, hi) if mask[i]]
+        count = len(rows)
+        if not count:
+            return self._result(0, None, None, None, {}, [], [])
+
+        distances = [self._distances[i] for i in rows]
+        buckets = Counter(self._buckets[i] for i in rows)
+        bucket_counts = [buckets.get(bucket, 0) for bucket in range(max(buckets) + 1)]
+        low, high = min(distances), max(distances)
+        percentile_values = self._percentiles(bucket_counts, count, percentiles, low, high)
+
+        pair_counts = Counter(self._pairs[i] for i in rows)
+        top_pairs = sorted(pair_counts.items(), key=lambda item: (-item[1], item[0]))[:top]
+        per_hour = sorted(Counter(self._seconds[i] // 3600 for i in rows).items())
+
+        return self._result(count, low, high, math.fsum(distances), percentile_values, top_pairs, per_hour)
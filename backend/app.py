@@ -9,20 +9,50 @@ import logging
 
 from config import Config
 from routes import api
+from serialization import FastJSONProvider
+import services as app_services
+from tracing import span
 
+_logging_configured = False
 
-def create_app(config=None):
+
+class TracedJSONProvider(FastJSONProvider):
+    """JSON provider that records response serialization as a trace span"""
+    
+    def response(self, *args, **kwargs):
+        with span('serialize'):
+            return super().response(*args, **kwargs)
+
+
+def configure_logging():
+    """Configure the root logger once per process"""
+    global _logging_configured
+    if _logging_configured:
+        return
+    logging.basicConfig(
+        level=getattr(logging, Config.LOG_LEVEL),
+        format=Config.LOG_FORMAT
+    )
+    _logging_configured = True
+
+
+def create_app(config=None, services=None):
     """
     Application factory for creating Flask app
     
+    Services (database, caches, geocoder, history writer) are attached to
+    the app and created on first use, so building the app is cheap.
+    
     Args:
         config: Optional configuration object
+        services: Optional Services to use instead of a new set
         
     Returns:
         Configured Flask application
     """
     # Create Flask app
     app = Flask(__name__)
+    app.json = TracedJSONProvider(app)
     
     # Load configuration
     if config:
@@ -31,10 +61,7 @@ def create_app(config=None):
         app.config.from_object(Config)
     
     # Configure logging
-    logging.basicConfig(
-        level=getattr(logging, Config.LOG_LEVEL),
-        format=Config.LOG_FORMAT
-    )
+    configure_logging()
     
     logger = logging.getLogger(__name__)
     logger.info("Initializing Distance Calculator API")
@@ -42,6 +69,9 @@ def create_app(config=None):
     # Enable CORS
     CORS(app)
     
+    # Attach services (created lazily)
+    app_services.init_app(app, services)
+    
     # Register blueprints
     app.register_blueprint(api)
     
@@ -50,6 +80,27 @@ def create_app(config=None):
     return app
 
 
+def create_asgi_app(config=None, services=None):
+    """
+    Application factory for the async (ASGI) execution mode
+    
+    calculate-distance geocodes source and destination concurrently and
+    saves the query after responding; other routes are served by the
+    Flask app on worker threads. Run with an ASGI server, e.g.
+    `uvicorn --factory app:create_asgi_app`.
+    
+    Args:
+        config: Optional configuration object
+        services: Optional Services to use instead of a new set
+        
+    Returns:
+        ASGI application
+    """
+    from asgi import AsgiApp
+    
+    return AsgiApp(create_app(config, services))
+
+
 def main():
     """Main entry point for running the application"""
     app = create_app()
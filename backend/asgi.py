@@ -0,0 +1,185 @@
+"""
+ASGI application
+Serves calculate-distance on the event loop and every other route through
+the Flask app on worker threads
+"""
+
+import asyncio
+import json
+import logging
+from typing import Callable
+
+from a2wsgi import WSGIMiddleware
+
+import routes
+from config import Config
+from geocoding import AsyncGeocoder, GeocodingError
+from metrics import REQUEST_SECONDS, count_error, timed
+from services import get_services
+from tracing import finish_trace, span, start_trace
+from utils import ResponseFormatter
+from validation import Validator, ValidationError
+
+logger = logging.getLogger(__name__)
+
+
+class AsgiApp:
+    """
+    ASGI front end for the Flask app
+
+    POST /api/calculate-distance is handled natively: source and destination
+    are geocoded concurrently through an AsyncGeocoder, the response is sent
+    as soon as the distance is known and the query is saved afterwards.
+    All other requests run the Flask app on a worker thread, including
+    streaming responses.
+    """
+
+    def __init__(self, wsgi_app: Callable, geocoder: AsyncGeocoder = None):
+        """
+        Args:
+            wsgi_app: Flask application from create_app
+            geocoder: Async geocoder used by the native routes (by default
+                      one wrapping the app's geocoder, created on first use)
+        """
+        self.wsgi_app = wsgi_app
+        # Runs the Flask app, including streamed responses, on a thread pool
+        self.wsgi = WSGIMiddleware(wsgi_app, workers=Config.SERVER_THREADS)
+        self.services = get_services(wsgi_app)
+        self._geocoder = geocoder
+        self.routes = {
+            ('POST', '/api/calculate-distance'): timed(
+                REQUEST_SECONDS.labels('api.calculate_distance')
+            )(self.calculate_distance),
+        }
+
+    @property
+    def geocoder(self) -> AsyncGeocoder:
+        if self._geocoder is None:
+            self._geocoder = AsyncGeocoder(self.services.geocoder)
+        return self._geocoder
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        handler = self.routes.get((scope['method'], scope['path']))
+        if handler is None:
+            await self.wsgi(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        trace = start_trace(f"{scope['method']} {scope['path']}")
+        try:
+            payload, status, after_response = await handler(body)
+            await _send_json(scope, send, self.wsgi_app.json, payload, status)
+        finally:
+            finish_trace(trace)
+        if after_response is not None:
+            await after_response()
+
+    async def calculate_distance(self, body: bytes):
+        """
+        Async counterpart of routes.calculate_distance
+
+        Returns:
+            Tuple of (response_dict, status_code, coroutine function to run
+            after the response has been sent, or None)
+        """
+        try:
+            try:
+                data = json.loads(body) if body else None
+            except ValueError:
+                data = None
+
+            if not data or not isinstance(data, dict):
+                logger.warning("No data provided in request")
+                return (*ResponseFormatter.format_error_response('No data provided', 400), None)
+
+            source, destination = routes._request_addresses(data)
+
+            # The first use of the pair cache may open the database
+            cached = await asyncio.to_thread(routes._cached_distance, self.services, source, destination)
+            if cached is not None:
+                # Not saved again, as in the Flask route
+                return (*ResponseFormatter.format_success_response(cached, 200), None)
+
+            try:
+                source, destination = Validator.validate_addresses(source, destination)
+            except ValidationError as e:
+                count_error(e)
+                logger.warning(f"Validation error: {str(e)}")
+                return (*ResponseFormatter.format_error_response(str(e), 400), None)
+
+            # Geocode both addresses concurrently
+            source_coords, dest_coords = await asyncio.gather(
+                self.geocoder.geocode(source),
+                self.geocoder.geocode(destination),
+                return_exceptions=True
+            )
+            for label, result in (('source', source_coords), ('destination', dest_coords)):
+                if isinstance(result, GeocodingError):
+                    count_error(result)
+                    logger.error(f"Failed to geocode {label}: {str(result)}")
+                    return (*ResponseFormatter.format_error_response(str(result), 404), None)
+                if isinstance(result, BaseException):
+                    raise result
+
+            response, row = routes._distance_response(
+                self.services, source, destination, source_coords, dest_coords
+            )
+            return (*ResponseFormatter.format_success_response(response, 200), self._saver(row))
+
+        except Exception as e:
+            count_error(e)
+            logger.error(f"Unexpected error in calculate_distance: {str(e)}")
+            return (*ResponseFormatter.format_error_response(
+                'An unexpected error occurred. Please try again.', 500
+            ), None)
+
+    def _saver(self, row: tuple):
+        """Persistence step run after the response, off the event loop"""
+        async def save():
+            await asyncio.to_thread(routes._save_query, self.services, row)
+        return save
+
+    async def _lifespan(self, receive: Callable, send: Callable):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._geocoder is not None:
+                    await self._geocoder.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _read_body(receive: Callable) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+async def _send_json(scope: dict, send: Callable, provider, payload: dict, status: int):
+    # Same encoder as the Flask routes
+    with span('serialize'):
+        body = provider.encode(payload)
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode('latin-1')),
+    ]
+    # Mirror flask-cors, which allows any origin by default
+    if any(name == b'origin' for name, _ in scope.get('headers', ())):
+        headers.append((b'access-control-allow-origin', b'*'))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
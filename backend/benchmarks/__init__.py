@@ -0,0 +1,5 @@
+"""
+Performance benchmarks for the backend
+
+Run from the backend directory, e.g. ``python -m benchmarks.haversine``
+"""
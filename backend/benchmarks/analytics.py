@@ -0,0 +1,105 @@
+"""
+History analytics benchmark
+
+Fills a queries table (10M rows by default) and compares the aggregates
+of /api/stats computed by SQL against the table with the same aggregates
+from the in-memory columnar snapshot (analytics.HistorySnapshot), over
+the whole history and over one day. Also reports how long the snapshot
+takes to load and how much memory its columns use.
+
+Usage:
+    python -m benchmarks.analytics [--rows 10000000] [--db /tmp/history-bench.db]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from analytics import HistorySnapshot
+from benchmarks.history import _timestamp, _timed, fill
+from database import Database
+
+SQL_CASES = {
+    'percentiles': '''
+        SELECT distance_km FROM queries {where}
+        ORDER BY distance_km LIMIT 1 OFFSET (SELECT COUNT(*) * 95 / 100 FROM queries {where})
+    ''',
+    'top pairs': '''
+        SELECT source_address, destination_address, COUNT(*) AS n FROM queries {where}
+        GROUP BY source_address, destination_address ORDER BY n DESC LIMIT 10
+    ''',
+    'per hour': '''
+        SELECT strftime('%Y-%m-%d %H:00:00', timestamp) AS hour, COUNT(*) FROM queries {where}
+        GROUP BY hour
+    ''',
+}
+
+
+def _sql_seconds(db: Database, where: str, params: tuple, repeat: int) -> float:
+    """Best time to run every SQL aggregate once"""
+    def run_all():
+        with db.get_connection() as conn:
+            for sql in SQL_CASES.values():
+                query_params = params * sql.count('{where}') if where else ()
+                conn.execute(sql.format(where=where), query_params).fetchall()
+    return _timed(run_all, repeat)
+
+
+def run(db: Database, rows: int, repeat: int = 3):
+    """
+    Run the benchmark cases
+
+    Args:
+        db: Database to fill (reused if it already has the rows)
+        rows: Rows in the table
+        repeat: Runs per case (best is reported)
+
+    Returns:
+        Dictionary with load seconds, snapshot MB and a list of
+        (case, sql ms, snapshot ms) tuples
+    """
+    fill(db, rows)
+
+    snapshot = HistorySnapshot(db)
+    start = time.perf_counter()
+    snapshot.refresh()
+    load_seconds = time.perf_counter() - start
+    columns = (snapshot._seconds, snapshot._distances, snapshot._buckets, snapshot._pairs)
+    megabytes = sum(len(column) * column.itemsize for column in columns) / 1e6
+
+    # One day in the middle of the history
+    since = _timestamp(rows // 2)
+    until = _timestamp(rows // 2 + 86400)
+    cases = [('whole history', '', (), {}), ('one day', 'WHERE timestamp >= ? AND timestamp < ?', (since, until),
+                                             {'since': since, 'until': until})]
+    results = []
+    for name, where, params, kwargs in cases:
+        sql = _sql_seconds(db, where, params, repeat)
+        columnar = _timed(lambda: snapshot.stats(**kwargs), repeat)
+        results.append((name, sql * 1000, columnar * 1000))
+    return {'load_seconds': load_seconds, 'snapshot_mb': megabytes, 'cases': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--db', help='database file to fill (default: a temporary file)')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(args.db or os.path.join(tmp, 'history-bench.db'))
+        result = run(db, args.rows)
+        db.close()
+
+    print(f"snapshot load: {result['load_seconds']:.1f} s, columns: {result['snapshot_mb']:.0f} MB")
+    print(f"{'case':<16}{'SQL ms':>12}{'snapshot ms':>14}{'speedup':>10}")
+    for name, sql_ms, snapshot_ms in result['cases']:
+        print(f"{name:<16}{sql_ms:>12.1f}{snapshot_ms:>14.2f}{sql_ms / snapshot_ms:>9.0f}x")
+
+
+if __name__ == '__main__':
+    main()
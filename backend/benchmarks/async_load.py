@@ -0,0 +1,187 @@
+"""
+Async pipeline load test
+
+Runs calculate-distance against a local mock Nominatim with fixed latency
+and compares one synchronous worker (werkzeug, single thread), a threaded
+werkzeug server, and one ASGI worker (uvicorn running create_asgi_app).
+Every request uses fresh addresses so all geocodes go upstream; the
+mock's peak number of active requests shows how many lookups one worker
+keeps in flight.
+
+Requires aiohttp and uvicorn.
+
+Usage:
+    python -m benchmarks.async_load [--requests 200] [--concurrency 1 16 64] [--latency 0.05]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+
+import aiohttp
+import requests
+
+from benchmarks.mock_nominatim import MockNominatimServer
+from config import Config
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+def _serve_mock(port: int, latency: float, failure_rate: float = 0.0):
+    MockNominatimServer(port=port, latency=latency, failure_rate=failure_rate)._server.serve_forever()
+
+
+def _serve_app(mode: str, port: int, mock_url: str, tmp: str, pool_size: int):
+    # Services read Config when the first request creates them; set it before serving
+    Config.NOMINATIM_BASE_URL = mock_url
+    Config.NOMINATIM_RATE_LIMIT = 0
+    Config.NOMINATIM_POOL_SIZE = pool_size
+    Config.DATABASE_NAME = os.path.join(tmp, f"load-{port}.db")
+    Config.WRITE_BEHIND_SPILL_PATH = os.path.join(tmp, f"load-{port}.spill.jsonl")
+    logging.disable(logging.WARNING)
+
+    from app import create_app, create_asgi_app
+
+    if mode == 'asgi':
+        import uvicorn
+        uvicorn.run(create_asgi_app(), host='127.0.0.1', port=port, log_level='warning')
+    else:
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', port, create_app(), threaded=(mode == 'threaded')).serve_forever()
+
+
+async def _load(port: int, total: int, concurrency: int, tag: str, unique: bool = True):
+    # unique=False sends one pair over and over (served from the pair cache)
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker(session, base_url):
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            n = i if unique else 0
+            start = time.perf_counter()
+            async with session.post(f"{base_url}/api/calculate-distance", json={
+                'source': f"{tag} {n} Source Road", 'destination': f"{tag} {n} Target Road"
+            }) as response:
+                response.raise_for_status()
+                await response.read()
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session, f"http://127.0.0.1:{port}") for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests_per_second': total / seconds,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def run(total: int, concurrency_levels, latency: float):
+    """
+    Run the load test
+
+    The mock geocoder and the server under test run in their own processes,
+    so neither competes with the load generator for the GIL.
+
+    Args:
+        total: Requests per case
+        concurrency_levels: Iterable of concurrent client counts
+        latency: Mock geocoder latency in seconds
+
+    Returns:
+        List of result dictionaries
+    """
+    modes = {
+        'sync (1 thread)': 'single',
+        'sync (threaded)': 'threaded',
+        'asgi (1 worker)': 'asgi',
+    }
+
+    mock_port = _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock = multiprocessing.Process(target=_serve_mock, args=(mock_port, latency), daemon=True)
+    mock.start()
+    _wait_for_port(mock_port)
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for case, (mode, kind) in enumerate(modes.items()):
+                for concurrency in concurrency_levels:
+                    port = _free_port()
+                    server = multiprocessing.Process(
+                        target=_serve_app,
+                        args=(kind, port, mock_url, tmp, max(concurrency_levels) * 2),
+                        daemon=True
+                    )
+                    server.start()
+                    _wait_for_port(port)
+                    requests.get(f"{mock_url}/_stats", params={'reset': 1})
+
+                    result = asyncio.run(_load(port, total, concurrency, f"Case {case} {concurrency}"))
+
+                    server.terminate()
+                    server.join()
+                    upstream = requests.get(f"{mock_url}/_stats").json()
+                    result.update({
+                        'mode': mode,
+                        'concurrency': concurrency,
+                        'upstream_in_flight': upstream['max_active'],
+                    })
+                    results.append(result)
+    finally:
+        mock.terminate()
+        mock.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--latency', type=float, default=0.05, help='mock geocoder seconds per request')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    print(f"{'mode':<18}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'upstream in flight':>20}")
+    for result in run(args.requests, args.concurrency, args.latency):
+        print(
+            f"{result['mode']:<18}{result['concurrency']:>8}{result['requests_per_second']:>10.1f}"
+            f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['upstream_in_flight']:>20}"
+        )
+
+
+if __name__ == '__main__':
+    main()
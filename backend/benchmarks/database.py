@@ -0,0 +1,113 @@
+"""
+Database write benchmark
+
+Compares the previous connect-per-call behaviour (new sqlite3 connection
+and rollback journal for every save_query) with the pooled thread-local
+connections in WAL mode, at 1, 8 and 32 concurrent writers.
+
+Usage:
+    python -m benchmarks.database [--writers 1 8 32] [--writes 2000]
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from database import Database
+
+
+class ConnectPerCallDatabase(Database):
+    """Database with the original open/close-per-call connection handling"""
+
+    @contextmanager
+    def get_connection(self):
+        conn = sqlite3.connect(self.db_name, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+def _write(db: Database, count: int):
+    for i in range(count):
+        db.save_query(
+            f"Source {i}", f"Destination {i}",
+            40.7128, -74.0060, 34.0522, -118.2437,
+            3935.75, 2445.56
+        )
+
+
+def _run_case(db_class, writers: int, writes: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = db_class(os.path.join(tmp, 'bench.db'))
+        per_writer = writes // writers
+        threads = [threading.Thread(target=_write, args=(db, per_writer)) for _ in range(writers)]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+        if hasattr(db, 'close'):
+            db.close()
+
+    total = per_writer * writers
+    return {
+        'writers': writers,
+        'writes': total,
+        'seconds': seconds,
+        'writes_per_second': total / seconds,
+    }
+
+
+def run(writer_counts, writes: int):
+    """
+    Run the benchmark
+
+    Args:
+        writer_counts: Iterable of concurrent writer thread counts
+        writes: Total save_query calls per case
+
+    Returns:
+        List of result dictionaries
+    """
+    results = []
+    for writers in writer_counts:
+        for mode, db_class in (('connect_per_call', ConnectPerCallDatabase), ('pooled_wal', Database)):
+            result = _run_case(db_class, writers, writes)
+            result['mode'] = mode
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writers', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--writes', type=int, default=2000, help='total writes per case')
+    args = parser.parse_args()
+
+    # Suppress per-insert logging so it does not dominate the measurement
+    logging.disable(logging.INFO)
+
+    print(f"{'writers':>8}  {'mode':<18}{'seconds':>10}  {'writes/s':>10}")
+    for result in run(args.writers, args.writes):
+        print(
+            f"{result['writers']:>8}  {result['mode']:<18}"
+            f"{result['seconds']:>10.3f}  {result['writes_per_second']:>10,.0f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
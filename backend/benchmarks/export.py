@@ -0,0 +1,115 @@
+"""
+History export benchmark
+
+Fills a queries table (2M rows by default) and streams exports of growing
+size through /api/history/export in every available format, each in a
+fresh process, reporting rows/s, output size and peak RSS. For
+comparison, the "list" case builds the export the way /api/history builds
+a page: all rows fetched, converted to dicts and encoded as one JSON
+document. Streaming formats should keep the same peak RSS at every size.
+
+Usage:
+    python -m benchmarks.export [--rows 2000000] [--db /tmp/export-bench.db]
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.history import fill
+from database import Database
+import export
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child; exports the rows above after_id and prints the result
+CHILD = '''
+import json, resource, sys, time
+import logging
+logging.disable(logging.WARNING)
+from database import Database
+from services import Services
+from app import create_app
+import records
+
+db_path, fmt, after_id = sys.argv[1], sys.argv[2], int(sys.argv[3])
+db = Database(db_path)
+client = create_app(services=Services(db=db)).test_client()
+start = time.perf_counter()
+size = 0
+if fmt == 'list':
+    with db.get_connection() as conn:
+        rows = conn.execute('SELECT * FROM queries WHERE id > ? ORDER BY id', (after_id,)).fetchall()
+    size = len(records.dumps({'queries': [records.QueryRecord(*row) for row in rows]}))
+else:
+    response = client.get(f'/api/history/export?format={fmt}&after_id={after_id}', buffered=False)
+    for piece in response.response:
+        size += len(piece)
+    response.close()
+seconds = time.perf_counter() - start
+print(json.dumps({
+    'seconds': seconds, 'bytes': size,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+}))
+'''
+
+
+def _run_child(db_path: str, fmt: str, after_id: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, db_path, fmt, str(after_id)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(db_path: str, rows: int):
+    """
+    Run the benchmark cases
+
+    Args:
+        db_path: Database to fill (reused if it already has the rows)
+        rows: Rows in the table; exports cover 1%, 10% and all of them
+
+    Returns:
+        List of result dictionaries (format, rows, rows_per_second, mb, max_rss_mb)
+    """
+    fill(Database(db_path), rows)
+    results = []
+    for fmt in ['list'] + export.available_formats():
+        for exported in (rows // 100, rows // 10, rows):
+            result = _run_child(db_path, fmt, rows - exported)
+            results.append({
+                'format': fmt,
+                'rows': exported,
+                'rows_per_second': exported / result['seconds'],
+                'mb': result['bytes'] / 1e6,
+                'max_rss_mb': result['max_rss_mb'],
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--db', help='database file to fill (default: a temporary file)')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, 'export-bench.db')
+        results = run(db_path, args.rows)
+        print(f"{'format':<10}{'rows':>12}{'rows/s':>14}{'output MB':>12}{'peak RSS MB':>14}")
+        for result in results:
+            print(
+                f"{result['format']:<10}{result['rows']:>12,}{result['rows_per_second']:>14,.0f}"
+                f"{result['mb']:>12.1f}{result['max_rss_mb']:>14.1f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
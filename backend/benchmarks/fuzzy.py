@@ -0,0 +1,104 @@
+"""
+Fuzzy address index benchmark
+
+Fills a FuzzyAddressIndex with synthetic street addresses and times
+exact-canonical hits, near-duplicate hits and misses, reporting mean and
+p99 latency against the configured lookup budget.
+
+Usage:
+    python -m benchmarks.fuzzy [--sizes 1000 10000 100000] [--lookups 5000]
+"""
+
+import argparse
+import logging
+import random
+import time
+
+from cache import FuzzyAddressIndex, GeocodeCache
+from config import Config
+
+
+STREETS = ['Main', 'Oak', 'Maple', 'Cedar', 'Elm', 'Washington', 'Lake', 'Hill', 'Park', 'Pine']
+SUFFIXES = ['Street', 'Avenue', 'Road', 'Boulevard', 'Lane']
+CITIES = ['Springfield', 'Riverside', 'Franklin', 'Greenville', 'Fairview', 'Salem', 'Madison']
+
+
+def make_addresses(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    return list({
+        f"{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(SUFFIXES)}, "
+        f"{rng.choice(CITIES)}, {rng.choice(['CA', 'NY', 'TX', 'IL', 'MA'])}"
+        for _ in range(count)
+    })
+
+
+def _latencies(func, inputs):
+    samples = []
+    for address in inputs:
+        start = time.perf_counter()
+        func(address)
+        samples.append((time.perf_counter() - start) * 1_000_000)
+    samples.sort()
+    return sum(samples) / len(samples), samples[int(len(samples) * 0.99)]
+
+
+def run(sizes, lookups: int):
+    """
+    Run the benchmark
+
+    Args:
+        sizes: Iterable of index sizes
+        lookups: Lookups per case
+
+    Returns:
+        List of result dictionaries with mean and p99 microseconds and the
+        number of lookups that ran out of budget
+    """
+    results = []
+    for size in sizes:
+        addresses = make_addresses(size)
+        geocode_cache = GeocodeCache(max_size=len(addresses))
+        index = FuzzyAddressIndex(geocode_cache, max_size=len(addresses))
+        for address in addresses:
+            geocode_cache.set(address, {'lat': 1.0, 'lon': 2.0})
+            index.add(address)
+
+        rng = random.Random(11)
+        sample = [rng.choice(addresses) for _ in range(lookups)]
+        cases = {
+            'exact (punctuation)': [address.replace(',', '').upper() for address in sample],
+            'near duplicate': [f"{address}, USA" for address in sample],
+            'miss': [address.replace('Street', 'Plaza').replace('Avenue', 'Court') + ' 7' for address in sample],
+        }
+        for name, inputs in cases.items():
+            exceeded = index.stats()['budget_exceeded']
+            mean_us, p99_us = _latencies(index.lookup, inputs)
+            results.append({
+                'size': len(addresses),
+                'case': name,
+                'mean_us': mean_us,
+                'p99_us': p99_us,
+                'over_budget': index.stats()['budget_exceeded'] - exceeded,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--lookups', type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    print(f"lookup budget: {Config.FUZZY_MATCH_BUDGET_MS} ms")
+    print(f"{'size':>8}  {'case':<22}{'mean us':>10}{'p99 us':>10}{'over budget':>13}")
+    for result in run(args.sizes, args.lookups):
+        print(
+            f"{result['size']:>8}  {result['case']:<22}{result['mean_us']:>10.1f}"
+            f"{result['p99_us']:>10.1f}{result['over_budget']:>13}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Gazetteer benchmark
+
+Writes a synthetic GeoNames-style TSV (10M rows by default), builds the
+memory-mapped index, then times opening it and exact/prefix lookups, and
+reports the peak resident memory of the build and of the loaded index.
+
+Usage:
+    python -m benchmarks.gazetteer [--rows 10000000] [--lookups 100000]
+"""
+
+import argparse
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+
+from gazetteer import Gazetteer
+
+
+def write_source(path: str, rows: int, seed: int = 7):
+    """Write rows of GeoNames-formatted places with random names"""
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(rows):
+            name = ''.join(rng.choice(letters) for _ in range(rng.randint(4, 12))).title()
+            fields = [
+                str(i), name, name, '',
+                f"{rng.uniform(-60, 70):.5f}", f"{rng.uniform(-180, 180):.5f}",
+                'P', 'PPL', 'XX', '', '', '', '', '',
+                str(rng.randint(0, 1_000_000)), '', '', 'UTC', '2024-01-01',
+            ]
+            f.write('\t'.join(fields) + '\n')
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _per_lookup_us(func, keys) -> float:
+    start = time.perf_counter()
+    for key in keys:
+        func(key)
+    return (time.perf_counter() - start) / len(keys) * 1_000_000
+
+
+def run(rows: int, lookups: int, tmp: str):
+    """
+    Run the benchmark
+
+    Args:
+        rows: Rows in the synthetic source file
+        lookups: Lookups per case
+        tmp: Directory for the source and index files
+
+    Returns:
+        List of (metric, value, unit) tuples
+    """
+    source = os.path.join(tmp, 'places.tsv')
+    index = os.path.join(tmp, 'places.idx')
+    results = []
+
+    start = time.perf_counter()
+    write_source(source, rows)
+    results.append(('write source', time.perf_counter() - start, 's'))
+
+    start = time.perf_counter()
+    count = Gazetteer.build(source, index)
+    results.append(('build index', time.perf_counter() - start, 's'))
+    results.append(('indexed names', count, ''))
+    results.append(('index size', os.path.getsize(index) / 1024 / 1024, 'MB'))
+    results.append(('peak rss after build', _peak_rss_mb(), 'MB'))
+
+    start = time.perf_counter()
+    gazetteer = Gazetteer(index)
+    results.append(('open index', (time.perf_counter() - start) * 1000, 'ms'))
+
+    # Sample indexed names by taking the first match of random two-letter prefixes
+    rng = random.Random(11)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    samples = [gazetteer.prefix(rng.choice(letters) + rng.choice(letters), 1) for _ in range(1000)]
+    names = [found[0]['name'] for found in samples if found]
+    hits = [rng.choice(names) for _ in range(lookups)]
+    misses = [f"{name}zz" for name in hits]
+    prefixes = [name[:3] for name in hits]
+
+    results.append(('exact hit', _per_lookup_us(gazetteer.exact, hits), 'us'))
+    results.append(('exact miss', _per_lookup_us(gazetteer.exact, misses), 'us'))
+    results.append(('prefix (10 results)', _per_lookup_us(gazetteer.prefix, prefixes), 'us'))
+    gazetteer.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--lookups', type=int, default=100_000)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for metric, value, unit in run(args.rows, args.lookups, tmp):
+            formatted = f"{value:,}" if isinstance(value, int) else f"{value:,.3f}"
+            print(f"{metric:<24}{formatted:>14} {unit}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Haversine throughput benchmark
+
+Compares the scalar DistanceCalculator.haversine_distance loop with the
+batch haversine_distances engine (NumPy and pure Python fallback).
+
+Usage:
+    python -m benchmarks.haversine [--sizes 1000 1000000 10000000]
+"""
+
+import argparse
+import random
+import time
+from array import array
+
+import utils
+from utils import DistanceCalculator
+
+
+def _coordinates(n: int, seed: int = 42):
+    rng = random.Random(seed)
+    lats = [array('d', (rng.uniform(-90, 90) for _ in range(n))) for _ in range(2)]
+    lons = [array('d', (rng.uniform(-180, 180) for _ in range(n))) for _ in range(2)]
+    return lats[0], lons[0], lats[1], lons[1]
+
+
+def _scalar_loop(src_lats, src_lons, dst_lats, dst_lons):
+    haversine = DistanceCalculator.haversine_distance
+    return [
+        haversine(lat1, lon1, lat2, lon2)
+        for lat1, lon1, lat2, lon2 in zip(src_lats, src_lons, dst_lats, dst_lons)
+    ]
+
+
+def _timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run(sizes):
+    """
+    Run the benchmark
+
+    Args:
+        sizes: Iterable of pair counts
+
+    Returns:
+        List of result dictionaries with throughput in pairs per second
+    """
+    results = []
+
+    for n in sizes:
+        coords = _coordinates(n)
+        timings = {
+            'scalar_loop': _timed(_scalar_loop, *coords),
+            'batch_python': _timed(DistanceCalculator._haversine_python, *coords),
+        }
+        np = utils._numpy()
+        if np is not None:
+            arrays = [np.frombuffer(c, dtype=np.float64) for c in coords]
+            timings['batch_numpy'] = _timed(DistanceCalculator._haversine_numpy, *arrays)
+
+        for engine, seconds in timings.items():
+            results.append({
+                'pairs': n,
+                'engine': engine,
+                'seconds': seconds,
+                'pairs_per_second': n / seconds if seconds else float('inf'),
+            })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 1_000_000, 10_000_000])
+    args = parser.parse_args()
+
+    if utils._numpy() is None:
+        print("NumPy not installed: batch_numpy is skipped")
+
+    print(f"{'pairs':>10}  {'engine':<14}{'seconds':>10}  {'pairs/s':>14}")
+    for result in run(args.sizes):
+        print(
+            f"{result['pairs']:>10}  {result['engine']:<14}"
+            f"{result['seconds']:>10.4f}  {result['pairs_per_second']:>14,.0f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
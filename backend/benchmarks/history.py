@@ -0,0 +1,130 @@
+"""
+History query benchmark
+
+Fills a queries table (10M rows by default) and compares the previous
+unindexed ORDER BY timestamp / OFFSET paging with the indexed keyset
+(before_id/after_id) pagination and filters of Database.get_history.
+
+Usage:
+    python -m benchmarks.history [--rows 10000000] [--db /tmp/history-bench.db]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from database import Database
+
+
+START_EPOCH = 1704067200
+
+FILL_SQL = '''
+    WITH RECURSIVE seq(x) AS (
+        SELECT ? UNION ALL SELECT x + 1 FROM seq WHERE x < ?
+    )
+    INSERT INTO queries
+    (source_address, destination_address, source_lat, source_lon,
+     dest_lat, dest_lon, distance_km, distance_miles, timestamp)
+    SELECT
+        'Source ' || (x % 5000), 'Destination ' || (x % 7000),
+        40.7128, -74.0060, 34.0522, -118.2437, 3935.75, 2445.56,
+        datetime(? + x, 'unixepoch')
+    FROM seq
+'''
+
+LEGACY_SQL = '''
+    SELECT * FROM queries NOT INDEXED
+    ORDER BY timestamp DESC
+    LIMIT ? OFFSET ?
+'''
+
+
+def fill(db: Database, rows: int, chunk: int = 1_000_000):
+    """Insert synthetic rows, one second apart, until the table has `rows` rows"""
+    with db.get_connection() as conn:
+        existing = conn.execute('SELECT COUNT(*) FROM queries').fetchone()[0]
+        conn.execute('PRAGMA synchronous=OFF')
+
+    for start in range(existing + 1, rows + 1, chunk):
+        end = min(start + chunk - 1, rows)
+        with db.get_connection() as conn:
+            conn.execute(FILL_SQL, (start, end, START_EPOCH))
+        print(f"  filled {end:,} rows", flush=True)
+
+
+def _legacy_page(db: Database, offset: int):
+    with db.get_connection() as conn:
+        return conn.execute(LEGACY_SQL, (50, offset)).fetchall()
+
+
+def _timestamp(seconds: int) -> str:
+    moment = datetime.fromtimestamp(START_EPOCH, timezone.utc) + timedelta(seconds=seconds)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _timed(func, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(db: Database, rows: int, repeat: int = 3):
+    """
+    Run the benchmark cases
+
+    Args:
+        db: Filled database
+        rows: Number of rows in the table
+        repeat: Runs per case (best time is reported)
+
+    Returns:
+        List of result dictionaries with milliseconds per page
+    """
+    middle = rows // 2
+    since = _timestamp(middle)
+    until = _timestamp(middle + 3600)
+
+    cases = [
+        ('legacy first page (no index)', lambda: _legacy_page(db, 0), 1),
+        ('legacy middle page (OFFSET)', lambda: _legacy_page(db, middle), 1),
+        ('first page', lambda: db.get_history(50), repeat),
+        ('middle page (before_id)', lambda: db.get_history(50, before_id=middle), repeat),
+        ('middle page (after_id)', lambda: db.get_history(50, after_id=middle), repeat),
+        ('time range (1 hour)', lambda: db.get_history(50, since=since, until=until), repeat),
+        ('address filter (1 in 5000)', lambda: db.get_history(50, address='Source 4999'), repeat),
+    ]
+
+    return [
+        {'case': name, 'rows': rows, 'ms': _timed(func, runs) * 1000}
+        for name, func, runs in cases
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--db', help='database file to fill and reuse (default: temporary)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(args.db or os.path.join(tmp, 'history-bench.db'))
+        print(f"Filling {args.rows:,} rows")
+        fill(db, args.rows)
+
+        print(f"{'case':<32}{'ms':>12}")
+        for result in run(db, args.rows, args.repeat):
+            print(f"{result['case']:<32}{result['ms']:>12.3f}")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Mixed-traffic load generator
+
+Drives POST /api/calculate-distance and GET /api/history at a fixed
+concurrency and reports throughput and latency percentiles per endpoint.
+By default the app is started in its own process against a local mock
+Nominatim with configurable latency and failure rate; pass --url to load
+an already running server instead (its geocoder is whatever it is
+configured with).
+
+Traffic mix:
+
+- history: --history-ratio of the requests fetch the latest history page
+- calculate-distance: the rest; --hot-ratio of them reuse a handful of
+  pairs (pair cache hits), the others use fresh addresses (two geocodes)
+
+The mix is drawn from a seeded generator, so two runs send the same
+sequence of requests. Requires aiohttp (and uvicorn for --server asgi).
+
+Usage:
+    python -m benchmarks.load [--requests 1000] [--concurrency 16] [--history-ratio 0.2]
+                              [--latency 0.05] [--failure-rate 0.05] [--server threaded]
+    python -m benchmarks.load --url http://127.0.0.1:5000
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import random
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+import aiohttp
+import requests
+
+from benchmarks.async_load import _free_port, _serve_app, _serve_mock, _wait_for_port
+
+ENDPOINTS = ('calculate-distance', 'history')
+HOT_PAIRS = 8
+
+
+def plan(total: int, history_ratio: float, hot_ratio: float, seed: int = 42):
+    """
+    Build the request sequence
+
+    Args:
+        total: Number of requests
+        history_ratio: Fraction of history requests
+        hot_ratio: Fraction of calculate-distance requests reusing a hot pair
+        seed: Seed for the mix
+
+    Returns:
+        List of (endpoint, payload) tuples; payload is the JSON body for
+        calculate-distance and the query string for history
+    """
+    rng = random.Random(seed)
+    # Fresh addresses per run, so a long-lived server cannot answer from cache
+    run_id = uuid.uuid4().hex[:8]
+    requests_ = []
+    for i in range(total):
+        if rng.random() < history_ratio:
+            requests_.append(('history', {'limit': 50}))
+        elif rng.random() < hot_ratio:
+            n = rng.randrange(HOT_PAIRS)
+            requests_.append(('calculate-distance', {
+                'source': f"Hot {n} Source Road", 'destination': f"Hot {n} Target Road"
+            }))
+        else:
+            requests_.append(('calculate-distance', {
+                'source': f"{run_id} {i} Source Road", 'destination': f"{run_id} {i} Target Road"
+            }))
+    return requests_
+
+
+def _percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def _send(session, base_url: str, endpoint: str, payload: dict) -> int:
+    if endpoint == 'history':
+        request = session.get(f"{base_url}/api/history", params=payload)
+    else:
+        request = session.post(f"{base_url}/api/calculate-distance", json=payload)
+    async with request as response:
+        await response.read()
+        return response.status
+
+
+async def drive(base_url: str, requests_: list, concurrency: int):
+    """
+    Send the planned requests with `concurrency` clients
+
+    Hot pairs are requested once before the clock starts, so they are
+    measured as cache hits.
+
+    Returns:
+        Tuple of (seconds, {endpoint: sorted latencies}, {endpoint: Counter of statuses})
+    """
+    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+    statuses = {endpoint: Counter() for endpoint in ENDPOINTS}
+    queue = asyncio.Queue()
+    for request in requests_:
+        queue.put_nowait(request)
+
+    async def worker(session):
+        while True:
+            try:
+                endpoint, payload = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                status = await _send(session, base_url, endpoint, payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = 'connection error'
+            latencies[endpoint].append(time.perf_counter() - start)
+            statuses[endpoint][status] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        for n in range(HOT_PAIRS):
+            await _send(session, base_url, 'calculate-distance', {
+                'source': f"Hot {n} Source Road", 'destination': f"Hot {n} Target Road"
+            })
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+
+    for values in latencies.values():
+        values.sort()
+    return seconds, latencies, statuses
+
+
+def summarize(seconds: float, latencies: dict, statuses: dict) -> dict:
+    """
+    Reduce raw latencies and statuses to throughput and percentiles
+
+    Returns:
+        Dictionary with overall requests_per_second and error count, and
+        per endpoint requests, errors, statuses and p50/p95/p99 in ms
+    """
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        values = latencies[endpoint]
+        errors = sum(count for status, count in statuses[endpoint].items() if status != 200)
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'errors': errors,
+            'statuses': {str(status): count for status, count in statuses[endpoint].items()},
+            'p50_ms': _percentile(values, 0.50) * 1000,
+            'p95_ms': _percentile(values, 0.95) * 1000,
+            'p99_ms': _percentile(values, 0.99) * 1000,
+        }
+    total = sum(result['requests'] for result in endpoints.values())
+    return {
+        'seconds': seconds,
+        'requests_per_second': total / seconds if seconds else 0.0,
+        'errors': sum(result['errors'] for result in endpoints.values()),
+        'endpoints': endpoints,
+    }
+
+
+def run(
+    total: int,
+    concurrency: int,
+    history_ratio: float = 0.2,
+    hot_ratio: float = 0.5,
+    latency: float = 0.05,
+    failure_rate: float = 0.0,
+    server: str = 'threaded',
+    url: str = None,
+    seed: int = 42
+) -> dict:
+    """
+    Run the load test
+
+    The mock geocoder and the server under test run in their own processes,
+    so neither competes with the load generator for the GIL.
+
+    Args:
+        total: Requests to send
+        concurrency: Concurrent clients
+        history_ratio: Fraction of history requests
+        hot_ratio: Fraction of calculate-distance requests reusing a hot pair
+        latency: Mock geocoder latency in seconds
+        failure_rate: Fraction of mock geocoder requests answered with 503
+        server: 'threaded' (werkzeug) or 'asgi' (uvicorn)
+        url: Load this running server instead of starting one
+        seed: Seed for the traffic mix and the injected failures
+
+    Returns:
+        Result dictionary from summarize(), plus the upstream request and
+        failure counts when the mock was used
+    """
+    requests_ = plan(total, history_ratio, hot_ratio, seed)
+    if url:
+        return summarize(*asyncio.run(drive(url.rstrip('/'), requests_, concurrency)))
+
+    mock_port = _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock = multiprocessing.Process(target=_serve_mock, args=(mock_port, latency, failure_rate), daemon=True)
+    mock.start()
+    try:
+        _wait_for_port(mock_port)
+        with tempfile.TemporaryDirectory() as tmp:
+            port = _free_port()
+            app = multiprocessing.Process(
+                target=_serve_app, args=(server, port, mock_url, tmp, concurrency * 2), daemon=True
+            )
+            app.start()
+            try:
+                _wait_for_port(port)
+                result = summarize(*asyncio.run(drive(f"http://127.0.0.1:{port}", requests_, concurrency)))
+            finally:
+                app.terminate()
+                app.join()
+        upstream = requests.get(f"{mock_url}/_stats").json()
+        result['upstream'] = {'requests': upstream['requests'], 'failed': upstream['failed']}
+    finally:
+        mock.terminate()
+        mock.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--history-ratio', type=float, default=0.2)
+    parser.add_argument('--hot-ratio', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=0.05, help='mock geocoder seconds per request')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of mock geocoder 503s')
+    parser.add_argument('--server', choices=['threaded', 'asgi'], default='threaded')
+    parser.add_argument('--url', help='load a running server instead of starting one')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    result = run(
+        args.requests, args.concurrency, args.history_ratio, args.hot_ratio,
+        args.latency, args.failure_rate, args.server, args.url, args.seed
+    )
+
+    print(f"{result['requests_per_second']:.1f} req/s over {result['seconds']:.1f} s, {result['errors']} errors")
+    print(f"{'endpoint':<20}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in result['endpoints'].items():
+        print(
+            f"{endpoint:<20}{stats['requests']:>10}{stats['errors']:>8}"
+            f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        )
+    if 'upstream' in result:
+        print(f"mock geocoder: {result['upstream']['requests']} requests, {result['upstream']['failed']} failed (503)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Local stub of the Nominatim search/reverse API
+
+Coordinates are derived deterministically from the query string, so the
+same address always resolves to the same point. Queries containing
+"nowhere" return no results. The first ``failures`` requests are answered
+with 503 to exercise client retries, and after that each request fails
+with probability ``failure_rate`` (seeded, so runs are repeatable). GET
+/_stats reports the request and failure counts and peak concurrency
+(``?reset=1`` restarts the peak).
+
+Usage:
+    python -m benchmarks.mock_nominatim [--port 8089] [--latency 0.05] [--failure-rate 0.05]
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def fake_coordinates(query: str):
+    """
+    Map a query string to stable coordinates
+
+    Args:
+        query: Address string
+
+    Returns:
+        Tuple of (lat, lon)
+    """
+    digest = hashlib.sha1(query.strip().lower().encode('utf-8')).digest()
+    lat = int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF * 170 - 85
+    lon = int.from_bytes(digest[4:8], 'big') / 0xFFFFFFFF * 360 - 180
+    return round(lat, 6), round(lon, 6)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, avoid Nagle/delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server.stub
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/_stats':
+            # Counters for load tests that run the stub in another process
+            with server.lock:
+                body = {
+                    'requests': sum(server.requests.values()),
+                    'failed': server.failed,
+                    'max_active': server.max_active,
+                }
+                if 'reset' in params:
+                    server.max_active = 0
+            self._send(200, body)
+            return
+
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.requests[params.get('q', url.path)] += 1
+
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+
+            with server.lock:
+                fail = server.failures > 0
+                if fail:
+                    server.failures -= 1
+                elif server.failure_rate:
+                    fail = server.rng.random() < server.failure_rate
+                if fail:
+                    server.failed += 1
+            if fail:
+                self._send(503, {'error': 'unavailable'}, {'Retry-After': '0'})
+                return
+
+            if url.path == '/search':
+                query = params.get('q', '')
+                if 'nowhere' in query.lower():
+                    body = []
+                else:
+                    lat, lon = fake_coordinates(query)
+                    body = [{'lat': str(lat), 'lon': str(lon), 'display_name': query}]
+            elif url.path == '/reverse':
+                body = {'display_name': f"{params.get('lat')}, {params.get('lon')}"}
+            else:
+                self._send(404, {'error': 'not found'})
+                return
+
+            self._send(200, body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _send(self, status: int, body, headers: dict = None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The socketserver default backlog of 5 drops connections under load
+    request_queue_size = 128
+
+
+class MockNominatimServer:
+    """Threaded stub server, usable as a context manager"""
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+        failures: int = 0,
+        failure_rate: float = 0.0,
+        seed: int = 42
+    ):
+        self.latency = latency
+        self.failures = failures
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.active = 0
+        self.max_active = 0
+
+        self._server = _Server((host, port), _Handler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per request')
+    parser.add_argument('--failures', type=int, default=0, help='answer the first N requests with 503')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    server = MockNominatimServer(args.host, args.port, args.latency, args.failures, args.failure_rate, args.seed)
+    print(f"Mock Nominatim listening on {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Query record benchmark
+
+Builds and serializes a 100k row query result two ways: the previous
+per-row dict with two nested coordinate dicts encoded by json.dumps, and
+QueryRecord objects encoded by records.dumps. Reports the time and the
+tracemalloc peak of each step and the memory the built rows keep alive.
+
+Usage:
+    python -m benchmarks.records [--rows 100000]
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.history import fill
+from database import Database
+import records
+from records import QueryRecord
+
+SELECT_SQL = '''
+    SELECT id, source_address, destination_address, source_lat, source_lon,
+           dest_lat, dest_lon, distance_km, distance_miles, timestamp
+    FROM queries ORDER BY id LIMIT ?
+'''
+
+
+def _legacy_row_to_dict(row) -> dict:
+    """The per-row conversion Database used before QueryRecord"""
+    return {
+        'id': row[0],
+        'source': row[1],
+        'destination': row[2],
+        'source_coords': {
+            'lat': row[3],
+            'lon': row[4]
+        },
+        'destination_coords': {
+            'lat': row[5],
+            'lon': row[6]
+        },
+        'distance_km': round(row[7], 2),
+        'distance_miles': round(row[8], 2),
+        'timestamp': row[9]
+    }
+
+
+def _legacy_dumps(document: dict) -> str:
+    # Flask's provider defaults for compact output
+    return json.dumps(document, sort_keys=True, separators=(',', ':'))
+
+
+def _measure(func, repeat: int):
+    """Best seconds over `repeat` runs, tracemalloc peak MB and retained MB of one more run"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = func()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, peak / 1e6, retained / 1e6
+
+
+def run(rows: list, repeat: int = 5):
+    """
+    Run the benchmark cases
+
+    Args:
+        rows: Query rows as tuples in QUERY_COLUMNS order
+        repeat: Timed runs per case (best is reported)
+
+    Returns:
+        List of (case, seconds, peak MB, retained MB) tuples
+    """
+    dicts = [_legacy_row_to_dict(row) for row in rows]
+    query_records = [QueryRecord(*row) for row in rows]
+    assert json.loads(records.dumps({'queries': query_records})) == json.loads(_legacy_dumps({'queries': dicts}))
+
+    cases = [
+        ('build dicts', lambda: [_legacy_row_to_dict(row) for row in rows]),
+        ('build records', lambda: [QueryRecord(*row) for row in rows]),
+        ('encode dicts', lambda: _legacy_dumps({'queries': dicts, 'count': len(dicts)})),
+        ('encode records', lambda: records.dumps({'queries': query_records, 'count': len(query_records)})),
+        ('build+encode dicts', lambda: _legacy_dumps({'queries': [_legacy_row_to_dict(row) for row in rows]})),
+        ('build+encode records', lambda: records.dumps({'queries': [QueryRecord(*row) for row in rows]})),
+    ]
+    return [(name, *_measure(func, repeat)) for name, func in cases]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'records-bench.db'))
+        fill(db, args.rows)
+        with db.get_connection() as conn:
+            rows = [tuple(row) for row in conn.execute(SELECT_SQL, (args.rows,))]
+        db.close()
+
+    print(f"{'case':<24}{'ms':>10}{'peak MB':>10}{'retained MB':>14}")
+    for name, seconds, peak, retained in run(rows):
+        print(f"{name:<24}{seconds * 1000:>10.1f}{peak:>10.1f}{retained:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+JSON serialization benchmark
+
+Encodes typical API responses, from /api/health to a 1000x1000 distance
+matrix, with each installed JSON backend (stdlib, orjson, msgspec) and
+reports the time per response. For the large responses it also compares
+encoding the body in one piece with the streamed encoding of long lists
+(FastJSONProvider.iter_encode): time to the first piece, total time and
+tracemalloc peak.
+
+Usage:
+    python -m benchmarks.serialization [--backends json orjson msgspec]
+"""
+
+import argparse
+import logging
+import random
+import timeit
+import tracemalloc
+
+from flask import Flask
+
+from records import QueryRecord
+from serialization import BACKENDS, FastJSONProvider, load_encoder
+from utils import ResponseFormatter
+
+
+def _coords(rng: random.Random) -> dict:
+    return {'lat': rng.uniform(-90, 90), 'lon': rng.uniform(-180, 180)}
+
+
+def _distance(rng: random.Random, index: int) -> dict:
+    km = rng.uniform(1, 20000)
+    return ResponseFormatter.format_distance_response(
+        f'{index} Main Street, Springfield', f'{index} Market Street, Shelbyville',
+        _coords(rng), _coords(rng), km, km * 0.621371
+    )
+
+
+def _record(rng: random.Random, index: int) -> QueryRecord:
+    km = rng.uniform(1, 20000)
+    return QueryRecord(
+        index, f'{index} Main Street, Springfield', f'{index} Market Street, Shelbyville',
+        *_coords(rng).values(), *_coords(rng).values(), km, km * 0.621371, '2024-01-01 12:00:00'
+    )
+
+
+def _matrix(rng: random.Random, size: int) -> dict:
+    addresses = [f'{index} Main Street, Springfield' for index in range(size)]
+    distances = [[round(rng.uniform(0, 20000), 2) for _ in range(size)] for _ in range(size)]
+    return ResponseFormatter.format_matrix_response(addresses, addresses, 'km', distances, [])
+
+
+def documents(seed: int = 42) -> list:
+    """(case, response document) pairs, smallest first"""
+    rng = random.Random(seed)
+    return [
+        ('health', {'status': 'healthy'}),
+        ('calculate-distance', _distance(rng, 0)),
+        ('history (100)', ResponseFormatter.format_history_response([_record(rng, i) for i in range(100)], 100)),
+        ('batch (1000)', ResponseFormatter.format_batch_response(
+            [{'index': i, **_distance(rng, i)} for i in range(1000)]
+        )),
+        ('matrix (100x100)', _matrix(rng, 100)),
+        ('matrix (1000x1000)', _matrix(rng, 1000)),
+    ]
+
+
+def _per_call(func) -> float:
+    """Best seconds per call over 5 timed batches of at least 50 ms"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, number // 4)
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def _first_piece(provider: FastJSONProvider, document):
+    next(provider.iter_encode(document))
+
+
+def _drain(provider: FastJSONProvider, document):
+    for _ in provider.iter_encode(document):
+        pass
+
+
+def _peak(func) -> float:
+    """tracemalloc peak MB of one call (timed separately, tracing slows the stdlib encoder)"""
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def _streaming(provider: FastJSONProvider, document) -> tuple:
+    """Whole body seconds and peak MB, then first piece seconds, streamed seconds and peak MB"""
+    whole = lambda: provider.encode(document)
+    streamed = lambda: _drain(provider, document)
+    return (
+        _per_call(whole), _peak(whole),
+        _per_call(lambda: _first_piece(provider, document)), _per_call(streamed), _peak(streamed)
+    )
+
+
+def run(backends) -> dict:
+    """
+    Run the benchmark cases
+
+    Args:
+        backends: Backend names to compare (those not installed are skipped)
+
+    Returns:
+        Dictionary with 'encode' (case, size in bytes, {backend: seconds})
+        tuples and 'streaming' (case, backend, whole seconds, whole peak
+        MB, first piece seconds, streamed seconds, streamed peak MB) tuples
+    """
+    app = Flask(__name__)
+    providers = {}
+    for name in backends:
+        provider = FastJSONProvider(app, name)
+        if provider.backend == name:
+            providers[name] = provider
+
+    cases = documents()
+    encode = []
+    for case, document in cases:
+        size = len(providers.get('json', next(iter(providers.values()))).encode(document))
+        encode.append((case, size, {
+            name: _per_call(lambda: provider.encode(document)) for name, provider in providers.items()
+        }))
+
+    streaming = []
+    for case, document in cases:
+        for name, provider in providers.items():
+            if provider.streamable(document):
+                streaming.append((case, name, *_streaming(provider, document)))
+    return {'encode': encode, 'streaming': streaming}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=['json', 'orjson', 'msgspec'], choices=BACKENDS)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    installed = [name for name in args.backends if load_encoder(name)[0] == name]
+    result = run(installed)
+
+    print(f"{'response':<22}{'KB':>10}" + ''.join(f"{name + ' ms':>14}" for name in installed))
+    for case, size, seconds in result['encode']:
+        print(f"{case:<22}{size / 1e3:>10.1f}" + ''.join(f"{seconds[name] * 1000:>14.3f}" for name in installed))
+
+    print()
+    print(f"{'streamed response':<22}{'backend':>9}{'whole ms':>10}{'peak MB':>9}"
+          f"{'first ms':>10}{'stream ms':>11}{'peak MB':>9}")
+    for case, name, whole, whole_peak, first, streamed, streamed_peak in result['streaming']:
+        print(f"{case:<22}{name:>9}{whole * 1000:>10.1f}{whole_peak:>9.1f}"
+              f"{first * 1000:>10.2f}{streamed * 1000:>11.1f}{streamed_peak:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Production server tuning benchmark
+
+Starts gunicorn with gunicorn.conf.py in several worker/thread layouts and
+drives calculate-distance against a local mock Nominatim with fixed latency.
+Two workloads bracket real traffic:
+
+- geocode: every request uses fresh addresses, so each one waits on two
+  upstream lookups (I/O bound)
+- cached: one pair repeated, answered from the pair cache (CPU bound, the
+  per-request cost of the framework and server)
+
+Requires gunicorn, aiohttp, uvicorn and uvicorn-worker.
+
+Usage:
+    python -m benchmarks.server [--requests 300] [--concurrency 64] [--latency 0.05]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.async_load import _free_port, _load, _serve_mock, _wait_for_port
+from config import Config
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (label, worker class, workers, threads)
+LAYOUTS = [
+    ('sync', 'sync', 1, 1),
+    ('gthread', 'gthread', 1, 8),
+    ('gthread', 'gthread', 1, 32),
+    ('gthread', 'gthread', 2, 8),
+    ('uvicorn', 'uvicorn_worker.UvicornWorker', 1, 1),
+]
+
+
+def _configure():
+    Config.NOMINATIM_BASE_URL = os.environ['BENCH_NOMINATIM_URL']
+    Config.NOMINATIM_RATE_LIMIT = 0
+    Config.NOMINATIM_POOL_SIZE = 64
+    Config.DATABASE_NAME = os.path.join(os.environ['BENCH_TMP'], 'server.db')
+    Config.WRITE_BEHIND_SPILL_PATH = os.path.join(os.environ['BENCH_TMP'], 'server.spill.jsonl')
+    logging.disable(logging.WARNING)
+
+
+def create_wsgi_app():
+    """Gunicorn app factory: the Flask app pointed at the mock geocoder"""
+    _configure()
+    from app import create_app
+    return create_app()
+
+
+def create_asgi_app():
+    """Gunicorn app factory: the ASGI app pointed at the mock geocoder"""
+    _configure()
+    from app import create_asgi_app
+    return create_asgi_app()
+
+
+def _start_gunicorn(worker_class: str, workers: int, threads: int, port: int, mock_url: str, tmp: str):
+    factory = 'create_asgi_app' if worker_class.startswith('uvicorn') else 'create_wsgi_app'
+    env = dict(os.environ, BENCH_NOMINATIM_URL=mock_url, BENCH_TMP=tmp)
+    env.pop('WEB_CONCURRENCY', None)
+    env.pop('GUNICORN_CMD_ARGS', None)
+    return subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn',
+            '--config', 'gunicorn.conf.py',
+            '--bind', f"127.0.0.1:{port}",
+            '--worker-class', worker_class,
+            '--workers', str(workers),
+            '--threads', str(threads),
+            '--log-level', 'warning',
+            f"benchmarks.server:{factory}()",
+        ],
+        cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def run(total: int, concurrency: int, latency: float):
+    """
+    Run every layout against both workloads
+
+    Args:
+        total: Requests per case
+        concurrency: Concurrent clients
+        latency: Mock geocoder latency in seconds
+
+    Returns:
+        List of result dictionaries
+    """
+    mock_port = _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock = multiprocessing.Process(target=_serve_mock, args=(mock_port, latency), daemon=True)
+    mock.start()
+    _wait_for_port(mock_port)
+
+    results = []
+    try:
+        for case, (label, worker_class, workers, threads) in enumerate(LAYOUTS):
+            with tempfile.TemporaryDirectory() as tmp:
+                port = _free_port()
+                server = _start_gunicorn(worker_class, workers, threads, port, mock_url, tmp)
+                try:
+                    _wait_for_port(port)
+                    for workload in ('geocode', 'cached'):
+                        tag = f"Case {case} {workload}"
+                        # Warm up connections, and every worker's pair cache for the cached run
+                        warmup_tag = tag if workload == 'cached' else f"{tag} warmup"
+                        asyncio.run(_load(port, concurrency, concurrency, warmup_tag, False))
+                        result = asyncio.run(_load(port, total, concurrency, tag, workload == 'geocode'))
+                        result.update({
+                            'layout': label,
+                            'workers': workers,
+                            'threads': threads,
+                            'workload': workload,
+                        })
+                        results.append(result)
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        mock.terminate()
+        mock.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.05, help='mock geocoder seconds per request')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    print(f"CPU cores: {multiprocessing.cpu_count()}, clients: {args.concurrency}")
+    print(f"{'layout':<10}{'workers':>8}{'threads':>8}{'workload':>10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for result in run(args.requests, args.concurrency, args.latency):
+        print(
+            f"{result['layout']:<10}{result['workers']:>8}{result['threads']:>8}{result['workload']:>10}"
+            f"{result['requests_per_second']:>10.1f}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
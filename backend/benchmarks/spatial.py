@@ -0,0 +1,92 @@
+"""
+Spatial lookup benchmark
+
+Times radius and nearest-location lookups as the queries table grows, to
+show that R*Tree lookups stay roughly flat while a full scan grows
+linearly with the table.
+
+Usage:
+    python -m benchmarks.spatial [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+
+from database import Database
+
+
+def fill(db: Database, rows: int, seed: int = 7, chunk: int = 50_000):
+    """Insert queries with endpoints scattered uniformly over land-ish latitudes"""
+    rng = random.Random(seed)
+    for start in range(0, rows, chunk):
+        batch = [
+            (
+                f"Source {i}", f"Destination {i}",
+                rng.uniform(-60, 70), rng.uniform(-180, 180),
+                rng.uniform(-60, 70), rng.uniform(-180, 180),
+                1000.0, 621.37
+            )
+            for i in range(start, min(start + chunk, rows))
+        ]
+        db.save_queries(batch)
+
+
+def _full_scan(db: Database, lat: float, lon: float, radius_km: float):
+    with db.get_connection() as conn:
+        rows = conn.execute('SELECT source_lat, source_lon, dest_lat, dest_lon FROM queries').fetchall()
+    return [row for row in rows if abs(row[0] - lat) < radius_km / 111 or abs(row[2] - lat) < radius_km / 111]
+
+
+def _timed(func, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(sizes):
+    """
+    Run the benchmark
+
+    Args:
+        sizes: Iterable of table sizes
+
+    Returns:
+        List of result dictionaries with milliseconds per lookup
+    """
+    results = []
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, 'spatial-bench.db'))
+            fill(db, rows)
+            cases = {
+                'radius 50 km (rtree)': lambda: db.find_queries_near(48.85, 2.35, 50),
+                'nearest 10 (rtree)': lambda: db.find_nearest_locations(48.85, 2.35, 10),
+                'radius 50 km (full scan)': lambda: _full_scan(db, 48.85, 2.35, 50),
+            }
+            for name, func in cases.items():
+                results.append({'case': name, 'rows': rows, 'ms': _timed(func)})
+            db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    print(f"{'rows':>10}  {'case':<28}{'ms':>10}")
+    for result in run(args.sizes):
+        print(f"{result['rows']:>10}  {result['case']:<28}{result['ms']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
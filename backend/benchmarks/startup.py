@@ -0,0 +1,110 @@
+"""
+Cold start benchmark
+
+Starts fresh interpreters and measures the time from the first import to
+the first served request: importing the app module, create_app(), a first
+request that needs no services (/api/health) and a first request that
+opens the database (/api/history). The eager case additionally builds
+every service and imports NumPy and aiohttp right after create_app, as
+importing routes used to, for comparison with the lazy default.
+
+Usage:
+    python -m benchmarks.startup [--runs 7]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child; prints the milestones in seconds since the script started
+CHILD = '''
+import json, os, sys, time
+start = time.perf_counter()
+marks = {}
+
+import logging
+logging.disable(logging.WARNING)
+from config import Config
+Config.DATABASE_NAME = os.path.join(sys.argv[1], 'startup.db')
+Config.WRITE_BEHIND_SPILL_PATH = os.path.join(sys.argv[1], 'startup.spill.jsonl')
+
+import app
+marks['import'] = time.perf_counter() - start
+
+flask_app = app.create_app()
+if sys.argv[2] == 'eager':
+    import aiohttp, numpy
+    from services import get_services
+    services = get_services(flask_app)
+    for name in services.NAMES:
+        getattr(services, name)
+marks['create_app'] = time.perf_counter() - start
+
+client = flask_app.test_client()
+assert client.get('/api/health').status_code == 200
+marks['first_request'] = time.perf_counter() - start
+
+assert client.get('/api/history').status_code == 200
+marks['first_db_request'] = time.perf_counter() - start
+
+print(json.dumps(marks))
+'''
+
+MILESTONES = ('import', 'create_app', 'first_request', 'first_db_request')
+
+
+def _run_child(mode: str, tmp: str) -> dict:
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, tmp, mode],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    marks = json.loads(output.strip().splitlines()[-1])
+    # Interpreter start-up and teardown included
+    marks['process'] = time.perf_counter() - start
+    return marks
+
+
+def run(runs: int):
+    """
+    Run the benchmark
+
+    Args:
+        runs: Fresh processes per mode (a new database each time)
+
+    Returns:
+        List of result dictionaries with the median milliseconds per milestone
+    """
+    results = []
+    for mode in ('lazy', 'eager'):
+        samples = []
+        for _ in range(runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                samples.append(_run_child(mode, tmp))
+        result = {'mode': mode}
+        for milestone in MILESTONES + ('process',):
+            result[milestone] = statistics.median(sample[milestone] for sample in samples) * 1000
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    args = parser.parse_args()
+
+    columns = MILESTONES + ('process',)
+    print(f"{'mode':<8}" + ''.join(f"{name + ' ms':>20}" for name in columns))
+    for result in run(args.runs):
+        print(f"{result['mode']:<8}" + ''.join(f"{result[name]:>20.1f}" for name in columns))
+
+
+if __name__ == '__main__':
+    main()
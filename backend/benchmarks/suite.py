@@ -0,0 +1,335 @@
+"""
+Benchmark suite with baseline comparison
+
+Runs a fixed set of microbenchmarks (haversine, validation, database) and
+a short mixed load test against the mock geocoder, writes the results as
+JSON and compares them with a saved baseline. The exit status is 1 when a
+metric is worse than the baseline by more than the tolerance, so the
+suite can gate a deploy.
+
+Each metric records its unit, whether higher is better and how much noise
+it tolerates (disk-bound writes and end-to-end latencies vary more than
+pure CPU loops). Microbenchmarks report the best of many short samples,
+which filters out scheduler noise but not a slower machine: record the
+baseline on the machine (or CI runner) that runs the comparison. Results
+carry the Python version, platform, CPU count and git commit, and a
+differing machine is reported before the comparison. On shared or
+burstable VMs whole runs shift by 20-40%; raise --tolerance there.
+
+Usage:
+    python -m benchmarks.suite                         # run, write results, compare
+    python -m benchmarks.suite --save-baseline         # run and store as the baseline
+    python -m benchmarks.suite --quick --skip-load     # fast smoke run
+    python -m benchmarks.suite --compare results.json  # compare a stored run, no benchmarks
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from database import Database
+from utils import DistanceCalculator
+from validation import Validator
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(BENCHMARKS_DIR, 'results', 'latest.json')
+
+# Machine fields that must match for the comparison to be meaningful
+MACHINE_FIELDS = ('python', 'implementation', 'platform', 'cpu_count')
+
+# Allowed relative slowdown for metrics that do not set their own
+DEFAULT_TOLERANCE = 0.2
+
+ADDRESSES = [
+    "1600 Amphitheatre Parkway, Mountain View, CA",
+    "Eiffel Tower, Paris, France",
+    "221B Baker Street, London",
+    "Brandenburger Tor, Pariser Platz, 10117 Berlin",
+]
+
+
+def _metric(value: float, unit: str, higher_is_better: bool, tolerance: float = DEFAULT_TOLERANCE) -> dict:
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better, 'tolerance': tolerance}
+
+
+def _best_rate(func, count: int, repeat: int) -> float:
+    """Best calls per second of func(count) over `repeat` runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(count)
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def bench_haversine(scale: float, repeat: int) -> dict:
+    haversine = DistanceCalculator.haversine_distance
+    count = int(20_000 * scale)
+
+    def scalar(n):
+        for _ in range(n):
+            haversine(40.7128, -74.0060, 34.0522, -118.2437)
+
+    src_lats = [40.7128 + i * 1e-6 for i in range(count)]
+    src_lons = [-74.0060] * count
+    dst_lats = [34.0522] * count
+    dst_lons = [-118.2437 - i * 1e-6 for i in range(count)]
+
+    def batch(n):
+        DistanceCalculator.haversine_distances(src_lats[:n], src_lons[:n], dst_lats[:n], dst_lons[:n])
+
+    return {
+        'haversine.scalar': _metric(_best_rate(scalar, count, repeat), 'calls/s', True),
+        'haversine.batch': _metric(_best_rate(batch, count, repeat), 'pairs/s', True),
+    }
+
+
+def bench_validation(scale: float, repeat: int) -> dict:
+    count = int(10_000 * scale)
+    items = (ADDRESSES * (count // len(ADDRESSES) + 1))[:count]
+
+    def single(n):
+        for address in items[:n]:
+            Validator.validate_address(address)
+
+    def many(n):
+        Validator.validate_many(items[:n])
+
+    return {
+        'validation.validate_address': _metric(_best_rate(single, count, repeat), 'addresses/s', True),
+        'validation.validate_many': _metric(_best_rate(many, count, repeat), 'addresses/s', True),
+    }
+
+
+def bench_database(scale: float, repeat: int) -> dict:
+    count = int(200 * scale)
+    row = ("Source", "Destination", 40.7128, -74.0060, 34.0522, -118.2437, 3935.75, 2445.56)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'suite.db'))
+
+        def single(n):
+            for _ in range(n):
+                db.save_query(*row)
+
+        def batch(n):
+            db.save_queries([row] * n)
+
+        results = {
+            'database.save_query': _metric(_best_rate(single, count, repeat), 'writes/s', True, 0.4),
+            'database.save_queries': _metric(_best_rate(batch, count * 10, repeat), 'writes/s', True, 0.4),
+        }
+
+        pages = int(100 * scale)
+
+        def history(n):
+            for _ in range(n):
+                db.get_history(limit=50)
+
+        # Seconds per page, reported in ms (lower is better)
+        results['database.get_history'] = _metric(1000 / _best_rate(history, pages, repeat), 'ms/page', False, 0.3)
+        db.close()
+    return results
+
+
+def bench_load(scale: float) -> dict:
+    from benchmarks import load
+
+    result = load.run(total=max(int(600 * scale), 50), concurrency=16, latency=0.02)
+    if result['errors']:
+        raise RuntimeError(f"Load test had {result['errors']} failed requests: {result['endpoints']}")
+
+    # Tail percentiles of a few hundred requests are noisy; p95 is the
+    # highest one the sample supports
+    distance = result['endpoints']['calculate-distance']
+    history = result['endpoints']['history']
+    return {
+        'load.requests_per_second': _metric(result['requests_per_second'], 'req/s', True, 0.3),
+        'load.calculate_distance.p50': _metric(distance['p50_ms'], 'ms', False, 0.3),
+        'load.calculate_distance.p95': _metric(distance['p95_ms'], 'ms', False, 0.5),
+        'load.history.p50': _metric(history['p50_ms'], 'ms', False, 0.3),
+        'load.history.p95': _metric(history['p95_ms'], 'ms', False, 0.5),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR,
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def machine() -> dict:
+    """Describe the interpreter and host the results were measured on"""
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(quick: bool = False, skip_load: bool = False) -> dict:
+    """
+    Run every benchmark
+
+    Args:
+        quick: Run a fraction of the iterations (smoke test, not for baselines)
+        skip_load: Skip the load test (no subprocesses or sockets)
+
+    Returns:
+        Results document: {'meta': {...}, 'metrics': {name: metric}}
+    """
+    scale, repeat = (0.5, 5) if quick else (1.0, 25)
+    metrics = {}
+    metrics.update(bench_haversine(scale, repeat))
+    metrics.update(bench_validation(scale, repeat))
+    metrics.update(bench_database(scale, repeat))
+    if not skip_load:
+        metrics.update(bench_load(scale))
+
+    return {
+        'meta': dict(
+            machine(),
+            commit=_git_commit(),
+            timestamp=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            quick=quick,
+        ),
+        'metrics': metrics,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float = None) -> list:
+    """
+    Compare a results document with a baseline
+
+    Args:
+        current: Results document from run()
+        baseline: Results document to compare against
+        tolerance: Allowed relative slowdown for every metric, e.g. 0.15
+            for 15%; by default each metric's own tolerance
+
+    Returns:
+        List of dictionaries (name, unit, baseline, current, change, status),
+        one per metric in either document; change is the relative
+        improvement (negative when worse) and status is one of 'ok',
+        'improved', 'regression', 'new' or 'missing'
+    """
+    rows = []
+    names = list(current['metrics']) + [name for name in baseline['metrics'] if name not in current['metrics']]
+    for name in names:
+        now = current['metrics'].get(name)
+        before = baseline['metrics'].get(name)
+        row = {
+            'name': name,
+            'unit': (now or before)['unit'],
+            'baseline': before['value'] if before else None,
+            'current': now['value'] if now else None,
+            'change': None,
+        }
+        if before is None:
+            row['status'] = 'new'
+        elif now is None:
+            row['status'] = 'missing'
+        else:
+            if before['value'] == 0:
+                change = 0.0
+            elif before['higher_is_better']:
+                change = now['value'] / before['value'] - 1
+            else:
+                change = before['value'] / now['value'] - 1 if now['value'] else float('inf')
+            row['change'] = change
+            allowed = tolerance if tolerance is not None else now.get('tolerance', DEFAULT_TOLERANCE)
+            if change < -allowed:
+                row['status'] = 'regression'
+            elif change > allowed:
+                row['status'] = 'improved'
+            else:
+                row['status'] = 'ok'
+        rows.append(row)
+    return rows
+
+
+def _load_json(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_json(path: str, document: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def _print_comparison(rows: list):
+    print(f"{'metric':<32}{'unit':>12}{'baseline':>14}{'current':>14}{'change':>10}  status")
+    for row in rows:
+        baseline = f"{row['baseline']:,.2f}" if row['baseline'] is not None else '-'
+        current = f"{row['current']:,.2f}" if row['current'] is not None else '-'
+        change = f"{row['change'] * 100:+.1f}%" if row['change'] is not None else '-'
+        print(f"{row['name']:<32}{row['unit']:>12}{baseline:>14}{current:>14}{change:>10}  {row['status']}")
+    regressions = [row['name'] for row in rows if row['status'] == 'regression']
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond tolerance: {', '.join(regressions)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='where to write the results JSON')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--compare', metavar='RESULTS', help='compare a results file instead of running')
+    parser.add_argument('--tolerance', type=float, help='allowed relative slowdown for every metric')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations, for smoke tests')
+    parser.add_argument('--skip-load', action='store_true', help='microbenchmarks only')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    if args.compare:
+        current = _load_json(args.compare)
+    else:
+        current = run(args.quick, args.skip_load)
+        _write_json(args.output, current)
+        print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        _write_json(args.baseline, current)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+
+    baseline = _load_json(args.baseline)
+    differing = [
+        field for field in MACHINE_FIELDS
+        if baseline['meta'].get(field) != current['meta'].get(field)
+    ]
+    if differing:
+        print(f"Warning: baseline was measured on a different machine ({', '.join(differing)} differ)")
+    if baseline['meta'].get('quick') != current['meta'].get('quick'):
+        print("Warning: comparing a --quick run with a full run")
+    print(f"Comparing with baseline from commit {baseline['meta'].get('commit') or '?'} "
+          f"({baseline['meta'].get('timestamp')})\n")
+
+    rows = compare(current, baseline, args.tolerance)
+    _print_comparison(rows)
+    return 1 if any(row['status'] == 'regression' for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
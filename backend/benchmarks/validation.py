@@ -0,0 +1,105 @@
+"""
+Address validation benchmark
+
+Compares the previous per-pattern validation (one uncompiled re.search
+per SQL_INJECTION_PATTERNS entry) with the single precompiled matcher
+used by Validator.validate_address and Validator.validate_many, on valid
+addresses, hostile inputs and inputs close to MAX_ADDRESS_LENGTH.
+
+Usage:
+    python -m benchmarks.validation [--count 100000]
+"""
+
+import argparse
+import logging
+import re
+import time
+
+from config import Config
+from validation import Validator
+
+
+VALID = [
+    "1600 Amphitheatre Parkway, Mountain View, CA",
+    "Eiffel Tower, Paris, France",
+    "221B Baker Street, London",
+    "Brandenburger Tor, Pariser Platz, 10117 Berlin",
+]
+
+HOSTILE = [
+    "'; DROP TABLE queries; --",
+    "Paris' OR '1'='1",
+    "London UNION SELECT * FROM queries",
+    "Berlin /* comment */ Germany",
+]
+
+
+def _long_inputs():
+    """Addresses just under the length limit, worst case for the matcher"""
+    base = "Long Street Name And Number, Some District, Some City, Some Region, "
+    length = Config.MAX_ADDRESS_LENGTH - 2
+    return [(base * 4)[:length], ("Or Avenue " * 30)[:length]]
+
+
+def legacy_validate(address: str) -> bool:
+    """Per-pattern check as validate_address did it before"""
+    for pattern in Validator.SQL_INJECTION_PATTERNS:
+        if re.search(pattern, address, re.IGNORECASE):
+            return False
+    return True
+
+
+def compiled_validate(address: str) -> bool:
+    return Validator.SQL_INJECTION_RE.search(address) is None
+
+
+def _throughput(func, inputs, count: int) -> float:
+    items = (inputs * (count // len(inputs) + 1))[:count]
+    start = time.perf_counter()
+    func(items)
+    return count / (time.perf_counter() - start)
+
+
+def run(count: int):
+    """
+    Run the benchmark
+
+    Args:
+        count: Addresses validated per case
+
+    Returns:
+        List of result dictionaries with addresses per second
+    """
+    inputs = {'valid': VALID, 'hostile': HOSTILE, 'near max length': _long_inputs()}
+    modes = {
+        'legacy per-pattern': lambda items: [legacy_validate(a) for a in items],
+        'compiled matcher': lambda items: [compiled_validate(a) for a in items],
+        'validate_many': Validator.validate_many,
+    }
+
+    results = []
+    for input_name, addresses in inputs.items():
+        for mode, func in modes.items():
+            results.append({
+                'inputs': input_name,
+                'mode': mode,
+                'per_second': _throughput(func, addresses, count),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=100_000)
+    args = parser.parse_args()
+
+    # validate_address logs a warning for every hostile input
+    logging.disable(logging.WARNING)
+
+    print(f"{'inputs':<18}{'mode':<22}{'addresses/s':>14}")
+    for result in run(args.count):
+        print(f"{result['inputs']:<18}{result['mode']:<22}{result['per_second']:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
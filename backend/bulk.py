@@ -0,0 +1,440 @@
+"""
+Bulk distance import
+Computes distances for a CSV or NDJSON file of address pairs outside the
+HTTP API, with constant memory and resumable checkpoints
+
+Usage:
+    python bulk.py pairs.csv distances.csv [--save-to-db] [--resume]
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import uuid
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cache import normalize_address
+from config import Config
+from utils import DistanceCalculator
+from validation import Validator
+
+logger = logging.getLogger(__name__)
+
+
+class BulkImportError(Exception):
+    """Custom exception for bulk import errors"""
+    pass
+
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+OUTPUT_FIELDS = (
+    'row', 'source', 'destination', 'source_lat', 'source_lon',
+    'dest_lat', 'dest_lon', 'distance_km', 'distance_miles', 'error'
+)
+
+CHECKPOINT_VERSION = 1
+
+# (end byte offset, source, destination, read error)
+Pair = Tuple[int, Optional[str], Optional[str], Optional[str]]
+
+
+def detect_format(path: str, fmt: str = "") -> str:
+    """
+    Get the file format from an explicit name or the file extension
+
+    Raises:
+        BulkImportError: If the format is unknown
+    """
+    if fmt:
+        if fmt not in ('csv', 'ndjson'):
+            raise BulkImportError(f"Unknown format: {fmt}")
+        return fmt
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise BulkImportError(f"Cannot tell the format of {path} (use .csv, .ndjson or .jsonl)")
+    return FORMATS[extension]
+
+
+def _records(f, start: int, quoted: bool) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield (end offset, raw record) from a binary file, starting at a byte offset
+
+    With quoted=True (CSV) a record continues over line breaks while a
+    quoted field is open, i.e. while it holds an odd number of quotes.
+    """
+    f.seek(start)
+    offset = start
+    pending = []
+    quotes = 0
+    for line in f:
+        offset += len(line)
+        pending.append(line)
+        if quoted:
+            quotes += line.count(b'"')
+            if quotes % 2:
+                continue
+        yield offset, b''.join(pending)
+        pending = []
+        quotes = 0
+    if pending:
+        yield offset, b''.join(pending)
+
+
+def read_pairs(path: str, fmt: str, start: int = 0) -> Iterator[Pair]:
+    """
+    Stream address pairs from an input file
+
+    CSV input needs a header row with `source` and `destination` columns
+    (other columns are ignored). NDJSON input has one object with `source`
+    and `destination` keys per line. Records that cannot be parsed are
+    yielded with a read error instead of stopping the job.
+
+    Args:
+        path: Input file
+        fmt: 'csv' or 'ndjson'
+        start: Byte offset of the first record to read (from a checkpoint)
+
+    Yields:
+        Tuples of (end byte offset, source, destination, read error)
+
+    Raises:
+        BulkImportError: If the CSV header lacks a required column
+    """
+    with open(path, 'rb') as f:
+        if fmt == 'ndjson':
+            for offset, raw in _records(f, start, quoted=False):
+                if not raw.strip():
+                    continue
+                try:
+                    item = json.loads(raw)
+                except ValueError:
+                    yield offset, None, None, 'Invalid JSON record'
+                    continue
+                if not isinstance(item, dict):
+                    yield offset, None, None, 'Record must be a JSON object'
+                    continue
+                yield offset, item.get('source'), item.get('destination'), None
+            return
+
+        records = _records(f, 0, quoted=True)
+        header_end, header = next(records, (0, b''))
+        columns = [name.strip().lower() for name in next(csv.reader([header.decode('utf-8-sig')]), [])]
+        missing = [name for name in ('source', 'destination') if name not in columns]
+        if missing:
+            raise BulkImportError(f"{path}: CSV header has no {' or '.join(missing)} column")
+        source_index = columns.index('source')
+        destination_index = columns.index('destination')
+
+        if start > header_end:
+            records = _records(f, start, quoted=True)
+        for offset, raw in records:
+            if not raw.strip():
+                continue
+            try:
+                fields = next(csv.reader([raw.decode('utf-8')]))
+                yield offset, fields[source_index], fields[destination_index], None
+            except (UnicodeDecodeError, csv.Error, IndexError):
+                yield offset, None, None, 'Malformed CSV record'
+
+
+def chunked(iterable, size: int) -> Iterator[list]:
+    """Group an iterable into lists of at most `size` items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def process_chunk(chunk: List[Pair], geocoder, first_row: int) -> Tuple[List[dict], List[tuple]]:
+    """
+    Validate, geocode and measure one chunk of pairs
+
+    Unique addresses are geocoded concurrently (cache first) and all
+    distances of the chunk are computed in one vectorized call.
+
+    Args:
+        chunk: Pairs from read_pairs
+        geocoder: Geocoder used for the lookups
+        first_row: Row number of the first pair (1-based)
+
+    Returns:
+        Tuple of (output records in input order, query rows for the database)
+    """
+    sources = Validator.validate_many([pair[1] for pair in chunk], "Source")
+    destinations = Validator.validate_many([pair[2] for pair in chunk], "Destination")
+
+    records = []
+    valid = []
+    for index, (pair, (source, source_error), (destination, destination_error)) in enumerate(
+        zip(chunk, sources, destinations)
+    ):
+        records.append(dict.fromkeys(OUTPUT_FIELDS))
+        records[-1].update({
+            'row': first_row + index,
+            'source': source or pair[1],
+            'destination': destination or pair[2],
+        })
+        error = pair[3] or source_error or destination_error
+        if error:
+            records[-1]['error'] = error
+        else:
+            valid.append((index, source, destination))
+
+    unique = {}
+    for _, source, destination in valid:
+        unique.setdefault(normalize_address(source), source)
+        unique.setdefault(normalize_address(destination), destination)
+    geocoded = geocoder.batch_geocode(list(unique.values()), Config.BULK_GEOCODE_WORKERS) if unique else {}
+    coords_by_key = {key: geocoded.get(address) for key, address in unique.items()}
+
+    resolved = []
+    for index, source, destination in valid:
+        source_coords = coords_by_key[normalize_address(source)]
+        dest_coords = coords_by_key[normalize_address(destination)]
+        if source_coords is None:
+            records[index]['error'] = f"Could not find address: {source}"
+        elif dest_coords is None:
+            records[index]['error'] = f"Could not find address: {destination}"
+        else:
+            resolved.append((index, source, destination, source_coords, dest_coords))
+
+    distances_km, distances_miles = DistanceCalculator.haversine_distances(
+        [item[3]['lat'] for item in resolved],
+        [item[3]['lon'] for item in resolved],
+        [item[4]['lat'] for item in resolved],
+        [item[4]['lon'] for item in resolved]
+    )
+
+    rows = []
+    for (index, source, destination, source_coords, dest_coords), km, miles in zip(
+        resolved, distances_km, distances_miles
+    ):
+        km = round(float(km), 2)
+        miles = round(float(miles), 2)
+        records[index].update({
+            'source_lat': source_coords['lat'], 'source_lon': source_coords['lon'],
+            'dest_lat': dest_coords['lat'], 'dest_lon': dest_coords['lon'],
+            'distance_km': km, 'distance_miles': miles,
+        })
+        rows.append((
+            source, destination,
+            source_coords['lat'], source_coords['lon'],
+            dest_coords['lat'], dest_coords['lon'],
+            km, miles
+        ))
+    return records, rows
+
+
+def encode_records(records: List[dict], fmt: str, header: bool = False) -> bytes:
+    """Encode output records as CSV (optionally with the header row) or NDJSON"""
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(OUTPUT_FIELDS)
+    writer.writerows([record[field] for field in OUTPUT_FIELDS] for record in records)
+    return buffer.getvalue().encode('utf-8')
+
+
+def _input_identity(path: str) -> dict:
+    stat = os.stat(path)
+    return {'input': os.path.abspath(path), 'input_size': stat.st_size, 'input_mtime_ns': stat.st_mtime_ns}
+
+
+def _load_checkpoint(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise BulkImportError(f"Corrupt checkpoint {path}: {str(e)}")
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise BulkImportError(f"Checkpoint {path} was written by an incompatible version")
+    return state
+
+
+def _write_checkpoint(path: str, state: dict):
+    """Replace the checkpoint atomically, so a crash leaves the old or the new one"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def run_import(
+    input_path: str,
+    output_path: str,
+    services=None,
+    save_to_db: bool = False,
+    resume: bool = False,
+    chunk_size: int = 0,
+    input_format: str = "",
+    output_format: str = "",
+    checkpoint_path: str = ""
+) -> Dict[str, int]:
+    """
+    Compute distances for every pair in a file
+
+    The input is streamed in chunks of chunk_size pairs. For each chunk
+    the unique addresses are geocoded through the cache, the distances are
+    computed in one vectorized call, the results are appended to the
+    output file (fsynced) and, with save_to_db, the successful pairs are
+    saved to the queries table in one transaction. A checkpoint written
+    after every chunk records how far the input, output and database got;
+    with resume=True a crashed job continues from it. The output is cut
+    back to the checkpoint, and database batches are committed together
+    with the job's progress, so no row is written twice. The checkpoint
+    is deleted when the job completes.
+
+    Args:
+        input_path: CSV or NDJSON file of address pairs
+        output_path: Results file (CSV or NDJSON, by extension)
+        services: Services providing the geocoder and database (defaults
+                  to a new set built from Config)
+        save_to_db: Also save successful pairs to the queries table
+        resume: Continue from the checkpoint if there is one
+        chunk_size: Pairs per chunk (defaults to Config.BULK_CHUNK_SIZE;
+                    a resumed job keeps its original chunk size)
+        input_format: 'csv' or 'ndjson' (defaults to the input extension)
+        output_format: 'csv' or 'ndjson' (defaults to the output extension,
+                       then to the input format)
+        checkpoint_path: Checkpoint file (defaults to <output>.checkpoint)
+
+    Returns:
+        Dictionary with the rows read, succeeded, failed and saved
+
+    Raises:
+        BulkImportError: If the input is unusable, or a checkpoint exists
+                         without resume or does not match the input
+    """
+    from services import Services
+
+    services = services or Services()
+    input_format = detect_format(input_path, input_format)
+    try:
+        output_format = detect_format(output_path, output_format)
+    except BulkImportError:
+        output_format = input_format
+    checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+
+    state = _load_checkpoint(checkpoint_path)
+    if state is not None and not resume:
+        raise BulkImportError(
+            f"Checkpoint {checkpoint_path} exists from an unfinished job; resume it or delete the checkpoint"
+        )
+    if state is not None:
+        expected = dict(_input_identity(input_path), output_format=output_format, save_to_db=save_to_db)
+        changed = [name for name, value in expected.items() if state.get(name) != value]
+        if changed:
+            raise BulkImportError(f"Cannot resume: {', '.join(changed)} changed since the checkpoint")
+        logger.info(f"Resuming job {state['job_id']} after {state['rows_done']} rows")
+    else:
+        if resume:
+            logger.info(f"No checkpoint at {checkpoint_path}, starting from the beginning")
+        state = dict(
+            _input_identity(input_path),
+            version=CHECKPOINT_VERSION,
+            job_id=uuid.uuid4().hex,
+            output_format=output_format,
+            save_to_db=save_to_db,
+            chunk_size=chunk_size or Config.BULK_CHUNK_SIZE,
+            rows_done=0,
+            input_offset=0,
+            output_offset=0,
+            stats={'rows': 0, 'succeeded': 0, 'failed': 0, 'saved': 0},
+        )
+
+    db_rows_done = services.db.get_import_progress(state['job_id']) if save_to_db else 0
+    stats = state['stats']
+
+    if state['output_offset']:
+        try:
+            output = open(output_path, 'r+b')
+        except FileNotFoundError:
+            raise BulkImportError(f"Cannot resume: {output_path} is missing")
+        # Drop anything written after the checkpoint
+        output.truncate(state['output_offset'])
+        output.seek(state['output_offset'])
+    else:
+        output = open(output_path, 'wb')
+
+    with output:
+        for chunk in chunked(read_pairs(input_path, input_format, state['input_offset']), state['chunk_size']):
+            records, rows = process_chunk(chunk, services.geocoder, state['rows_done'] + 1)
+
+            output.write(encode_records(records, output_format, header=(output.tell() == 0)))
+            output.flush()
+            os.fsync(output.fileno())
+
+            rows_done = state['rows_done'] + len(chunk)
+            if save_to_db and rows_done > db_rows_done:
+                stats['saved'] += services.db.save_import_batch(state['job_id'], rows, rows_done)
+
+            stats['rows'] += len(chunk)
+            stats['succeeded'] += len(rows)
+            stats['failed'] += len(chunk) - len(rows)
+            state.update(rows_done=rows_done, input_offset=chunk[-1][0], output_offset=output.tell())
+            _write_checkpoint(checkpoint_path, state)
+            logger.info(
+                f"Processed {stats['rows']} rows ({stats['succeeded']} succeeded, {stats['failed']} failed)"
+            )
+
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(checkpoint_path)
+    logger.info(f"Import job {state['job_id']} completed: {stats}")
+    return stats
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Compute distances for a file of address pairs")
+    parser.add_argument('input', help='CSV (source,destination columns) or NDJSON file')
+    parser.add_argument('output', help='results file, CSV or NDJSON by extension')
+    parser.add_argument('--save-to-db', action='store_true', help='also save successful pairs to the queries table')
+    parser.add_argument('--resume', action='store_true', help='continue from the checkpoint of a crashed run')
+    parser.add_argument('--chunk-size', type=int, default=0, help=f"pairs per chunk (default {Config.BULK_CHUNK_SIZE})")
+    parser.add_argument('--input-format', choices=['csv', 'ndjson'], default='')
+    parser.add_argument('--output-format', choices=['csv', 'ndjson'], default='')
+    parser.add_argument('--checkpoint', default='', help='checkpoint file (default <output>.checkpoint)')
+    args = parser.parse_args()
+
+    from app import configure_logging
+    from services import Services
+
+    configure_logging()
+    services = Services()
+    try:
+        stats = run_import(
+            args.input, args.output, services,
+            save_to_db=args.save_to_db,
+            resume=args.resume,
+            chunk_size=args.chunk_size,
+            input_format=args.input_format,
+            output_format=args.output_format,
+            checkpoint_path=args.checkpoint
+        )
+    except BulkImportError as e:
+        logger.error(str(e))
+        return 1
+    finally:
+        services.close()
+
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,578 @@
+import re
+import math
+import time
+import threading
+import logging
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+_NUMBER_RE = re.compile(r'\d+')
+
+
+def normalize_address(address: str) -> str:
+    """
+    Normalize an address into a cache key
+
+    Args:
+        address: Raw address string
+
+    Returns:
+        Lowercased address with collapsed whitespace
+    """
+    return _WHITESPACE_RE.sub(' ', address).strip().lower()
+
+
+def canonical_address(address: str) -> str:
+    """
+    Reduce an address to its comparable form for fuzzy matching
+
+    Args:
+        address: Raw address string
+
+    Returns:
+        NFKC-normalized, case-folded address with punctuation turned into
+        spaces and whitespace collapsed ("New York,NY " -> "new york ny")
+    """
+    address = _PUNCTUATION_RE.sub(' ', unicodedata.normalize('NFKC', address))
+    return _WHITESPACE_RE.sub(' ', address).strip().casefold()
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Padded character trigrams of a canonical address"""
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class CacheEntry:
+    """A cached geocoding result (coords is None for negative results)"""
+
+    __slots__ = ('coords', 'expires_at')
+
+    def __init__(self, coords: Optional[Dict[str, float]], expires_at: float):
+        self.coords = coords
+        self.expires_at = expires_at
+
+    @property
+    def found(self) -> bool:
+        return self.coords is not None
+
+    def is_expired(self, now: float) -> bool:
+        return now >= self.expires_at
+
+
+class GeocodeCache:
+    """
+    Two-tier geocoding cache
+
+    Tier one is an in-process LRU bounded by size and TTL, tier two is the
+    geocode_cache table in the query database. Negative results are cached
+    with a shorter TTL so that typos do not hit the provider on every request.
+    """
+
+    def __init__(
+        self,
+        database=None,
+        max_size: int = 0,
+        ttl: int = 0,
+        negative_ttl: int = 0
+    ):
+        self.database = database
+        self.max_size = max_size or Config.GEOCODE_CACHE_SIZE
+        self.ttl = ttl or Config.GEOCODE_CACHE_TTL
+        self.negative_ttl = negative_ttl or Config.GEOCODE_CACHE_NEGATIVE_TTL
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'negative_hits': 0,
+            'persistent_hits': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+    def add_invalidation_listener(self, listener: Callable[[str], None]):
+        """
+        Register a callback run with the normalized key whenever an entry is
+        invalidated or replaced with different coordinates
+        """
+        self._listeners.append(listener)
+
+    def get(self, address: str) -> Optional[CacheEntry]:
+        """
+        Look up an address in the memory tier, then the persistent tier
+
+        Args:
+            address: Address string (normalized internally)
+
+        Returns:
+            CacheEntry or None on a miss
+        """
+        key = normalize_address(address)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.is_expired(now):
+                    del self._entries[key]
+                    self._stats['expirations'] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._record_hit(entry)
+                    return entry
+
+        entry = self._load_persistent(key, now)
+
+        with self._lock:
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['persistent_hits'] += 1
+            self._record_hit(entry)
+            self._store(key, entry)
+            return entry
+
+    def set(self, address: str, coords: Optional[Dict[str, float]]) -> CacheEntry:
+        """
+        Cache a geocoding result
+
+        Args:
+            address: Address string (normalized internally)
+            coords: Dictionary with 'lat' and 'lon' keys, or None if not found
+
+        Returns:
+            The stored CacheEntry
+        """
+        key = normalize_address(address)
+        ttl = self.ttl if coords is not None else self.negative_ttl
+        entry = CacheEntry(coords, time.time() + ttl)
+
+        with self._lock:
+            previous = self._entries.get(key)
+            self._store(key, entry)
+
+        if previous is not None and previous.coords != coords:
+            self._notify(key)
+
+        if self.database is not None:
+            try:
+                self.database.save_geocode(
+                    key,
+                    coords['lat'] if coords else None,
+                    coords['lon'] if coords else None,
+                    entry.expires_at
+                )
+            except Exception as e:
+                logger.error(f"Failed to persist geocode cache entry: {str(e)}")
+
+        return entry
+
+    def expires_at(self, address: str) -> Optional[float]:
+        """
+        Expiry of the in-memory entry for an address, without touching counters
+
+        Args:
+            address: Address string (normalized internally)
+
+        Returns:
+            Unix timestamp, or None if the address is not in the memory tier
+        """
+        with self._lock:
+            entry = self._entries.get(normalize_address(address))
+            return entry.expires_at if entry is not None else None
+
+    def invalidate(self, address: str):
+        """
+        Remove an address from both tiers
+
+        Args:
+            address: Address string (normalized internally)
+        """
+        key = normalize_address(address)
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+        if self.database is not None:
+            try:
+                self.database.delete_geocode(key)
+            except Exception as e:
+                logger.error(f"Failed to delete geocode cache entry: {str(e)}")
+
+        self._notify(key)
+
+    def clear(self):
+        """Drop every entry from the memory tier"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get cache counters
+
+        Returns:
+            Dictionary of hit/miss/eviction counters and the current size
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_size'] = self.max_size
+        return stats
+
+    def _notify(self, key: str):
+        for listener in self._listeners:
+            listener(key)
+
+    def _record_hit(self, entry: CacheEntry):
+        self._stats['hits'] += 1
+        if not entry.found:
+            self._stats['negative_hits'] += 1
+
+    def _store(self, key: str, entry: CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _load_persistent(self, key: str, now: float) -> Optional[CacheEntry]:
+        if self.database is None:
+            return None
+
+        try:
+            row = self.database.get_geocode(key)
+        except Exception as e:
+            logger.error(f"Failed to read geocode cache entry: {str(e)}")
+            return None
+
+        if not row or row['expires_at'] <= now:
+            return None
+
+        coords = None
+        if row['lat'] is not None and row['lon'] is not None:
+            coords = {'lat': row['lat'], 'lon': row['lon']}
+        return CacheEntry(coords, row['expires_at'])
+
+
+class PairCache:
+    """
+    Result cache for (source, destination) pairs
+
+    Keys are order-aware pairs of normalized addresses; values are the
+    formatted distance responses. An entry expires together with the
+    earlier of its two geocode cache entries, and is dropped as soon as
+    either address is invalidated in the geocode cache.
+    """
+
+    def __init__(self, geocode_cache: GeocodeCache, max_size: int = 0):
+        self.geocode_cache = geocode_cache
+        self.max_size = max_size or Config.PAIR_CACHE_SIZE
+
+        self._entries = OrderedDict()
+        self._pairs_by_address = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+        geocode_cache.add_invalidation_listener(self._invalidate_address)
+
+    @staticmethod
+    def make_key(source: str, destination: str) -> Tuple[str, str]:
+        return normalize_address(source), normalize_address(destination)
+
+    def get(self, source: str, destination: str) -> Optional[dict]:
+        """
+        Look up a cached distance response
+
+        Args:
+            source: Source address
+            destination: Destination address
+
+        Returns:
+            Copy of the cached response dictionary, or None on a miss
+        """
+        key = self.make_key(source, destination)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            payload, expires_at = entry
+            if time.time() >= expires_at:
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return dict(payload)
+
+    def set(self, source: str, destination: str, payload: dict) -> bool:
+        """
+        Cache a distance response for as long as both geocodes stay valid
+
+        Args:
+            source: Source address
+            destination: Destination address
+            payload: Formatted distance response
+
+        Returns:
+            True if cached, False if either address is not in the geocode cache
+        """
+        source_expiry = self.geocode_cache.expires_at(source)
+        dest_expiry = self.geocode_cache.expires_at(destination)
+        if source_expiry is None or dest_expiry is None:
+            return False
+
+        key = self.make_key(source, destination)
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (dict(payload), min(source_expiry, dest_expiry))
+            for address_key in key:
+                self._pairs_by_address.setdefault(address_key, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+        return True
+
+    def clear(self):
+        """Drop every cached pair"""
+        with self._lock:
+            self._entries.clear()
+            self._pairs_by_address.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get cache counters
+
+        Returns:
+            Dictionary of hit/miss/eviction/invalidation counters and the current size
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_size'] = self.max_size
+        return stats
+
+    def _invalidate_address(self, address_key: str):
+        with self._lock:
+            for key in list(self._pairs_by_address.get(address_key, ())):
+                self._remove(key)
+                self._stats['invalidations'] += 1
+
+    def _remove(self, key: Tuple[str, str]):
+        if self._entries.pop(key, None) is None:
+            return
+        for address_key in key:
+            pairs = self._pairs_by_address.get(address_key)
+            if pairs is not None:
+                pairs.discard(key)
+                if not pairs:
+                    del self._pairs_by_address[address_key]
+
+
+class FuzzyAddressIndex:
+    """
+    Trigram index over addresses with cached geocodes
+
+    Resolves near-duplicate spellings of an address to a geocode cache
+    entry. An exact match on the canonical form is a dictionary lookup;
+    otherwise candidates sharing trigrams are scored by Jaccard similarity
+    and the best one at or above the threshold wins. Candidates must carry
+    the same house/postal numbers, so "12 Main St" never matches "21 Main St".
+
+    Addresses with numbers are only compared against entries with the same
+    numbers; otherwise only the rarest trigrams are used to collect
+    candidates (any match above the threshold must share at least one of
+    them). A lookup that runs past its latency budget gives up and is
+    treated as a miss.
+    """
+
+    def __init__(
+        self,
+        geocode_cache: GeocodeCache,
+        threshold: float = 0,
+        budget_ms: float = 0,
+        max_size: int = 0
+    ):
+        self.geocode_cache = geocode_cache
+        self.threshold = threshold or Config.FUZZY_MATCH_THRESHOLD
+        self.budget_ms = budget_ms or Config.FUZZY_MATCH_BUDGET_MS
+        self.max_size = max_size or Config.FUZZY_INDEX_SIZE
+
+        # canonical -> (cache key, trigrams, numbers), in LRU order
+        self._entries = OrderedDict()
+        self._canonical_by_key = {}
+        self._by_numbers = {}
+        self._postings = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'lookups': 0,
+            'exact_hits': 0,
+            'fuzzy_hits': 0,
+            'misses': 0,
+            'budget_exceeded': 0,
+            'evictions': 0,
+        }
+
+        geocode_cache.add_invalidation_listener(self._invalidate_key)
+
+    def add(self, address: str):
+        """
+        Index an address whose geocode is in the cache
+
+        Args:
+            address: Address string
+        """
+        canonical = canonical_address(address)
+        if not canonical:
+            return
+        key = normalize_address(address)
+
+        with self._lock:
+            entry = self._entries.get(canonical)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(canonical)
+                return
+            self._remove(canonical)
+            grams = trigrams(canonical)
+            numbers = tuple(_NUMBER_RE.findall(canonical))
+            self._entries[canonical] = (key, grams, numbers)
+            self._canonical_by_key.setdefault(key, set()).add(canonical)
+            if numbers:
+                self._by_numbers.setdefault(numbers, set()).add(canonical)
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(canonical)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def lookup(self, address: str) -> Optional[Dict[str, float]]:
+        """
+        Find cached coordinates for an address or a close spelling of it
+
+        Args:
+            address: Address string
+
+        Returns:
+            Dictionary with 'lat' and 'lon' keys, or None on a miss
+        """
+        canonical = canonical_address(address)
+
+        with self._lock:
+            self._stats['lookups'] += 1
+            entry = self._entries.get(canonical)
+            if entry is not None:
+                match, stat = entry[0], 'exact_hits'
+            else:
+                match, stat = self._best_match(canonical), 'fuzzy_hits'
+            if match is None:
+                self._stats['misses'] += 1
+                return None
+
+        cached = self.geocode_cache.get(match)
+        if cached is None or not cached.found:
+            self._invalidate_key(match)
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+
+        with self._lock:
+            self._stats[stat] += 1
+        logger.info(f"Fuzzy geocode match: {address} -> {match}")
+        return cached.coords
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get index counters
+
+        Returns:
+            Dictionary of lookup/hit/miss counters and the current size
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_size'] = self.max_size
+        return stats
+
+    def clear(self):
+        """Drop every indexed address"""
+        with self._lock:
+            self._entries.clear()
+            self._canonical_by_key.clear()
+            self._by_numbers.clear()
+            self._postings.clear()
+
+    def _best_match(self, canonical: str) -> Optional[str]:
+        if not canonical:
+            return None
+
+        grams = trigrams(canonical)
+        numbers = tuple(_NUMBER_RE.findall(canonical))
+        deadline = time.perf_counter() + self.budget_ms / 1000
+
+        if numbers:
+            candidates = self._by_numbers.get(numbers, ())
+        else:
+            # A match needs ceil(threshold * |grams|) shared trigrams, so it must
+            # contain at least one of the rarest |grams| - that + 1 of them
+            min_overlap = math.ceil(self.threshold * len(grams))
+            rare = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))
+            candidates = set()
+            for gram in rare[:len(grams) - min_overlap + 1]:
+                candidates.update(self._postings.get(gram, ()))
+
+        best, best_score = None, self.threshold
+        for checked, candidate in enumerate(candidates):
+            if checked % 64 == 0 and time.perf_counter() > deadline:
+                self._stats['budget_exceeded'] += 1
+                return None
+            key, candidate_grams, candidate_numbers = self._entries[candidate]
+            if candidate_numbers != numbers:
+                continue
+            shared = len(grams & candidate_grams)
+            score = shared / (len(grams) + len(candidate_grams) - shared)
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    def _invalidate_key(self, key: str):
+        with self._lock:
+            for canonical in list(self._canonical_by_key.get(key, ())):
+                self._remove(canonical)
+
+    def _remove(self, canonical: str):
+        entry = self._entries.pop(canonical, None)
+        if entry is None:
+            return
+        key, grams, numbers = entry
+        for index, index_key in ((self._canonical_by_key, key), (self._by_numbers, numbers)):
+            canonicals = index.get(index_key)
+            if canonicals is not None:
+                canonicals.discard(canonical)
+                if not canonicals:
+                    del index[index_key]
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(canonical)
+                if not postings:
+                    del self._postings[gram]
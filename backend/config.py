@@ -4,22 +4,111 @@ class Config:
     HOST = '0.0.0.0'
     PORT = 5000
     
+    # production server (gunicorn.conf.py)
+    SERVER_WORKERS = 0  # processes, 0 = one per CPU core
+    SERVER_THREADS = 32  # request threads per worker (gthread worker class)
+    SERVER_WORKER_CLASS = 'gthread'  # gthread, sync or uvicorn (async mode)
+    SERVER_PRELOAD = True  # create the app once in the master, then fork workers
+    SERVER_TIMEOUT = 30  # seconds before a silent worker is killed and replaced
+    SERVER_GRACEFUL_TIMEOUT = 30  # seconds workers get to finish on reload/shutdown
+    SERVER_KEEPALIVE = 5  # seconds an idle keep-alive connection is held open
+    SERVER_MAX_REQUESTS = 0  # recycle a worker after this many requests, 0 = never
+    SERVER_MAX_REQUESTS_JITTER = 0
+    
     # distance queris db
     DATABASE_NAME = 'distance_queries.db'
+    DATABASE_JOURNAL_MODE = 'WAL'
+    DATABASE_SYNCHRONOUS = 'NORMAL'  # safe with WAL, fsyncs only at checkpoints
+    DATABASE_BUSY_TIMEOUT = 5  # seconds to wait on a locked database
+    DATABASE_STATEMENT_CACHE_SIZE = 64
+
+    # write-behind queue for query history
+    WRITE_BEHIND_ENABLED = False  # history reads lag writes by up to the flush interval when on
+    WRITE_BEHIND_QUEUE_SIZE = 10000
+    WRITE_BEHIND_BATCH_SIZE = 100
+    WRITE_BEHIND_FLUSH_INTERVAL = 0.5  # seconds
+    WRITE_BEHIND_POLICY = 'block'  # block, drop_oldest or spill
+    WRITE_BEHIND_BLOCK_TIMEOUT = 1.0  # seconds before a blocked row is dropped
+    WRITE_BEHIND_SPILL_PATH = 'distance_queries.spill.jsonl'
 
     # nomination db
     NOMINATIM_BASE_URL = 'https://nominatim.openstreetmap.org'
     NOMINATIM_TIMEOUT = 10
     NOMINATIM_USER_AGENT = 'DistanceCalculatorApp/1.0'
+    NOMINATIM_RATE_LIMIT = 1.0  # requests per second, shared by all workers
+    NOMINATIM_RATE_BURST = 1
+    GEOCODE_MAX_WORKERS = 4
+    NOMINATIM_POOL_CONNECTIONS = 2  # distinct hosts kept in the pool
+    NOMINATIM_POOL_SIZE = 10  # keep-alive connections per host
+    NOMINATIM_MAX_RETRIES = 3  # retries for 429/5xx responses
+    NOMINATIM_BACKOFF_BASE = 0.5  # seconds, doubled per retry
+    NOMINATIM_BACKOFF_MAX = 8
+
+    # geocoder backends, local ones are tried in order before nominatim
+    GEOCODER_BACKEND = 'nominatim'  # nominatim, local or local,nominatim
+    GAZETTEER_PATH = 'gazetteer.tsv'  # GeoNames dump, CSV or a built .idx file
+    GAZETTEER_BUILD_CHUNK_ROWS = 1000000  # rows sorted in memory while indexing
+    GAZETTEER_DOMINANT_RATIO = 10  # a shared name resolves locally only to a place this many times more populous
+    GAZETTEER_SAME_PLACE_KM = 25  # entries of one name closer than this are the same place
+    GAZETTEER_QUALIFIER_KM = 3000  # "Paris, Texas" misses if Texas is indexed farther than this from Paris
+
+    # geocode cache (ttl in seconds)
+    GEOCODE_CACHE_SIZE = 10000
+    GEOCODE_CACHE_TTL = 7 * 24 * 3600
+    GEOCODE_CACHE_NEGATIVE_TTL = 3600
+    PAIR_CACHE_SIZE = 10000
+
+    # fuzzy matching of near-duplicate addresses against cached geocodes
+    FUZZY_MATCH_ENABLED = True
+    FUZZY_MATCH_THRESHOLD = 0.8  # trigram Jaccard similarity
+    FUZZY_MATCH_BUDGET_MS = 2.0  # a lookup running longer is treated as a miss
+    FUZZY_INDEX_SIZE = 10000
     
     # limit configs
     MAX_HISTORY_LIMIT = 100
     DEFAULT_HISTORY_LIMIT = 50
+    MAX_BATCH_PAIRS = 1000
+    MAX_MATRIX_ADDRESSES = 1000
+    MATRIX_CHUNK_ROWS = 64
     MIN_ADDRESS_LENGTH = 3
     MAX_ADDRESS_LENGTH = 200
     EARTH_RADIUS_KM = 6371
+    SPATIAL_MAX_RADIUS_KM = 500
+    SPATIAL_INITIAL_RADIUS_KM = 10  # first ring of the nearest-location search
+    MAX_NEAREST_LOCATIONS = 100
+    SPATIAL_CANDIDATE_FACTOR = 4  # index points fetched per requested result, nearest first
     KM_TO_MILES_FACTOR = 0.621371
     
+    # bulk import (bulk.py)
+    BULK_CHUNK_SIZE = 1000  # pairs geocoded, computed, written and checkpointed together
+    BULK_GEOCODE_WORKERS = 8  # concurrent lookups per chunk (cache misses only)
+    
+    # history export (/api/history/export)
+    EXPORT_CHUNK_ROWS = 10000  # rows fetched, encoded and sent together (one Parquet row group)
+    EXPORT_PARQUET_COMPRESSION = 'snappy'  # snappy, zstd, gzip or none
+    
+    # history analytics (/api/stats)
+    STATS_DISTANCE_RESOLUTION = 0.01  # relative width of the percentile histogram buckets
+    STATS_DEFAULT_TOP_PAIRS = 10
+    STATS_MAX_TOP_PAIRS = 100
+    
+    # JSON responses (serialization.py)
+    JSON_BACKEND = 'auto'  # auto (orjson, then msgspec, then json), orjson, msgspec or json
+    JSON_STREAM_MIN_ITEMS = 1000  # responses holding a list this long are streamed, 0 = never
+    JSON_STREAM_CHUNK_ITEMS = 64  # list items encoded per streamed piece
+    
+    # metrics (/api/metrics)
+    METRICS_ENABLED = True
+    
+    # request tracing and profiling
+    TRACE_ENABLED = True
+    TRACE_SLOW_REQUEST_MS = 1000  # requests slower than this log their span breakdown
+    TRACE_MAX_SPANS = 200  # spans kept per request
+    PROFILE_SAMPLE_RATE = 0.0  # fraction of requests profiled with cProfile, 0 = off
+    PROFILE_DIR = 'profiles'  # pstats dumps of sampled requests
+    PROFILE_MAX_FILES = 100  # oldest dumps are deleted beyond this
+    PROFILE_CONTROL_ENABLED = False  # allow PUT /api/debug/profiling to change the rate
+    
     # logging
     LOG_LEVEL = 'INFO'
     LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -1,24 +1,75 @@
 import sqlite3
 import logging
-from typing import List, Dict, Optional
+import math
+import threading
+from typing import Callable, Iterator, List, Dict, Optional
 from contextlib import contextmanager
 
 from config import Config
+from metrics import DB_WRITE_SECONDS, timed
+from records import QUERY_COLUMNS, QueryMatch, QueryRecord
+from tracing import traced
+from utils import DistanceCalculator
 
 logger = logging.getLogger(__name__)
 
 
+INSERT_QUERY_SQL = '''
+    INSERT INTO queries 
+    (source_address, destination_address, source_lat, source_lon, 
+     dest_lat, dest_lon, distance_km, distance_miles)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
 class Database:
     #Database handler for distance queries
+    #Each thread reuses one connection; sqlite3 caches the prepared
+    #statements per connection, so each SQL string is prepared once per thread
     
     def __init__(self, db_name: str = ""):
         self.db_name = db_name or Config.DATABASE_NAME
+        self._local = threading.local()
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        self._listeners = []
         self.init_db()
     
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=Config.DATABASE_BUSY_TIMEOUT,
+            cached_statements=Config.DATABASE_STATEMENT_CACHE_SIZE,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA journal_mode={Config.DATABASE_JOURNAL_MODE}')
+        conn.execute(f'PRAGMA synchronous={Config.DATABASE_SYNCHRONOUS}')
+        return conn
+    
+    def _thread_connection(self) -> sqlite3.Connection:
+        """Get (or open) the connection owned by the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        
+        conn = self._connect()
+        thread = threading.current_thread()
+        
+        with self._connections_lock:
+            # Close connections left behind by threads that have exited
+            for ident, (owner, stale) in list(self._connections.items()):
+                if not owner.is_alive():
+                    stale.close()
+                    del self._connections[ident]
+            self._connections[thread.ident] = (thread, conn)
+        
+        self._local.conn = conn
+        return conn
+    
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row
+        conn = self._thread_connection()
         try:
             yield conn
             conn.commit()
@@ -26,8 +77,32 @@ class Database:
             conn.rollback()
             logger.error(f"Database error: {str(e)}")
             raise
-        finally:
-            conn.close()
+    
+    def close(self):
+        """Close every pooled connection (e.g. at shutdown or after fork)"""
+        with self._connections_lock:
+            for _, conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+    
+    def add_listener(self, listener: Callable[[int, List[tuple]], None]):
+        """
+        Call listener(first_id, rows) after queries are committed
+        
+        rows are tuples as for save_queries, with ids first_id onwards
+        (AUTOINCREMENT ids are consecutive within one transaction).
+        clear_history calls listener(0, []). Listeners run on the writing
+        thread and must be quick; their errors are logged, not raised.
+        """
+        self._listeners.append(listener)
+    
+    def _notify(self, first_id: int, rows: List[tuple]):
+        for listener in self._listeners:
+            try:
+                listener(first_id, rows)
+            except Exception as e:
+                logger.error(f"Query listener failed: {str(e)}")
     
     def init_db(self):
         """Initialize database with required tables"""
@@ -48,11 +123,80 @@ class Database:
                         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
                     )
                 ''')
+                # id is the rowid (the table's own b-tree); this index serves
+                # time range filters and keeps ties ordered by id
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_queries_timestamp
+                    ON queries (timestamp, id)
+                ''')
+                self._init_spatial_index(cursor)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS geocode_cache (
+                        address_key TEXT PRIMARY KEY,
+                        lat REAL,
+                        lon REAL,
+                        expires_at REAL NOT NULL
+                    )
+                ''')
+                # Progress of bulk import jobs (bulk.py), committed together
+                # with each batch of imported queries
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS import_jobs (
+                        job_id TEXT PRIMARY KEY,
+                        rows_done INTEGER NOT NULL,
+                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
             logger.info("Database initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize database: {str(e)}")
             raise
     
+    def _init_spatial_index(self, cursor: sqlite3.Cursor):
+        """
+        Create the R*Tree over query endpoints
+        
+        Each query contributes two points: rtree id = query_id * 2 for the
+        source and query_id * 2 + 1 for the destination. Triggers keep the
+        index in step with inserts and deletes on queries.
+        """
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'query_points'"
+        )
+        exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS query_points
+            USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS queries_points_insert
+            AFTER INSERT ON queries
+            BEGIN
+                INSERT INTO query_points VALUES
+                    (NEW.id * 2, NEW.source_lat, NEW.source_lat, NEW.source_lon, NEW.source_lon),
+                    (NEW.id * 2 + 1, NEW.dest_lat, NEW.dest_lat, NEW.dest_lon, NEW.dest_lon);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS queries_points_delete
+            AFTER DELETE ON queries
+            BEGIN
+                DELETE FROM query_points WHERE id IN (OLD.id * 2, OLD.id * 2 + 1);
+            END
+        ''')
+        
+        if not exists:
+            # Index queries stored before the spatial index existed
+            cursor.execute('''
+                INSERT INTO query_points
+                SELECT id * 2, source_lat, source_lat, source_lon, source_lon FROM queries
+                UNION ALL
+                SELECT id * 2 + 1, dest_lat, dest_lat, dest_lon, dest_lon FROM queries
+            ''')
+    
+    @traced('db.save_query')
+    @timed(DB_WRITE_SECONDS.labels('save_query'))
     def save_query(
         self,
         source_address: str,
@@ -70,44 +214,152 @@ class Database:
         Returns:
             int: ID of the inserted record
         """
+        row = (
+            source_address, destination_address,
+            source_lat, source_lon,
+            dest_lat, dest_lon,
+            distance_km, distance_miles
+        )
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO queries 
-                    (source_address, destination_address, source_lat, source_lon, 
-                     dest_lat, dest_lon, distance_km, distance_miles)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    source_address, destination_address,
-                    source_lat, source_lon,
-                    dest_lat, dest_lon,
-                    distance_km, distance_miles
-                ))
+                cursor.execute(INSERT_QUERY_SQL, row)
                 query_id = cursor.lastrowid or 0
                 logger.info(f"Query saved to database with ID: {query_id}")
-                return query_id
+            if self._listeners:
+                self._notify(query_id, [row])
+            return query_id
         except Exception as e:
             logger.error(f"Failed to save query: {str(e)}")
             raise
     
-    def get_history(self, limit: Optional[int] = None) -> List[Dict]:
+    @traced('db.save_queries')
+    @timed(DB_WRITE_SECONDS.labels('save_queries'))
+    def save_queries(self, rows: List[tuple]) -> int:
         """
-        Retrieve query history from database
+        Save many distance queries in a single transaction
+        
+        Args:
+            rows: Tuples of (source_address, destination_address, source_lat,
+                  source_lon, dest_lat, dest_lon, distance_km, distance_miles)
+        
+        Returns:
+            int: Number of inserted records
+        """
+        if not rows:
+            return 0
+        
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(INSERT_QUERY_SQL, rows)
+                first_id = self._first_inserted_id(cursor, len(rows))
+                logger.info(f"Saved {len(rows)} queries to database")
+            if self._listeners:
+                self._notify(first_id, rows)
+            return len(rows)
+        except Exception as e:
+            logger.error(f"Failed to save queries: {str(e)}")
+            raise
+    
+    def _first_inserted_id(self, cursor: sqlite3.Cursor, count: int) -> int:
+        """Id of the first of `count` rows just inserted in this transaction (listeners only)"""
+        if not self._listeners or not count:
+            return 0
+        cursor.execute('SELECT last_insert_rowid()')
+        return cursor.fetchone()[0] - count + 1
+    
+    @timed(DB_WRITE_SECONDS.labels('save_import_batch'))
+    def save_import_batch(self, job_id: str, rows: List[tuple], rows_done: int) -> int:
+        """
+        Save a batch of imported queries and the job's progress atomically
+        
+        Either both the rows and the new progress are committed or neither
+        is, so a resumed job never saves a batch twice.
+        
+        Args:
+            job_id: Import job identifier
+            rows: Tuples as for save_queries
+            rows_done: Input rows processed once this batch is saved
+        
+        Returns:
+            int: Number of inserted records
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(INSERT_QUERY_SQL, rows)
+                first_id = self._first_inserted_id(cursor, len(rows))
+                cursor.execute('''
+                    INSERT INTO import_jobs (job_id, rows_done) VALUES (?, ?)
+                    ON CONFLICT (job_id) DO UPDATE SET
+                        rows_done = excluded.rows_done, updated_at = CURRENT_TIMESTAMP
+                ''', (job_id, rows_done))
+            if self._listeners and rows:
+                self._notify(first_id, rows)
+            return len(rows)
+        except Exception as e:
+            logger.error(f"Failed to save import batch for job {job_id}: {str(e)}")
+            raise
+    
+    def get_import_progress(self, job_id: str) -> int:
+        """
+        Get the input rows an import job has saved so far
+        
+        Args:
+            job_id: Import job identifier
+        
+        Returns:
+            int: Rows done, 0 for an unknown job
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT rows_done FROM import_jobs WHERE job_id = ?', (job_id,))
+            row = cursor.fetchone()
+            return row['rows_done'] if row else 0
+    
+    @traced('db.get_history')
+    def get_history(
+        self,
+        limit: Optional[int] = None,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        address: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None
+    ) -> List[QueryRecord]:
+        """
+        Retrieve query history from database, newest first
+        
+        Pages are addressed with a keyset cursor on id: pass the last id of a
+        page as before_id for the next (older) page, or the first id as
+        after_id for the previous (newer) page. Both seek the primary key
+        instead of scanning past skipped rows.
         
         Args:
             limit: Maximum number of records to retrieve
+            before_id: Only return queries with an id lower than this
+            after_id: Only return queries with an id higher than this
+            address: Substring to match in the source or destination address
+            since: Only return queries at or after this timestamp ('YYYY-MM-DD HH:MM:SS')
+            until: Only return queries before this timestamp ('YYYY-MM-DD HH:MM:SS')
             
         Returns:
-            List of query dictionaries
+            List of QueryRecords
         """
         limit = limit or Config.DEFAULT_HISTORY_LIMIT
         limit = min(limit, Config.MAX_HISTORY_LIMIT)
         
+        where, params = self._history_filters(before_id, after_id, address, since, until)
+        # Paging forward from after_id walks the key upwards, then flips the page
+        order = 'ASC' if after_id is not None and before_id is None else 'DESC'
+        
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
+                # Plain tuples, unpacked straight into QueryRecords
+                cursor.row_factory = None
+                cursor.execute(f'''
                     SELECT 
                         id,
                         source_address,
@@ -120,31 +372,16 @@ class Database:
                         distance_miles,
                         timestamp
                     FROM queries
-                    ORDER BY timestamp DESC
+                    {where}
+                    ORDER BY id {order}
                     LIMIT ?
-                ''', (limit,))
+                ''', (*params, limit))
                 
                 rows = cursor.fetchall()
+                if order == 'ASC':
+                    rows.reverse()
                 
-                # Convert to list of dictionaries
-                history = []
-                for row in rows:
-                    history.append({
-                        'id': row['id'],
-                        'source': row['source_address'],
-                        'destination': row['destination_address'],
-                        'source_coords': {
-                            'lat': row['source_lat'],
-                            'lon': row['source_lon']
-                        },
-                        'destination_coords': {
-                            'lat': row['dest_lat'],
-                            'lon': row['dest_lon']
-                        },
-                        'distance_km': round(row['distance_km'], 2),
-                        'distance_miles': round(row['distance_miles'], 2),
-                        'timestamp': row['timestamp']
-                    })
+                history = [QueryRecord(*row) for row in rows]
                 
                 logger.info(f"Retrieved {len(history)} historical queries")
                 return history
@@ -153,7 +390,148 @@ class Database:
             logger.error(f"Failed to retrieve history: {str(e)}")
             raise
     
-    def get_query_by_id(self, query_id: int) -> Optional[Dict]:
+    @staticmethod
+    def _history_filters(
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        address: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None
+    ) -> tuple:
+        """Build the WHERE clause and parameters of a history query"""
+        conditions = []
+        params = []
+        
+        if before_id is not None:
+            conditions.append('id < ?')
+            params.append(before_id)
+        if after_id is not None:
+            conditions.append('id > ?')
+            params.append(after_id)
+        if address:
+            pattern = '%' + address.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append(
+                "(source_address LIKE ? ESCAPE '\\' OR destination_address LIKE ? ESCAPE '\\')"
+            )
+            params.extend([pattern, pattern])
+        if since:
+            conditions.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            conditions.append('timestamp < ?')
+            params.append(until)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return where, params
+    
+    def iter_history(
+        self,
+        chunk_size: int = 0,
+        after_id: Optional[int] = None,
+        address: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None
+    ) -> Iterator[List[tuple]]:
+        """
+        Stream the whole query history, oldest first, in chunks of rows
+        
+        Rows are read with fetchmany on a dedicated connection, so at most
+        one chunk is in memory and the pooled connection of the calling
+        thread stays free while the export is consumed. The single SELECT
+        reads one snapshot of the table: rows written during the export
+        are not included. Closing the generator early closes the connection.
+        
+        Args:
+            chunk_size: Rows per chunk (default: Config.EXPORT_CHUNK_ROWS)
+            after_id: Only return queries with an id higher than this (resume)
+            address: Substring to match in the source or destination address
+            since: Only return queries at or after this timestamp ('YYYY-MM-DD HH:MM:SS')
+            until: Only return queries before this timestamp ('YYYY-MM-DD HH:MM:SS')
+            
+        Yields:
+            Lists of (id, source, destination, source_lat, source_lon,
+            dest_lat, dest_lon, distance_km, distance_miles, timestamp)
+            tuples, in EXPORT_COLUMNS order
+        """
+        where, params = self._history_filters(after_id=after_id, address=address, since=since, until=until)
+        return self._iter_chunks(f'''
+            SELECT 
+                id,
+                source_address,
+                destination_address,
+                source_lat,
+                source_lon,
+                dest_lat,
+                dest_lon,
+                distance_km,
+                distance_miles,
+                timestamp
+            FROM queries
+            {where}
+            ORDER BY id ASC
+        ''', params, chunk_size or Config.EXPORT_CHUNK_ROWS, 'export history')
+    
+    def iter_stats_rows(self, after_id: int = 0, chunk_size: int = 0) -> Iterator[List[tuple]]:
+        """
+        Stream the columns the analytics snapshot keeps, oldest first
+        
+        Args:
+            after_id: Only return queries with an id higher than this
+            chunk_size: Rows per chunk (default: Config.EXPORT_CHUNK_ROWS)
+            
+        Yields:
+            Lists of (id, source, destination, distance_km, unix seconds) tuples
+        """
+        return self._iter_chunks('''
+            SELECT 
+                id,
+                source_address,
+                destination_address,
+                distance_km,
+                CAST(strftime('%s', timestamp) AS INTEGER)
+            FROM queries
+            WHERE id > ?
+            ORDER BY id ASC
+        ''', (after_id,), chunk_size or Config.EXPORT_CHUNK_ROWS, 'read history columns')
+    
+    def _iter_chunks(self, sql: str, params, chunk_size: int, action: str) -> Iterator[List[tuple]]:
+        """Run one SELECT on a dedicated connection and yield its rows in chunks"""
+        conn = self._connect()
+        # Plain tuples: no per-row Row objects on bulk read paths
+        conn.row_factory = None
+        try:
+            cursor = conn.execute(sql, params)
+            
+            count = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                count += len(rows)
+                yield rows
+            
+            logger.info(f"Streamed {count} historical queries ({action})")
+        except sqlite3.Error as e:
+            logger.error(f"Failed to {action}: {str(e)}")
+            raise
+        finally:
+            conn.close()
+    
+    def get_id_range(self) -> tuple:
+        """
+        Get the lowest and highest query id (two primary key seeks)
+        
+        Returns:
+            Tuple of (min id, max id), (None, None) for an empty table
+        """
+        with self.get_connection() as conn:
+            row = conn.execute(
+                'SELECT (SELECT MIN(id) FROM queries), (SELECT MAX(id) FROM queries)'
+            ).fetchone()
+            return row[0], row[1]
+    
+    @traced('db.get_query_by_id')
+    def get_query_by_id(self, query_id: int) -> Optional[QueryRecord]:
         """
         Retrieve a specific query by ID
         
@@ -161,7 +539,7 @@ class Database:
             query_id: ID of the query to retrieve
             
         Returns:
-            Query dictionary or None if not found
+            QueryRecord or None if not found
         """
         try:
             with self.get_connection() as conn:
@@ -174,26 +552,266 @@ class Database:
                 if not row:
                     return None
                 
-                return {
-                    'id': row['id'],
-                    'source': row['source_address'],
-                    'destination': row['destination_address'],
-                    'source_coords': {
-                        'lat': row['source_lat'],
-                        'lon': row['source_lon']
-                    },
-                    'destination_coords': {
-                        'lat': row['dest_lat'],
-                        'lon': row['dest_lon']
-                    },
-                    'distance_km': round(row['distance_km'], 2),
-                    'distance_miles': round(row['distance_miles'], 2),
-                    'timestamp': row['timestamp']
-                }
+                return QueryRecord(*row)
         except Exception as e:
             logger.error(f"Failed to retrieve query {query_id}: {str(e)}")
             raise
     
+    def _query_points_in(
+        self,
+        cursor: sqlite3.Cursor,
+        boxes: List[tuple],
+        lat: float,
+        lon: float,
+        limit: int,
+        endpoint: str = 'any',
+        distinct_points: bool = False
+    ) -> List:
+        """
+        Fetch queries with an endpoint inside any of the bounding boxes
+        
+        Points are ranked inside SQLite by an equirectangular estimate of
+        their distance from (lat, lon) and at most limit are fetched per box,
+        so a box over a busy area does not load its whole history. With
+        distinct_points, points at the same coordinates are grouped and only
+        the latest query at each location is fetched.
+        """
+        endpoint_filter = {
+            'any': '',
+            'source': 'AND (p.id & 1) = 0',
+            'destination': 'AND (p.id & 1) = 1'
+        }[endpoint]
+        if distinct_points:
+            select, group = 'MAX(p.id) AS id', 'GROUP BY p.min_lat, p.min_lon'
+        else:
+            select, group = 'p.id', ''
+        
+        rows = []
+        for min_lat, max_lat, min_lon, max_lon in boxes:
+            cursor.execute(f'''
+                SELECT q.*, c.id & 1 AS endpoint
+                FROM (
+                    SELECT {select}
+                    FROM query_points p
+                    WHERE p.min_lat <= :max_lat AND p.max_lat >= :min_lat
+                      AND p.min_lon <= :max_lon AND p.max_lon >= :min_lon
+                      {endpoint_filter}
+                    {group}
+                    ORDER BY (p.min_lat - :lat) * (p.min_lat - :lat)
+                        + (min(abs(p.min_lon - :lon), 360 - abs(p.min_lon - :lon)) * :cos_lat)
+                        * (min(abs(p.min_lon - :lon), 360 - abs(p.min_lon - :lon)) * :cos_lat)
+                    LIMIT :limit
+                ) c
+                JOIN queries q ON q.id = c.id >> 1
+            ''', {
+                'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon,
+                'lat': lat, 'lon': lon, 'cos_lat': math.cos(math.radians(lat)), 'limit': limit
+            })
+            rows.extend(cursor.fetchall())
+        return rows
+    
+    @staticmethod
+    def _point_distances(rows: List, lat: float, lon: float):
+        """Haversine distance from (lat, lon) to the matched endpoint of each row"""
+        point_lats = [row['dest_lat'] if row['endpoint'] else row['source_lat'] for row in rows]
+        point_lons = [row['dest_lon'] if row['endpoint'] else row['source_lon'] for row in rows]
+        distances, _ = DistanceCalculator.haversine_distances(
+            [lat] * len(rows), [lon] * len(rows), point_lats, point_lons
+        )
+        return distances
+    
+    @traced('db.find_queries_near')
+    def find_queries_near(
+        self,
+        lat: float,
+        lon: float,
+        radius_km: float,
+        endpoint: str = 'any',
+        limit: Optional[int] = None
+    ) -> List[QueryMatch]:
+        """
+        Find stored queries that start and/or end within a radius of a point
+        
+        Candidates come from the R*Tree over bounding boxes, at most
+        limit * SPATIAL_CANDIDATE_FACTOR per box, and are refined with the
+        haversine distance.
+        
+        Args:
+            lat: Latitude of the centre point
+            lon: Longitude of the centre point
+            radius_km: Search radius in kilometers
+            endpoint: 'source', 'destination' or 'any'
+            limit: Maximum number of records to retrieve
+            
+        Returns:
+            QueryMatches, nearest first
+        """
+        limit = min(limit or Config.DEFAULT_HISTORY_LIMIT, Config.MAX_HISTORY_LIMIT)
+        
+        try:
+            with self.get_connection() as conn:
+                rows = self._query_points_in(
+                    conn.cursor(), DistanceCalculator.bounding_boxes(lat, lon, radius_km), lat, lon,
+                    limit * Config.SPATIAL_CANDIDATE_FACTOR, endpoint
+                )
+            
+            matches = {}
+            for row, distance in zip(rows, self._point_distances(rows, lat, lon)):
+                if distance > radius_km:
+                    continue
+                best = matches.get(row['id'])
+                if best is None or distance < best[1]:
+                    matches[row['id']] = (row, float(distance))
+            
+            results = [
+                QueryMatch(
+                    *row[:len(QUERY_COLUMNS)],
+                    matched_endpoint='destination' if row['endpoint'] else 'source',
+                    match_distance_km=distance
+                )
+                for row, distance in sorted(matches.values(), key=lambda match: match[1])[:limit]
+            ]
+            
+            logger.info(f"Found {len(results)} queries within {radius_km} km of ({lat}, {lon})")
+            return results
+            
+        except Exception as e:
+            logger.error(f"Failed to search queries near ({lat}, {lon}): {str(e)}")
+            raise
+    
+    @traced('db.find_nearest_locations')
+    def find_nearest_locations(self, lat: float, lon: float, k: int = 10) -> List[Dict]:
+        """
+        Find the k known geocoded locations nearest to a point
+        
+        Known locations are the distinct coordinates stored as query
+        endpoints, grouped in SQL and named by the latest query there.
+        The search radius starts at SPATIAL_INITIAL_RADIUS_KM and doubles until
+        k locations lie inside it, so only nearby index pages are read.
+        
+        Args:
+            lat: Latitude of the point
+            lon: Longitude of the point
+            k: Number of locations to return
+            
+        Returns:
+            Dictionaries with 'address', 'lat', 'lon' and 'distance_km', nearest first
+        """
+        radius_km = Config.SPATIAL_INITIAL_RADIUS_KM
+        max_radius_km = math.pi * Config.EARTH_RADIUS_KM
+        
+        try:
+            while True:
+                with self.get_connection() as conn:
+                    rows = self._query_points_in(
+                        conn.cursor(), DistanceCalculator.bounding_boxes(lat, lon, radius_km), lat, lon,
+                        k * Config.SPATIAL_CANDIDATE_FACTOR, distinct_points=True
+                    )
+                
+                locations = {}
+                for row, distance in zip(rows, self._point_distances(rows, lat, lon)):
+                    if distance > radius_km:
+                        continue
+                    if row['endpoint']:
+                        address, point = row['destination_address'], (row['dest_lat'], row['dest_lon'])
+                    else:
+                        address, point = row['source_address'], (row['source_lat'], row['source_lon'])
+                    locations.setdefault((address, point), float(distance))
+                
+                if len(locations) >= k or radius_km >= max_radius_km:
+                    break
+                radius_km = min(radius_km * 2, max_radius_km)
+            
+            nearest = sorted(locations.items(), key=lambda item: item[1])[:k]
+            return [
+                {'address': address, 'lat': point[0], 'lon': point[1], 'distance_km': round(distance, 2)}
+                for (address, point), distance in nearest
+            ]
+            
+        except Exception as e:
+            logger.error(f"Failed to find locations near ({lat}, {lon}): {str(e)}")
+            raise
+    
+    @traced('db.get_geocode')
+    def get_geocode(self, address_key: str) -> Optional[Dict]:
+        """
+        Retrieve a persisted geocode cache entry
+        
+        Args:
+            address_key: Normalized address
+            
+        Returns:
+            Dictionary with 'lat', 'lon' and 'expires_at' keys or None if not found
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT lat, lon, expires_at FROM geocode_cache WHERE address_key = ?
+            ''', (address_key,))
+            
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            return {
+                'lat': row['lat'],
+                'lon': row['lon'],
+                'expires_at': row['expires_at']
+            }
+    
+    @traced('db.save_geocode')
+    def save_geocode(
+        self,
+        address_key: str,
+        lat: Optional[float],
+        lon: Optional[float],
+        expires_at: float
+    ):
+        """
+        Insert or refresh a geocode cache entry
+        
+        Args:
+            address_key: Normalized address
+            lat: Latitude, or None for a negative result
+            lon: Longitude, or None for a negative result
+            expires_at: Expiry as a Unix timestamp
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO geocode_cache (address_key, lat, lon, expires_at)
+                VALUES (?, ?, ?, ?)
+            ''', (address_key, lat, lon, expires_at))
+    
+    @traced('db.delete_geocode')
+    def delete_geocode(self, address_key: str):
+        """
+        Delete a geocode cache entry
+        
+        Args:
+            address_key: Normalized address
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM geocode_cache WHERE address_key = ?', (address_key,))
+    
+    def purge_expired_geocodes(self, now: float) -> int:
+        """
+        Delete expired geocode cache entries
+        
+        Args:
+            now: Current Unix timestamp
+            
+        Returns:
+            int: Number of deleted entries
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM geocode_cache WHERE expires_at <= ?', (now,))
+            deleted_count = cursor.rowcount
+            logger.info(f"Purged {deleted_count} expired geocode cache entries")
+            return deleted_count
+    
     def clear_history(self):
         """Clear all query history (use with caution)"""
         try:
@@ -202,7 +820,8 @@ class Database:
                 cursor.execute('DELETE FROM queries')
                 deleted_count = cursor.rowcount
                 logger.warning(f"Cleared {deleted_count} queries from history")
-                return deleted_count
+            self._notify(0, [])
+            return deleted_count
         except Exception as e:
             logger.error(f"Failed to clear history: {str(e)}")
             raise
@@ -0,0 +1,201 @@
+"""
+History export
+Encodes chunks of query history rows as CSV, NDJSON, Arrow IPC or Parquet
+one chunk at a time, so an export of any size is streamed in constant memory
+
+Arrow and Parquet need the optional pyarrow package.
+"""
+
+import csv
+import importlib.util
+import io
+import json
+import logging
+from typing import Iterable, Iterator, List
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ExportError(Exception):
+    """Custom exception for history export errors"""
+    pass
+
+
+# Column order of the rows yielded by Database.iter_history
+EXPORT_COLUMNS = (
+    'id', 'source', 'destination', 'source_lat', 'source_lon',
+    'dest_lat', 'dest_lon', 'distance_km', 'distance_miles', 'timestamp'
+)
+
+FORMATS = ('csv', 'ndjson', 'arrow', 'parquet')
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+EXTENSIONS = {'csv': 'csv', 'ndjson': 'ndjson', 'arrow': 'arrows', 'parquet': 'parquet'}
+
+
+def _pyarrow():
+    """Import pyarrow on first use (None if it is not installed)"""
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    return pyarrow
+
+
+# Formats that need pyarrow; the others are written with the standard library
+PYARROW_FORMATS = ('arrow', 'parquet')
+
+
+def format_available(fmt: str) -> bool:
+    """
+    Whether this installation can export a format
+
+    pyarrow is looked up without importing it, so CSV and NDJSON exports
+    never load it.
+    """
+    if fmt not in FORMATS:
+        return False
+    return fmt not in PYARROW_FORMATS or importlib.util.find_spec('pyarrow') is not None
+
+
+def available_formats() -> List[str]:
+    """Formats this installation can export (arrow and parquet need pyarrow)"""
+    return [fmt for fmt in FORMATS if format_available(fmt)]
+
+
+def encode_chunks(chunks: Iterable[List[tuple]], fmt: str) -> Iterator[bytes]:
+    """
+    Encode chunks of history rows into a byte stream
+
+    Each input chunk produces one output piece (plus a trailer for Arrow
+    and Parquet), so the caller can send it and drop it before the next
+    chunk is read.
+
+    Args:
+        chunks: Lists of row tuples in EXPORT_COLUMNS order
+        fmt: One of FORMATS
+
+    Returns:
+        Iterator of encoded byte strings
+
+    Raises:
+        ExportError: If the format is unknown or needs pyarrow and it is missing
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown export format: {fmt}")
+    if not format_available(fmt):
+        raise ExportError(f"Export format {fmt} requires the pyarrow package")
+
+    if fmt == 'csv':
+        return _csv_chunks(chunks)
+    if fmt == 'ndjson':
+        return _ndjson_chunks(chunks)
+    return _arrow_chunks(chunks, parquet=fmt == 'parquet')
+
+
+def _csv_chunks(chunks: Iterable[List[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode('utf-8')
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(chunks: Iterable[List[tuple]]) -> Iterator[bytes]:
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows
+        ).encode('utf-8')
+
+
+class _ChunkSink:
+    """Write-only file object collecting what pyarrow writes until drained"""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _schema(pa):
+    return pa.schema([
+        ('id', pa.int64()),
+        ('source', pa.string()),
+        ('destination', pa.string()),
+        ('source_lat', pa.float64()),
+        ('source_lon', pa.float64()),
+        ('dest_lat', pa.float64()),
+        ('dest_lon', pa.float64()),
+        ('distance_km', pa.float64()),
+        ('distance_miles', pa.float64()),
+        ('timestamp', pa.timestamp('s')),
+    ])
+
+
+def _record_batch(pa, schema, rows: List[tuple]):
+    columns = list(zip(*rows))
+    arrays = [
+        # SQLite keeps timestamps as 'YYYY-MM-DD HH:MM:SS' text
+        pa.array(values, pa.string()).cast(field.type) if field.name == 'timestamp'
+        else pa.array(values, field.type)
+        for field, values in zip(schema, columns)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _arrow_chunks(chunks: Iterable[List[tuple]], parquet: bool) -> Iterator[bytes]:
+    pa = _pyarrow()
+    schema = _schema(pa)
+    sink = _ChunkSink()
+    if parquet:
+        import pyarrow.parquet as pq
+        compression = Config.EXPORT_PARQUET_COMPRESSION
+        writer = pq.ParquetWriter(sink, schema, compression=None if compression == 'none' else compression)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    try:
+        for rows in chunks:
+            batch = _record_batch(pa, schema, rows)
+            if parquet:
+                # One row group per chunk, written out as soon as it is complete
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            yield sink.drain()
+    finally:
+        # Arrow's end-of-stream marker, Parquet's footer
+        writer.close()
+    yield sink.drain()
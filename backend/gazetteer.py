@@ -0,0 +1,477 @@
+import os
+import csv
+import mmap
+import heapq
+import shutil
+import struct
+import sys
+import logging
+import tempfile
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cache import normalize_address
+from config import Config
+from utils import DistanceCalculator
+
+logger = logging.getLogger(__name__)
+
+
+class GazetteerError(Exception):
+    """Custom exception for gazetteer errors"""
+    pass
+
+
+# Index file layout (little-endian, whatever the byte order of the host):
+#   header   magic, record count, key blob size
+#   offsets  (count + 1) uint64 offsets into the key blob
+#   lats     count float64
+#   lons     count float64
+#   flags    count uint8 (AMBIGUOUS)
+#   keys     normalized UTF-8 names, sorted, concatenated
+INDEX_MAGIC = b'GAZIDX02'
+HEADER = struct.Struct('<8sQQ')
+
+# Set when other places share the name and none is clearly the most populous
+AMBIGUOUS = 1
+
+# Temporary sort runs: key length, lat, lon, population, then the key
+_RUN_RECORD = struct.Struct('<Hddq')
+
+# GeoNames dump columns (geoname table, tab separated, no header)
+GEONAMES_NAME = 1
+GEONAMES_ASCIINAME = 2
+GEONAMES_LAT = 4
+GEONAMES_LON = 5
+GEONAMES_POPULATION = 14
+
+
+class _Keys:
+    """Sequence view of the sorted key blob, so bisect can search it in place"""
+
+    __slots__ = ('_offsets', '_blob')
+
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> bytes:
+        return bytes(self._blob[self._offsets[index]:self._offsets[index + 1]])
+
+
+class Gazetteer:
+    """
+    Offline place name index backed by a memory-mapped file
+
+    The index is a sorted array of normalized names with their coordinates,
+    built once from a GeoNames dump (TSV) or a CSV with name/lat/lon columns.
+    Opening it only maps the file, so load time and resident memory do not
+    grow with the number of rows; lookups are a binary search over the map.
+    When a name occurs more than once, the most populous place is kept, and
+    the name is marked ambiguous unless that place has more than
+    GAZETTEER_DOMINANT_RATIO times the population of any other place of
+    the name (entries within GAZETTEER_SAME_PLACE_KM are the same place).
+    """
+
+    def __init__(self, path: str):
+        """
+        Map an index file
+
+        Args:
+            path: Path to a file written by Gazetteer.build
+
+        Raises:
+            GazetteerError: If the file is not a gazetteer index
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise GazetteerError(f"Gazetteer index is empty: {path}")
+
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise GazetteerError(f"Not a gazetteer index: {path}")
+        magic, count, keys_size = HEADER.unpack_from(self._map)
+        if magic != INDEX_MAGIC:
+            self.close()
+            if magic.startswith(INDEX_MAGIC[:6]):
+                raise GazetteerError(f"Gazetteer index has an old format, rebuild it: {path}")
+            raise GazetteerError(f"Not a gazetteer index: {path}")
+
+        start = HEADER.size
+        offsets_end = start + (count + 1) * 8
+        lats_end = offsets_end + count * 8
+        lons_end = lats_end + count * 8
+        flags_end = lons_end + count
+        if len(self._map) < flags_end + keys_size:
+            size = len(self._map)
+            self.close()
+            raise GazetteerError(
+                f"Gazetteer index is truncated ({size} bytes, header needs {flags_end + keys_size}), rebuild it: {path}"
+            )
+
+        view = memoryview(self._map)
+        self._offsets = _little_endian(view[start:offsets_end], 'Q')
+        self._lats = _little_endian(view[offsets_end:lats_end], 'd')
+        self._lons = _little_endian(view[lats_end:lons_end], 'd')
+        self._flags = view[lons_end:flags_end]
+        self._blob = view[flags_end:flags_end + keys_size]
+        self._keys = _Keys(self._offsets, self._blob)
+
+        logger.info(f"Loaded gazetteer with {count} names from {path}")
+
+    @classmethod
+    def open(cls, path: str) -> 'Gazetteer':
+        """
+        Open a gazetteer, building the index first if path is a source file
+
+        A source file is indexed to `<path>.idx`, which is rebuilt whenever
+        the source is newer or the index cannot be opened (e.g. truncated).
+
+        Args:
+            path: Index file, GeoNames TSV or CSV
+
+        Returns:
+            Gazetteer
+        """
+        if _read_magic(path).startswith(INDEX_MAGIC[:6]):
+            return cls(path)
+
+        index_path = f"{path}.idx"
+        if (
+            not os.path.exists(index_path)
+            or os.path.getmtime(index_path) < os.path.getmtime(path)
+            or _read_magic(index_path) != INDEX_MAGIC
+        ):
+            cls.build(path, index_path)
+            return cls(index_path)
+
+        try:
+            return cls(index_path)
+        except GazetteerError as e:
+            logger.warning(f"{e}; rebuilding from {path}")
+            cls.build(path, index_path)
+            return cls(index_path)
+
+    @classmethod
+    def from_config(cls) -> 'Gazetteer':
+        """Open the gazetteer at Config.GAZETTEER_PATH"""
+        return cls.open(Config.GAZETTEER_PATH)
+
+    @staticmethod
+    def build(source: str, dest: str, chunk_rows: int = 0) -> int:
+        """
+        Build an index file from a GeoNames TSV or a CSV
+
+        Rows are sorted in chunks of chunk_rows and merged from temporary
+        run files, so memory use is bounded by the chunk size rather than
+        the size of the source.
+
+        Args:
+            source: GeoNames dump (.tsv/.txt) or CSV with a header containing
+                    name, lat/latitude, lon/lng/longitude and optionally population
+            dest: Index file to write (written to a temporary file next to
+                  it and renamed, so concurrent builds never expose a partial file)
+            chunk_rows: Rows sorted in memory at once (defaults to
+                        Config.GAZETTEER_BUILD_CHUNK_ROWS)
+
+        Returns:
+            Number of names in the index
+        """
+        chunk_rows = chunk_rows or Config.GAZETTEER_BUILD_CHUNK_ROWS
+        logger.info(f"Building gazetteer index {dest} from {source}")
+
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(dest))) as tmp:
+            runs = _write_sorted_runs(_read_source(source), chunk_rows, tmp)
+            count = _write_index(heapq.merge(*(_read_run(run) for run in runs)), dest, tmp)
+
+        logger.info(f"Built gazetteer index with {count} names")
+        return count
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _find(self, key: str) -> Optional[int]:
+        """Position of a normalized name, or None if not indexed"""
+        key = key.encode('utf-8')
+        index = bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return index
+        return None
+
+    def _coords(self, index: int) -> Dict[str, float]:
+        return {'lat': self._lats[index], 'lon': self._lons[index]}
+
+    def exact(self, name: str) -> Optional[Dict[str, float]]:
+        """
+        Look up a place by its full name
+
+        Args:
+            name: Place name (normalized internally)
+
+        Returns:
+            Dictionary with 'lat' and 'lon' keys (the most populous place
+            of the name), or None if not indexed
+        """
+        index = self._find(normalize_address(name))
+        return None if index is None else self._coords(index)
+
+    def ambiguous(self, name: str) -> bool:
+        """Whether other places of similar size share the name"""
+        index = self._find(normalize_address(name))
+        return index is not None and bool(self._flags[index] & AMBIGUOUS)
+
+    def prefix(self, text: str, limit: int = 10) -> List[Dict[str, object]]:
+        """
+        Look up places whose name starts with text
+
+        Args:
+            text: Name prefix (normalized internally)
+            limit: Maximum number of results
+
+        Returns:
+            List of dictionaries with 'name', 'lat' and 'lon', in name order
+        """
+        key = normalize_address(text).encode('utf-8')
+        results = []
+        index = bisect_left(self._keys, key)
+        while index < len(self._keys) and len(results) < limit:
+            name = self._keys[index]
+            if not name.startswith(key):
+                break
+            results.append({
+                'name': name.decode('utf-8'),
+                'lat': self._lats[index],
+                'lon': self._lons[index],
+            })
+            index += 1
+        return results
+
+    def lookup(self, address: str) -> Optional[Dict[str, float]]:
+        """
+        Geocoder backend interface
+
+        Tries the full name, then the locality before the first comma
+        ("Paris, France" -> "paris"). Ambiguous names are a miss, so the
+        remote geocoder resolves them from the whole address. So is a
+        locality with a qualifier that is itself indexed more than
+        GAZETTEER_QUALIFIER_KM away ("Paris, Texas" when the index knows
+        Texas but only Paris, France).
+
+        Args:
+            address: Address as entered
+
+        Returns:
+            Dictionary with 'lat' and 'lon' keys, or None
+        """
+        key = normalize_address(address)
+        index = self._find(key)
+        if index is None:
+            locality, _, qualifiers = key.partition(',')
+            if not qualifiers:
+                return None
+            index = self._find(locality.strip())
+            if index is None or not self._qualifiers_match(index, qualifiers.split(',')):
+                return None
+        if self._flags[index] & AMBIGUOUS:
+            return None
+        return self._coords(index)
+
+    def _qualifiers_match(self, index: int, qualifiers: List[str]) -> bool:
+        for qualifier in qualifiers:
+            other = self._find(qualifier.strip())
+            if other is None or self._flags[other] & AMBIGUOUS:
+                continue
+            distance = DistanceCalculator.haversine_distance(
+                self._lats[index], self._lons[index], self._lats[other], self._lons[other]
+            )
+            if distance > Config.GAZETTEER_QUALIFIER_KM:
+                return False
+        return True
+
+    def close(self):
+        """Unmap the index file"""
+        for name in ('_offsets', '_lats', '_lons', '_flags', '_blob'):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+        self._file.close()
+
+
+def _read_magic(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read(len(INDEX_MAGIC))
+
+
+def _little_endian(view: memoryview, typecode: str) -> memoryview:
+    """Typed view of little-endian data; copied and swapped on big-endian hosts"""
+    if sys.byteorder == 'little':
+        return view.cast(typecode)
+    values = array(typecode)
+    values.frombytes(view)
+    values.byteswap()
+    return memoryview(values)
+
+
+def _write_little_endian(values: array, f):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(f)
+
+
+def _read_source(path: str) -> Iterator[Tuple[bytes, float, float, int]]:
+    """Yield (key, lat, lon, population) for every name in a source file"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            reader = csv.DictReader(f)
+            columns = {name.lower(): name for name in reader.fieldnames or ()}
+            lat_col = columns.get('lat') or columns.get('latitude')
+            lon_col = columns.get('lon') or columns.get('lng') or columns.get('longitude')
+            if 'name' not in columns or not lat_col or not lon_col:
+                raise GazetteerError("CSV gazetteer needs name, lat and lon columns")
+            pop_col = columns.get('population')
+            for row in reader:
+                yield from _entries(
+                    (row[columns['name']],), row[lat_col], row[lon_col],
+                    row.get(pop_col) if pop_col else None
+                )
+        else:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) <= GEONAMES_POPULATION:
+                    continue
+                yield from _entries(
+                    (fields[GEONAMES_NAME], fields[GEONAMES_ASCIINAME]),
+                    fields[GEONAMES_LAT], fields[GEONAMES_LON], fields[GEONAMES_POPULATION]
+                )
+
+
+def _entries(names, lat, lon, population):
+    try:
+        lat, lon = float(lat), float(lon)
+        population = int(population or 0)
+    except ValueError:
+        return
+    keys = {normalize_address(name) for name in names if name}
+    for key in keys:
+        if key:
+            yield key.encode('utf-8'), lat, lon, population
+
+
+def _write_sorted_runs(entries, chunk_rows: int, tmp: str) -> List[str]:
+    """Sort entries in chunks of chunk_rows and write each chunk to a run file"""
+    runs = []
+    chunk = []
+
+    def flush():
+        # Most populous first within a name, so deduplication keeps it
+        chunk.sort(key=lambda entry: (entry[0], -entry[3]))
+        path = os.path.join(tmp, f"run-{len(runs)}.bin")
+        with open(path, 'wb') as f:
+            for key, lat, lon, population in chunk:
+                f.write(_RUN_RECORD.pack(len(key), lat, lon, population))
+                f.write(key)
+        runs.append(path)
+        chunk.clear()
+
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= chunk_rows:
+            flush()
+    if chunk or not runs:
+        flush()
+    return runs
+
+
+def _read_run(path: str) -> Iterator[Tuple[bytes, int, float, float]]:
+    """Yield (key, -population, lat, lon) in run order, the heapq.merge sort key"""
+    with open(path, 'rb', buffering=1 << 20) as f:
+        while True:
+            header = f.read(_RUN_RECORD.size)
+            if not header:
+                return
+            length, lat, lon, population = _RUN_RECORD.unpack(header)
+            yield f.read(length), -population, lat, lon
+
+
+def _write_index(entries, dest: str, tmp: str, buffer_rows: int = 65536) -> int:
+    """
+    Write merged entries to dest, keeping the first entry of each name
+
+    The first entry is the most populous; the name is flagged AMBIGUOUS if a
+    later entry is another place that the first does not clearly outnumber.
+    """
+    offsets = array('Q', [0])
+    lats = array('d')
+    lons = array('d')
+    flags = bytearray()
+    count = 0
+    keys_size = 0
+    previous = None
+    kept_population = 0
+
+    sections = [os.path.join(tmp, name) for name in ('offsets', 'lats', 'lons', 'flags', 'keys')]
+    files = [open(path, 'wb') for path in sections]
+    offsets_file, lats_file, lons_file, flags_file, keys_file = files
+
+    def flush():
+        _write_little_endian(offsets, offsets_file)
+        _write_little_endian(lats, lats_file)
+        _write_little_endian(lons, lons_file)
+        flags_file.write(flags)
+        del offsets[:], lats[:], lons[:], flags[:]
+
+    try:
+        for key, negative_population, lat, lon in entries:
+            if key == previous:
+                other_population = -negative_population
+                if not flags[-1] and _other_place(lats[-1], lons[-1], kept_population, lat, lon, other_population):
+                    flags[-1] = AMBIGUOUS
+                continue
+            # Flush before a new name so the flag of the current one stays in the buffer
+            if len(lats) >= buffer_rows:
+                flush()
+            previous = key
+            kept_population = -negative_population
+            keys_file.write(key)
+            keys_size += len(key)
+            offsets.append(keys_size)
+            lats.append(lat)
+            lons.append(lon)
+            flags.append(0)
+            count += 1
+        flush()
+    finally:
+        for f in files:
+            f.close()
+
+    # Assembled inside the build's own temporary directory (next to dest),
+    # so concurrent builds never share a partial file and the rename is atomic
+    partial = os.path.join(tmp, 'index')
+    with open(partial, 'wb') as out:
+        out.write(HEADER.pack(INDEX_MAGIC, count, keys_size))
+        for path in sections:
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, out, 1 << 20)
+    os.replace(partial, dest)
+    return count
+
+
+def _other_place(
+    lat: float, lon: float, population: int,
+    other_lat: float, other_lon: float, other_population: int
+) -> bool:
+    """Whether an entry is a distinct place that the kept place does not clearly outnumber"""
+    if DistanceCalculator.haversine_distance(lat, lon, other_lat, other_lon) <= Config.GAZETTEER_SAME_PLACE_KM:
+        return False
+    return population <= other_population * Config.GAZETTEER_DOMINANT_RATIO
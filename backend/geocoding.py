@@ -1,8 +1,18 @@
 import requests
+from requests.adapters import HTTPAdapter
+import asyncio
 import logging
-from typing import Dict, Optional
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
 
+from cache import normalize_address
 from config import Config
+from gazetteer import Gazetteer, GazetteerError
+from metrics import GEOCODE_SECONDS, NOMINATIM_SECONDS, count_error, registry, timed
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -12,17 +22,277 @@ class GeocodingError(Exception):
     pass
 
 
+class RateLimiter:
+    """
+    Token bucket rate limiter shared by all geocoding workers
+    
+    Callers reserve a token and sleep until it becomes available, so
+    concurrent workers are served in arrival order at the configured rate.
+    """
+    
+    _shared = {}
+    _shared_lock = threading.Lock()
+    
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Args:
+            rate: Tokens added per second
+            burst: Maximum number of tokens that can accumulate
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def for_provider(cls, base_url: str) -> 'RateLimiter':
+        """
+        Get the process-wide limiter for a provider
+        
+        Args:
+            base_url: Provider base URL
+            
+        Returns:
+            RateLimiter shared by every Geocoder talking to base_url
+        """
+        with cls._shared_lock:
+            limiter = cls._shared.get(base_url)
+            if limiter is None:
+                limiter = cls(Config.NOMINATIM_RATE_LIMIT, Config.NOMINATIM_RATE_BURST)
+                cls._shared[base_url] = limiter
+            return limiter
+    
+    def reserve(self) -> float:
+        """
+        Take a token without waiting for it
+        
+        Returns:
+            Seconds until the reserved token becomes available
+        """
+        if self.rate <= 0:
+            return 0.0
+        
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+    
+    def acquire(self) -> float:
+        """
+        Block until a token is available
+        
+        Returns:
+            Seconds spent waiting
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+REMOTE_BACKEND = 'nominatim'
+
+# Local backend factories by Config.GEOCODER_BACKEND name
+LOCAL_BACKENDS = {
+    'local': Gazetteer.from_config,
+}
+
+
 class Geocoder:
-    """Geocoder using Nominatim (OpenStreetMap) API"""
+    """
+    Geocoder using local backends with Nominatim (OpenStreetMap) API as fallback
+    
+    A local backend is any object with a lookup(address) method returning a
+    {'lat', 'lon'} dictionary or None. Local backends are tried in order
+    before the cache and Nominatim; their results are not cached since a
+    lookup is already cheaper than a cache read.
+    """
     
-    def __init__(self):
-        """Initialize geocoder with configuration"""
-        self.base_url = Config.NOMINATIM_BASE_URL
+    def __init__(
+        self,
+        cache=None,
+        base_url: str = "",
+        rate_limiter: Optional[RateLimiter] = None,
+        backends: Optional[List] = None,
+        fuzzy_index=None
+    ):
+        """
+        Initialize geocoder with configuration
+        
+        Args:
+            cache: Optional GeocodeCache consulted before calling Nominatim
+            base_url: Nominatim base URL (defaults to Config.NOMINATIM_BASE_URL)
+            rate_limiter: Limiter for upstream requests (defaults to the shared
+                          limiter for base_url)
+            backends: Local backends (defaults to those named in
+                      Config.GEOCODER_BACKEND)
+            fuzzy_index: Optional FuzzyAddressIndex consulted after a cache
+                         miss, before calling Nominatim
+        """
+        names = [name.strip() for name in Config.GEOCODER_BACKEND.split(',') if name.strip()]
+        self.remote_enabled = REMOTE_BACKEND in names
+        self.backends = self._create_backends(names) if backends is None else list(backends)
+        
+        self.cache = cache
+        self.fuzzy_index = fuzzy_index
+        self.base_url = base_url or Config.NOMINATIM_BASE_URL
         self.timeout = Config.NOMINATIM_TIMEOUT
         self.headers = {
             'User-Agent': Config.NOMINATIM_USER_AGENT
         }
+        self.rate_limiter = rate_limiter or RateLimiter.for_provider(self.base_url)
+        self.max_workers = Config.GEOCODE_MAX_WORKERS
+        self.max_retries = Config.NOMINATIM_MAX_RETRIES
+        self.session = self._create_session()
+        
+        self._stats = {'requests': 0, 'retries': 0, 'local_hits': 0}
+        self._stats_lock = threading.Lock()
+        
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._executor = None
+        self._executor_workers = 0
+        self._executor_lock = threading.Lock()
+    
+    @staticmethod
+    def _create_backends(names: List[str]) -> List:
+        """Open the local backends named in Config.GEOCODER_BACKEND"""
+        backends = []
+        for name in names:
+            if name == REMOTE_BACKEND:
+                continue
+            factory = LOCAL_BACKENDS.get(name)
+            if factory is None:
+                raise ValueError(f"Unknown geocoder backend: {name}")
+            try:
+                backends.append(factory())
+            except (OSError, GazetteerError) as e:
+                logger.error(f"Failed to open {name} geocoder backend: {str(e)}")
+        return backends
+    
+    def _create_session(self) -> requests.Session:
+        """Create a keep-alive session with a bounded connection pool"""
+        session = requests.Session()
+        session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=Config.NOMINATIM_POOL_CONNECTIONS,
+            pool_maxsize=Config.NOMINATIM_POOL_SIZE
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    @traced('nominatim')
+    def _request(self, path: str, params: dict) -> requests.Response:
+        """
+        Send a GET request to Nominatim over the pooled session
+        
+        429 and 5xx responses are retried up to max_retries times with
+        exponential backoff and full jitter (honouring Retry-After).
+        
+        Raises:
+            requests.exceptions.RequestException: If the request ultimately fails
+        """
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        
+        while True:
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            if registry.enabled:
+                NOMINATIM_SECONDS.observe(time.perf_counter() - start)
+            
+            with self._stats_lock:
+                self._stats['requests'] += 1
+            
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                response.raise_for_status()
+                return response
+            
+            delay = self._backoff_delay(attempt, response.headers.get('Retry-After'))
+            attempt += 1
+            with self._stats_lock:
+                self._stats['retries'] += 1
+            logger.warning(
+                f"Nominatim returned {response.status_code}, retry {attempt}/{self.max_retries} in {delay:.2f}s"
+            )
+            response.close()
+            time.sleep(delay)
+    
+    @staticmethod
+    def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+        """Exponential backoff with full jitter, at least Retry-After seconds"""
+        delay = random.uniform(0, min(
+            Config.NOMINATIM_BACKOFF_MAX,
+            Config.NOMINATIM_BACKOFF_BASE * (2 ** attempt)
+        ))
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), Config.NOMINATIM_BACKOFF_MAX))
+            except ValueError:
+                pass
+        return delay
+    
+    def connection_stats(self) -> Dict[str, float]:
+        """
+        Get connection pool counters
+        
+        Returns:
+            Dictionary with requests sent, retries, lookups answered by a
+            local backend, connections opened, requests served on a reused
+            connection and the reuse ratio
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        
+        opened = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+        
+        stats['connections_opened'] = opened
+        stats['connections_reused'] = max(0, stats['requests'] - opened)
+        stats['reuse_ratio'] = round(stats['connections_reused'] / stats['requests'], 4) if stats['requests'] else 0.0
+        return stats
     
+    def close(self):
+        """Close pooled connections, the batch thread pool and local backends"""
+        self.session.close()
+        for backend in self.backends:
+            if hasattr(backend, 'close'):
+                backend.close()
+        self.backends = []
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def reset(self):
+        """
+        Start over with a new session and no batch thread pool
+
+        Used in forked server workers: pooled sockets, pool threads and
+        in-flight lookups inherited from the parent process are dropped
+        without being closed, since the parent still owns them.
+        """
+        self.session = self._create_session()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._executor = None
+        self._executor_workers = 0
+        self._executor_lock = threading.Lock()
+
+    @traced('geocode')
+    @timed(GEOCODE_SECONDS.labels('sync'))
     def geocode(self, address: str) -> Dict[str, float]:
         """
         Geocode an address to coordinates
@@ -36,48 +306,158 @@ class Geocoder:
         Raises:
             GeocodingError: If geocoding fails
         """
+        coords = self._resolve_known(address)
+        if coords is None:
+            coords = self._fetch_coalesced(address)
+        
+        if coords is None:
+            raise GeocodingError(f"Could not find address: {address}")
+        
+        return dict(coords)
+    
+    def _resolve_known(self, address: str) -> Optional[Dict[str, float]]:
+        """
+        Resolve an address without calling Nominatim
+        
+        Tries the local backends, the cache and the fuzzy index in that order.
+        
+        Returns:
+            Coordinates, or None if Nominatim has to be asked
+            
+        Raises:
+            GeocodingError: If the address is known not to exist, or is not
+                            found locally and Nominatim is disabled
+        """
+        coords = self._lookup_local(address)
+        if coords is not None:
+            return coords
+        
+        if not self.remote_enabled:
+            raise GeocodingError(f"Could not find address: {address}")
+        
+        if self.cache is not None:
+            entry = self.cache.get(address)
+            if entry is not None:
+                if not entry.found:
+                    raise GeocodingError(f"Could not find address: {address}")
+                logger.info(f"Geocode cache hit: {address}")
+                if self.fuzzy_index is not None:
+                    self.fuzzy_index.add(address)
+                return entry.coords
+        
+        if self.fuzzy_index is not None:
+            return self.fuzzy_index.lookup(address)
+        
+        return None
+    
+    def _remember(self, address: str, coords: Optional[Dict[str, float]]):
+        """Store a Nominatim result in the cache and the fuzzy index"""
+        if self.cache is not None:
+            self.cache.set(address, coords)
+            if coords is not None and self.fuzzy_index is not None:
+                self.fuzzy_index.add(address)
+    
+    def _lookup_local(self, address: str) -> Optional[Dict[str, float]]:
+        """Try each local backend in order, returning the first match"""
+        for backend in self.backends:
+            try:
+                coords = backend.lookup(address)
+            except Exception as e:
+                logger.error(f"Local geocoder backend failed for {address}: {str(e)}")
+                continue
+            if coords is not None:
+                with self._stats_lock:
+                    self._stats['local_hits'] += 1
+                return coords
+        return None
+    
+    def _fetch_coalesced(self, address: str) -> Optional[Dict[str, float]]:
+        """
+        Fetch an address, sharing one upstream call between concurrent callers
+        
+        The first caller for a normalized address performs the request and
+        fills the cache; callers arriving while it is in flight wait for its
+        result (or exception) instead of issuing their own request.
+        """
+        key = normalize_address(address)
+        
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        
+        if not owner:
+            logger.info(f"Joining in-flight geocode request: {address}")
+            return future.result()
+        
+        try:
+            coords = self._fetch(address)
+            self._remember(address, coords)
+            future.set_result(coords)
+            return coords
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+    
+    def _fetch(self, address: str) -> Optional[Dict[str, float]]:
+        """
+        Query Nominatim for an address
+        
+        Args:
+            address: Address string to geocode
+            
+        Returns:
+            Dictionary with 'lat' and 'lon' keys, or None if there were no results
+            
+        Raises:
+            GeocodingError: If the request or response parsing fails
+        """
         logger.info(f"Geocoding address: {address}")
         
         try:
-            url = f"{self.base_url}/search"
             params = {
                 'q': address,
                 'format': 'json',
                 'limit': 1
             }
-            response = requests.get(
-                url,
-                params=params,
-                headers=self.headers,
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            if not data:
-                logger.warning(f"No results found for address: {address}")
-                raise GeocodingError(f"Could not find address: {address}")
-            
-            result = data[0]
-            lat = float(result['lat'])
-            lon = float(result['lon'])
+            response = self._request('/search', params)
+            return self._parse_search(address, response.json())
             
-            logger.info(f"Successfully geocoded: {address} -> ({lat}, {lon})")
-            
-            return {'lat': lat, 'lon': lon}
-            
-        except requests.exceptions.Timeout:
+        except requests.exceptions.Timeout as e:
+            count_error(e)
             logger.error(f"Timeout while geocoding address: {address}")
             raise GeocodingError("Geocoding service timed out. Please try again.")
         
         except requests.exceptions.RequestException as e:
+            count_error(e)
             logger.error(f"Request error while geocoding {address}: {str(e)}")
             raise GeocodingError("Failed to connect to geocoding service")
         
         except (KeyError, ValueError, IndexError) as e:
+            count_error(e)
             logger.error(f"Error parsing geocoding response for {address}: {str(e)}")
             raise GeocodingError("Invalid geocoding response")
     
+    @staticmethod
+    def _parse_search(address: str, data: list) -> Optional[Dict[str, float]]:
+        """Extract coordinates from a /search response (None if there were no results)"""
+        if not data:
+            logger.warning(f"No results found for address: {address}")
+            return None
+        
+        result = data[0]
+        lat = float(result['lat'])
+        lon = float(result['lon'])
+        
+        logger.info(f"Successfully geocoded: {address} -> ({lat}, {lon})")
+        
+        return {'lat': lat, 'lon': lon}
+    
     def reverse_geocode(self, lat: float, lon: float) -> Optional[str]:
         """
         Reverse geocode coordinates to an address
@@ -92,21 +472,13 @@ class Geocoder:
         logger.info(f"Reverse geocoding coordinates: ({lat}, {lon})")
         
         try:
-            url = f"{self.base_url}/reverse"
             params = {
                 'lat': lat,
                 'lon': lon,
                 'format': 'json'
             }
             
-            response = requests.get(
-                url,
-                params=params,
-                headers=self.headers,
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            
+            response = self._request('/reverse', params)
             data = response.json()
             
             if 'display_name' in data:
@@ -120,24 +492,222 @@ class Geocoder:
             logger.error(f"Error reverse geocoding ({lat}, {lon}): {str(e)}")
             return None
     
-    def batch_geocode(self, addresses: list) -> Dict[str, Dict[str, float]]:
+    def batch_geocode(self, addresses: list, max_workers: int = 0) -> Dict[str, Dict[str, float]]:
         """
         Geocode multiple addresses
         
+        Addresses found by a local backend are resolved inline; the rest are
+        looked up concurrently on a bounded thread pool. All workers share the
+        provider rate limiter, and duplicate addresses share a single
+        upstream request.
+        
         Args:
             addresses: List of address strings
+            max_workers: Concurrent lookups (defaults to Config.GEOCODE_MAX_WORKERS,
+                         1 disables concurrency)
             
         Returns:
-            Dictionary mapping addresses to coordinates
+            Dictionary mapping addresses to coordinates (None if geocoding failed)
         """
-        results = {}
+        results = dict.fromkeys(addresses)
+        pending = []
+        for address in results:
+            coords = self._lookup_local(address) if self.backends else None
+            if coords is not None:
+                results[address] = dict(coords)
+            else:
+                pending.append(address)
         
-        for address in addresses:
-            try:
-                coords = self.geocode(address)
-                results[address] = coords
-            except GeocodingError as e:
-                logger.warning(f"Failed to geocode {address}: {str(e)}")
-                results[address] = None
+        max_workers = max_workers or self.max_workers
         
+        if max_workers <= 1 or len(pending) <= 1:
+            for address in pending:
+                results[address] = self._geocode_or_none(address)
+            return results
+        
+        executor = self._get_executor(max_workers)
+        futures = {address: executor.submit(self._geocode_or_none, address) for address in pending}
+        for address, future in futures.items():
+            results[address] = future.result()
         return results
+    
+    def _geocode_or_none(self, address: str) -> Optional[Dict[str, float]]:
+        try:
+            return self.geocode(address)
+        except GeocodingError as e:
+            logger.warning(f"Failed to geocode {address}: {str(e)}")
+            return None
+    
+    def _get_executor(self, max_workers: int) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None or self._executor_workers != max_workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix='geocoder'
+                )
+                self._executor_workers = max_workers
+            return self._executor
+
+
+class AsyncGeocoder:
+    """
+    asyncio front end for a Geocoder
+    
+    Shares the wrapped Geocoder's local backends, cache, fuzzy index, rate
+    limiter and counters, but talks to Nominatim through an aiohttp
+    session so that an event loop can have many lookups in flight.
+    """
+    
+    def __init__(self, geocoder: Geocoder, session=None):
+        """
+        Args:
+            geocoder: Geocoder providing configuration and shared state
+            session: Optional aiohttp.ClientSession (created on first use
+                     otherwise, since it is bound to the running loop)
+        """
+        # Imported here: aiohttp is only needed by the async mode and slow to import
+        try:
+            import aiohttp
+        except ImportError:
+            aiohttp = None
+        if aiohttp is None and session is None:
+            raise RuntimeError("AsyncGeocoder requires the aiohttp package")
+        
+        self._aiohttp = aiohttp
+        self._client_errors = aiohttp.ClientError if aiohttp is not None else ()
+        self.geocoder = geocoder
+        self._session = session
+        self._inflight = {}
+    
+    def _get_session(self):
+        if self._session is None:
+            aiohttp = self._aiohttp
+            self._session = aiohttp.ClientSession(
+                headers=self.geocoder.headers,
+                timeout=aiohttp.ClientTimeout(total=self.geocoder.timeout),
+                connector=aiohttp.TCPConnector(limit=Config.NOMINATIM_POOL_SIZE)
+            )
+        return self._session
+    
+    async def aclose(self):
+        """Close the HTTP session"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    @traced('geocode')
+    @timed(GEOCODE_SECONDS.labels('async'))
+    async def geocode(self, address: str) -> Dict[str, float]:
+        """
+        Geocode an address to coordinates
+        
+        Args:
+            address: Address string to geocode
+            
+        Returns:
+            Dictionary with 'lat' and 'lon' keys
+            
+        Raises:
+            GeocodingError: If geocoding fails
+        """
+        # Local backends, the SQLite cache tier and the fuzzy scan block, keep them off the event loop
+        coords = await asyncio.to_thread(self.geocoder._resolve_known, address)
+        if coords is None:
+            coords = await self._fetch_coalesced(address)
+        
+        if coords is None:
+            raise GeocodingError(f"Could not find address: {address}")
+        
+        return dict(coords)
+    
+    async def _fetch_coalesced(self, address: str) -> Optional[Dict[str, float]]:
+        """
+        Fetch an address, sharing one upstream call between concurrent tasks
+        
+        The fetch runs as its own task that every caller awaits through a
+        shield, so a caller that is cancelled (its client went away) stops
+        waiting without cancelling the lookup the others are waiting for.
+        """
+        key = normalize_address(address)
+        
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_remember(key, address))
+            task.add_done_callback(_retrieve_exception)
+            self._inflight[key] = task
+        else:
+            logger.info(f"Joining in-flight geocode request: {address}")
+        return await asyncio.shield(task)
+    
+    async def _fetch_and_remember(self, key: str, address: str) -> Optional[Dict[str, float]]:
+        try:
+            coords = await self._fetch(address)
+            # Cache writes touch SQLite, keep them off the event loop
+            await asyncio.to_thread(self.geocoder._remember, address, coords)
+            return coords
+        finally:
+            del self._inflight[key]
+    
+    async def _fetch(self, address: str) -> Optional[Dict[str, float]]:
+        """
+        Query Nominatim for an address, retrying 429/5xx like Geocoder._request
+        
+        Raises:
+            GeocodingError: If the request or response parsing fails
+        """
+        logger.info(f"Geocoding address: {address}")
+        
+        geocoder = self.geocoder
+        url = f"{geocoder.base_url}/search"
+        params = {'q': address, 'format': 'json', 'limit': 1}
+        attempt = 0
+        
+        try:
+            while True:
+                wait = geocoder.rate_limiter.reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+                
+                start = time.perf_counter()
+                async with self._get_session().get(url, params=params) as response:
+                    if registry.enabled:
+                        NOMINATIM_SECONDS.observe(time.perf_counter() - start)
+                    with geocoder._stats_lock:
+                        geocoder._stats['requests'] += 1
+                    
+                    if response.status not in RETRY_STATUS_CODES or attempt >= geocoder.max_retries:
+                        response.raise_for_status()
+                        return geocoder._parse_search(address, await response.json(content_type=None))
+                    
+                    delay = geocoder._backoff_delay(attempt, response.headers.get('Retry-After'))
+                
+                attempt += 1
+                with geocoder._stats_lock:
+                    geocoder._stats['retries'] += 1
+                logger.warning(
+                    f"Nominatim returned {response.status}, retry {attempt}/{geocoder.max_retries} in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+        
+        except asyncio.TimeoutError as e:
+            count_error(e)
+            logger.error(f"Timeout while geocoding address: {address}")
+            raise GeocodingError("Geocoding service timed out. Please try again.")
+        
+        except self._client_errors as e:
+            count_error(e)
+            logger.error(f"Request error while geocoding {address}: {str(e)}")
+            raise GeocodingError("Failed to connect to geocoding service")
+        
+        except (KeyError, ValueError, IndexError) as e:
+            count_error(e)
+            logger.error(f"Error parsing geocoding response for {address}: {str(e)}")
+            raise GeocodingError("Invalid geocoding response")
+
+
+def _retrieve_exception(task: asyncio.Task):
+    """Mark a fetch task's exception as retrieved, in case every caller stopped waiting"""
+    if not task.cancelled():
+        task.exception()
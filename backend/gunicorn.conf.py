@@ -0,0 +1,103 @@
+"""
+Production server configuration
+Gunicorn settings and worker lifecycle hooks, read from Config
+
+Run from the backend directory (gunicorn picks this file up by default):
+
+    gunicorn                                   # gthread workers, WSGI app
+    gunicorn --workers 2 --threads 16          # command line flags win
+    GUNICORN_CMD_ARGS="--threads 16" gunicorn  # same, via the environment
+
+Set SERVER_WORKER_CLASS = 'uvicorn' to serve the async (ASGI) app. Send
+SIGHUP to the master to replace all workers gracefully; in-flight requests
+get SERVER_GRACEFUL_TIMEOUT seconds to finish. With SERVER_PRELOAD the
+application code is imported once by the master, so a HUP applies config
+changes but not code changes: deploy new code with SIGUSR2 (start a new
+master next to the old one) followed by SIGTERM to the old master.
+"""
+
+import multiprocessing
+import os
+import sys
+
+from config import Config
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'uvicorn': 'uvicorn_worker.UvicornWorker',
+}
+
+if Config.SERVER_WORKER_CLASS not in WORKER_CLASSES:
+    raise ValueError(f"Unknown server worker class: {Config.SERVER_WORKER_CLASS}")
+
+bind = f"{Config.HOST}:{Config.PORT}"
+worker_class = WORKER_CLASSES[Config.SERVER_WORKER_CLASS]
+wsgi_app = 'app:create_asgi_app()' if Config.SERVER_WORKER_CLASS == 'uvicorn' else 'app:create_app()'
+
+# WEB_CONCURRENCY is the conventional override used by hosting platforms
+workers = int(os.environ.get('WEB_CONCURRENCY', 0)) or Config.SERVER_WORKERS or multiprocessing.cpu_count()
+threads = Config.SERVER_THREADS
+preload_app = Config.SERVER_PRELOAD
+
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+keepalive = Config.SERVER_KEEPALIVE
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS_JITTER
+
+loglevel = Config.LOG_LEVEL.lower()
+
+# Worker heartbeat files on a container's overlay filesystem can stall
+# for seconds; keep them in memory when possible
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def _services():
+    """Services of the apps loaded in this process (none before the app is)"""
+    services = sys.modules.get('services')
+    return services.instances() if services is not None else []
+
+
+def pre_fork(server, worker):
+    """
+    Close the master's database connections before forking
+
+    Services are created on first use, so a preloaded master normally has
+    none; this covers anything that touched the database while loading.
+    A SQLite connection must never be used by two processes.
+    """
+    for services in _services():
+        db = services.created('db')
+        if db is not None:
+            db.close()
+
+
+def post_fork(server, worker):
+    """
+    Give the new worker its own connections
+
+    Database connections reopen lazily per thread. A geocoder inherited
+    from the master gets a new HTTP session and batch pool. Either way the
+    worker gets its share of the provider rate limit: the token bucket is
+    per process, so the configured rate is split between the workers to
+    keep the total within the provider's policy.
+    """
+    Config.NOMINATIM_RATE_LIMIT = Config.NOMINATIM_RATE_LIMIT / server.num_workers
+
+    for services in _services():
+        db = services.created('db')
+        if db is not None:
+            db.close()
+        geocoder = services.created('geocoder')
+        if geocoder is not None:
+            geocoder.reset()
+            geocoder.rate_limiter.rate = Config.NOMINATIM_RATE_LIMIT
+    server.log.info(f"Worker {worker.pid} initialized")
+
+
+def worker_exit(server, worker):
+    """Flush queued query history and close connections as a worker stops"""
+    for services in _services():
+        services.close(timeout=Config.SERVER_GRACEFUL_TIMEOUT)
@@ -0,0 +1,316 @@
+import functools
+import inspect
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+# Bucket upper bounds in seconds
+FAST_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+IO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# A collected sample: (metric name, type, help, [(labels, value), ...])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """Labelled metric family; children are created once per label set"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """
+        Get the child for a set of label values
+
+        Resolve children once and keep them when the labels are fixed; the
+        lookup is cheap but not free on a hot path.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def collect(self) -> Tuple[str, str, str, list]:
+        samples = []
+        for values, child in sorted(self._children.items()):
+            samples.extend(child.samples(self.name, dict(zip(self.labelnames, values))))
+        return self.name, self.kind, self.documentation, samples
+
+    def clear(self):
+        """Zero every child in place, so resolved children stay valid (used by tests)"""
+        with self._lock:
+            for child in self._children.values():
+                child.reset()
+
+
+class _CounterChild:
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def reset(self):
+        with self._lock:
+            self._value = 0
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def samples(self, name: str, labels: Dict[str, str]):
+        return [(name, labels, self._value)]
+
+
+class _HistogramChild:
+    __slots__ = ('_bounds', '_counts', '_sum', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        # One slot per bound plus +Inf; cumulated when rendered
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self._bounds) + 1)
+            self._sum = 0.0
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of a with block"""
+        if not registry.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def samples(self, name: str, labels: Dict[str, str]):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self._bounds + (float('inf'),), counts):
+            cumulative += count
+            samples.append((f"{name}_bucket", dict(labels, le=_format_value(float(bound))), cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class Counter(_Metric):
+    """Monotonic counter"""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+
+class Histogram(_Metric):
+    """Latency histogram with fixed buckets"""
+
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Tuple[float, ...] = IO_BUCKETS,
+        labelnames: Tuple[str, ...] = ()
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+
+class Registry:
+    """
+    Metrics of one process, rendered in the Prometheus text format
+
+    Besides its own metrics the registry calls collectors at scrape time,
+    so counters that services already keep (cache hits, pool reuse) are
+    exported without touching the hot path.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]):
+        """
+        Register a function called on every scrape
+
+        Args:
+            collector: Returns (name, type, help, [(labels, value), ...]) tuples
+        """
+        self._collectors.append(collector)
+
+    def collect(self) -> List[Tuple[str, str, str, list]]:
+        """Get (name, type, help, [(sample name, labels, value), ...]) for every family"""
+        families = [metric.collect() for metric in self._metrics]
+        for collector in self._collectors:
+            try:
+                for name, kind, documentation, samples in collector():
+                    families.append((name, kind, documentation, [
+                        (name, labels, value) for labels, value in samples
+                    ]))
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+        return families
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format (0.0.4)"""
+        lines = []
+        for name, kind, documentation, samples in self.collect():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """Reset every registered metric (used by tests)"""
+        for metric in self._metrics:
+            metric.clear()
+
+
+registry = Registry(enabled=Config.METRICS_ENABLED)
+
+
+def timed(histogram) -> Callable:
+    """
+    Decorator recording each call's duration in a histogram (or child)
+
+    Exceptions are timed too, and coroutine functions are timed until they
+    return. When the registry is disabled the call goes straight through.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not registry.enabled:
+                    return await func(*args, **kwargs)
+                start = perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count_error(error: BaseException):
+    """Count an error by exception type"""
+    if registry.enabled:
+        ERRORS.labels(type(error).__name__).inc()
+
+
+# Hot path metrics
+REQUEST_SECONDS = registry.register(Histogram(
+    'distance_http_request_seconds', 'API request latency by endpoint', IO_BUCKETS, ('endpoint',)
+))
+VALIDATION_SECONDS = registry.register(Histogram(
+    'distance_validation_seconds', 'Address validation latency', FAST_BUCKETS
+))
+GEOCODE_SECONDS = registry.register(Histogram(
+    'distance_geocode_seconds', 'Geocode call latency (local, cache or Nominatim)', IO_BUCKETS, ('mode',)
+))
+NOMINATIM_SECONDS = registry.register(Histogram(
+    'distance_nominatim_request_seconds', 'Nominatim HTTP request latency, per attempt', IO_BUCKETS
+))
+HAVERSINE_SECONDS = registry.register(Histogram(
+    'distance_haversine_seconds', 'Haversine computation latency', FAST_BUCKETS, ('mode',)
+))
+DB_WRITE_SECONDS = registry.register(Histogram(
+    'distance_db_write_seconds', 'Query history write latency', IO_BUCKETS, ('operation',)
+))
+ERRORS = registry.register(Counter(
+    'distance_errors_total', 'Errors by exception type', ('type',)
+))
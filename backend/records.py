@@ -0,0 +1,222 @@
+"""
+Query records
+Slotted record types for stored queries, and a JSON encoder that writes
+them straight to text without building intermediate dicts
+"""
+
+import json
+from json.encoder import encode_basestring_ascii as _string
+from typing import Optional
+
+# Column order of queries rows (SELECT * and the explicit history SELECT)
+QUERY_COLUMNS = (
+    'id', 'source', 'destination', 'source_lat', 'source_lon',
+    'dest_lat', 'dest_lon', 'distance_km', 'distance_miles', 'timestamp'
+)
+
+_SEPARATORS = (',', ':')
+
+
+class Coordinates:
+    """A latitude/longitude pair; reads like the {'lat', 'lon'} dict it replaces"""
+
+    __slots__ = ('lat', 'lon')
+
+    def __init__(self, lat: float, lon: float):
+        self.lat = lat
+        self.lon = lon
+
+    def __getitem__(self, key: str) -> float:
+        if key == 'lat':
+            return self.lat
+        if key == 'lon':
+            return self.lon
+        raise KeyError(key)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Coordinates):
+            return (self.lat, self.lon) == (other.lat, other.lon)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Coordinates(lat={self.lat!r}, lon={self.lon!r})"
+
+    def to_dict(self) -> dict:
+        return {'lat': self.lat, 'lon': self.lon}
+
+
+class QueryRecord:
+    """
+    One stored distance query
+
+    A single slotted object per row instead of a dict with two nested
+    coordinate dicts. Coordinates are kept flat and source_coords /
+    destination_coords build Coordinates on access. Item access with the
+    API keys (record['source'], record['source_coords']['lat']) works as
+    it did on the dicts. Distances are rounded to 2 decimals, as served.
+    """
+
+    __slots__ = QUERY_COLUMNS
+
+    # API keys readable with item access
+    _KEYS = frozenset(QUERY_COLUMNS + ('source_coords', 'destination_coords'))
+
+    def __init__(
+        self,
+        id: int,
+        source: str,
+        destination: str,
+        source_lat: float,
+        source_lon: float,
+        dest_lat: float,
+        dest_lon: float,
+        distance_km: float,
+        distance_miles: float,
+        timestamp: Optional[str] = None
+    ):
+        self.id = id
+        self.source = source
+        self.destination = destination
+        self.source_lat = source_lat
+        self.source_lon = source_lon
+        self.dest_lat = dest_lat
+        self.dest_lon = dest_lon
+        self.distance_km = round(distance_km, 2)
+        self.distance_miles = round(distance_miles, 2)
+        self.timestamp = timestamp
+
+    @property
+    def source_coords(self) -> Coordinates:
+        return Coordinates(self.source_lat, self.source_lon)
+
+    @property
+    def destination_coords(self) -> Coordinates:
+        return Coordinates(self.dest_lat, self.dest_lon)
+
+    def __getitem__(self, key: str):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, name) for name in QUERY_COLUMNS)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, QueryRecord):
+            return type(self) is type(other) and self._values() == other._values()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(id={self.id!r}, source={self.source!r}, destination={self.destination!r})"
+
+    def to_dict(self) -> dict:
+        """The record as the API's query dictionary"""
+        return {
+            'id': self.id,
+            'source': self.source,
+            'destination': self.destination,
+            'source_coords': {'lat': self.source_lat, 'lon': self.source_lon},
+            'destination_coords': {'lat': self.dest_lat, 'lon': self.dest_lon},
+            'distance_km': self.distance_km,
+            'distance_miles': self.distance_miles,
+            'timestamp': self.timestamp
+        }
+
+    def _json_fields(self) -> tuple:
+        # Keys in sorted order, split where QueryMatch inserts its own
+        return (
+            f'"destination":{_string(self.destination)},'
+            f'"destination_coords":{{"lat":{self.dest_lat!r},"lon":{self.dest_lon!r}}},'
+            f'"distance_km":{self.distance_km!r},"distance_miles":{self.distance_miles!r},'
+            f'"id":{self.id!r}'
+        ), (
+            f'"source":{_string(self.source)},'
+            f'"source_coords":{{"lat":{self.source_lat!r},"lon":{self.source_lon!r}}},'
+            f'"timestamp":{_string(self.timestamp) if self.timestamp is not None else "null"}'
+        )
+
+    def to_json(self) -> str:
+        """
+        Encode the record as compact JSON text
+
+        Equivalent to json.dumps(to_dict(), sort_keys=True,
+        separators=(',', ':')) but formatted directly from the slots.
+        """
+        head, tail = self._json_fields()
+        return f'{{{head},{tail}}}'
+
+
+class QueryMatch(QueryRecord):
+    """A QueryRecord found by a spatial search, with the endpoint that matched"""
+
+    __slots__ = ('matched_endpoint', 'match_distance_km')
+
+    _KEYS = QueryRecord._KEYS | {'matched_endpoint', 'match_distance_km'}
+
+    def __init__(self, *columns, matched_endpoint: str, match_distance_km: float):
+        """
+        Args:
+            *columns: QueryRecord arguments
+            matched_endpoint: 'source' or 'destination'
+            match_distance_km: Distance from the search point to that endpoint
+        """
+        super().__init__(*columns)
+        self.matched_endpoint = matched_endpoint
+        self.match_distance_km = round(match_distance_km, 2)
+
+    def _values(self) -> tuple:
+        return super()._values() + (self.matched_endpoint, self.match_distance_km)
+
+    def to_dict(self) -> dict:
+        query = super().to_dict()
+        query['matched_endpoint'] = self.matched_endpoint
+        query['match_distance_km'] = self.match_distance_km
+        return query
+
+    def to_json(self) -> str:
+        head, tail = self._json_fields()
+        return (
+            f'{{{head},"match_distance_km":{self.match_distance_km!r},'
+            f'"matched_endpoint":{_string(self.matched_endpoint)},{tail}}}'
+        )
+
+
+def _is_records(value) -> bool:
+    return isinstance(value, QueryRecord) or (isinstance(value, list) and bool(value) and isinstance(value[0], QueryRecord))
+
+
+def has_records(obj) -> bool:
+    """Whether obj is a record or a list of them, or a dict holding either"""
+    if _is_records(obj):
+        return True
+    return isinstance(obj, dict) and any(_is_records(value) for value in obj.values())
+
+
+def dumps(obj, sort_keys: bool = True, default=None) -> str:
+    """
+    Encode a response document as compact JSON, writing records directly
+
+    Records, and lists whose first item is a record, are encoded with
+    to_json(); everything else goes through json.dumps. Lists hold either
+    only records or none.
+
+    Args:
+        obj: A record, or a dict whose values may be records or lists of records
+        sort_keys: Sort the keys of dicts (record keys are always sorted)
+        default: json.dumps default for other objects json cannot encode
+
+    Returns:
+        JSON text
+    """
+    if isinstance(obj, QueryRecord):
+        return obj.to_json()
+    if isinstance(obj, list) and obj and isinstance(obj[0], QueryRecord):
+        return '[' + ','.join([record.to_json() for record in obj]) + ']'
+    if isinstance(obj, dict) and has_records(obj):
+        items = sorted(obj.items()) if sort_keys else obj.items()
+        return '{' + ','.join([f'{_string(str(key))}:{dumps(value, sort_keys, default)}' for key, value in items]) + '}'
+    return json.dumps(obj, separators=_SEPARATORS, sort_keys=sort_keys, default=default)
@@ -1,8 +1,17 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, g, has_app_context, request, jsonify, stream_with_context
+import json
 import logging
+import math
+import time
+from typing import Optional, Tuple
 
-from database import Database
-from geocoding import Geocoder, GeocodingError
+import export
+from cache import normalize_address
+from config import Config
+from geocoding import GeocodingError
+from metrics import REQUEST_SECONDS, VALIDATION_SECONDS, count_error, registry
+from tracing import finish_trace, profiler, start_trace, traced
+from services import Services, get_services
 from validation import Validator, ValidationError
 from utils import DistanceCalculator, ResponseFormatter
 
@@ -11,9 +20,89 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 api = Blueprint('api', __name__, url_prefix='/api')
 
-# Initialize services
-db = Database()
-geocoder = Geocoder()
+
+@api.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    g.trace = start_trace(f"{request.method} {request.path}")
+    g.profile = profiler.start()
+
+
+@api.after_request
+def _observe_request(response):
+    # Streamed responses are timed until the headers are sent
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    duration = time.perf_counter() - start
+    if registry.enabled:
+        REQUEST_SECONDS.labels(request.endpoint or 'unknown').observe(duration)
+    finish_trace(g.pop('trace', None))
+    profiler.stop(g.pop('profile', None), request.endpoint or 'unknown', duration)
+    return response
+
+
+@api.teardown_request
+def _end_failed_request(error):
+    # after_request is skipped when a view raises; never leave the profiler running
+    duration = time.perf_counter() - g.pop('request_start', time.perf_counter())
+    finish_trace(g.pop('trace', None))
+    profiler.stop(g.pop('profile', None), request.endpoint or 'unknown', duration)
+
+
+def _created_cache_stats(services) -> dict:
+    """Counters of the caches already in use; a stats request never creates a service"""
+    stats = {}
+    for name, service in (('geocode', 'geocode_cache'), ('pairs', 'pair_cache'), ('fuzzy', 'fuzzy_index')):
+        cache = services.created(service)
+        if cache is not None:
+            stats[name] = cache.stats()
+    return stats
+
+
+def _service_metrics():
+    """Export the counters services already keep (collected on each scrape)"""
+    if not has_app_context():
+        return []
+    services = get_services()
+    caches = _created_cache_stats(services)
+    if 'fuzzy' in caches:
+        caches['fuzzy']['hits'] = caches['fuzzy']['exact_hits'] + caches['fuzzy']['fuzzy_hits']
+    
+    hits, misses, ratios, sizes = [], [], [], []
+    for name, stats in caches.items():
+        labels = {'cache': name}
+        lookups = stats['hits'] + stats['misses']
+        hits.append((labels, stats['hits']))
+        misses.append((labels, stats['misses']))
+        ratios.append((labels, stats['hits'] / lookups if lookups else 0.0))
+        sizes.append((labels, stats['size']))
+    
+    families = [
+        ('distance_cache_hits_total', 'counter', 'Cache hits', hits),
+        ('distance_cache_misses_total', 'counter', 'Cache misses', misses),
+        ('distance_cache_hit_ratio', 'gauge', 'Cache hits / lookups since start', ratios),
+        ('distance_cache_entries', 'gauge', 'Entries held in memory', sizes),
+    ]
+    geocoder = services.created('geocoder')
+    if geocoder is not None:
+        upstream = geocoder.connection_stats()
+        families += [
+            ('distance_nominatim_requests_total', 'counter', 'Nominatim HTTP requests', [({}, upstream['requests'])]),
+            ('distance_nominatim_retries_total', 'counter', 'Nominatim retries after 429/5xx', [({}, upstream['retries'])]),
+            ('distance_local_geocoder_hits_total', 'counter', 'Addresses resolved by local backends', [({}, upstream['local_hits'])]),
+        ]
+    writer = services.created('query_writer')
+    if writer is not None:
+        writer = writer.stats()
+        families += [
+            ('distance_writer_queue_depth', 'gauge', 'Query history rows waiting to be written', [({}, writer['queue_depth'])]),
+            ('distance_writer_dropped_total', 'counter', 'Query history rows dropped under backpressure', [({}, writer['dropped'])]),
+        ]
+    return families
+
+
+registry.add_collector(_service_metrics)
 
 
 @api.route('/health', methods=['GET'])
@@ -22,6 +111,146 @@ def health_check():
     return jsonify({'status': 'healthy'}), 200
 
 
+@api.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Geocode cache, pair cache and fuzzy address index counters
+    
+    Caches that have not been used yet since the app started are left out.
+    
+    Response:
+        {
+            "geocode": {
+                "hits": 10,
+                "misses": 2,
+                "negative_hits": 1,
+                "persistent_hits": 3,
+                "evictions": 0,
+                "expirations": 0,
+                "size": 12,
+                "max_size": 10000
+            },
+            "pairs": {
+                "hits": 5,
+                "misses": 7,
+                "evictions": 0,
+                "expirations": 0,
+                "invalidations": 0,
+                "size": 7,
+                "max_size": 10000
+            },
+            "fuzzy": {
+                "lookups": 4,
+                "exact_hits": 2,
+                "fuzzy_hits": 1,
+                "misses": 1,
+                "budget_exceeded": 0,
+                "evictions": 0,
+                "size": 12,
+                "max_size": 10000
+            }
+        }
+    """
+    stats = _created_cache_stats(get_services())
+    return ResponseFormatter.format_success_response(stats, 200)
+
+
+@api.route('/geocoder/stats', methods=['GET'])
+def geocoder_stats():
+    """
+    Geocoder counters (Nominatim connection pool and local backend hits)
+    
+    Response:
+        {
+            "requests": 120,
+            "retries": 2,
+            "local_hits": 40,
+            "connections_opened": 4,
+            "connections_reused": 116,
+            "reuse_ratio": 0.9667
+        }
+    """
+    services = get_services()
+    return ResponseFormatter.format_success_response(services.geocoder.connection_stats(), 200)
+
+
+@api.route('/writer/stats', methods=['GET'])
+def writer_stats():
+    """
+    Write-behind queue counters
+    
+    Response:
+        {
+            "submitted": 120,
+            "written": 118,
+            "dropped": 0,
+            "spilled": 0,
+            "failed": 0,
+            "flushes": 6,
+            "queue_depth": 2,
+            "last_flush_ms": 1.2,
+            "max_flush_ms": 3.4,
+            "avg_flush_ms": 1.5,
+            "policy": "block"
+        }
+    """
+    services = get_services()
+    return ResponseFormatter.format_success_response(services.query_writer.stats(), 200)
+
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Metrics in the Prometheus text exposition format
+    
+    Latency histograms for requests, validation, geocoding, Nominatim,
+    haversine and history writes, error counts by exception type, and
+    cache hit ratios. Values are per process.
+    
+    Response (text/plain):
+        # HELP distance_validation_seconds Address validation latency
+        # TYPE distance_validation_seconds histogram
+        distance_validation_seconds_bucket{le="5e-06"} 0
+        ...
+        distance_cache_hit_ratio{cache="geocode"} 0.8
+    """
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@api.route('/debug/profiling', methods=['GET', 'PUT'])
+def profiling():
+    """
+    Show or change the sampling profiler (only if PROFILE_CONTROL_ENABLED)
+    
+    The setting applies to the process that serves the request.
+    
+    Request Body (PUT):
+        {
+            "sample_rate": 0.05
+        }
+    
+    Response:
+        {
+            "profiled": 12,
+            "skipped_busy": 1,
+            "sample_rate": 0.05,
+            "directory": "profiles"
+        }
+    """
+    if not Config.PROFILE_CONTROL_ENABLED:
+        return ResponseFormatter.format_error_response('Not found', 404)
+    
+    if request.method == 'PUT':
+        data = request.get_json(silent=True) or {}
+        try:
+            profiler.set_sample_rate(float(data.get('sample_rate')))
+        except (TypeError, ValueError) as e:
+            count_error(e)
+            return ResponseFormatter.format_error_response('sample_rate must be a number between 0 and 1', 400)
+    
+    return ResponseFormatter.format_success_response(profiler.stats(), 200)
+
+
 @api.route('/calculate-distance', methods=['POST'])
 def calculate_distance():
     """
@@ -43,6 +272,7 @@ def calculate_distance():
             "destination_coords": {"lat": 34.0, "lon": -118.2}
         }
     """
+    services = get_services()
     try:
         # Get request data
         data = request.get_json()
@@ -51,72 +281,443 @@ def calculate_distance():
             logger.warning("No data provided in request")
             return ResponseFormatter.format_error_response('No data provided', 400)
         
-        source = data.get('source', '').strip()
-        destination = data.get('destination', '').strip()
+        source, destination = _request_addresses(data)
+        
+        # A repeat is answered as stored and not inserted again: history keeps
+        # the row of the request that computed it
+        cached = _cached_distance(services, source, destination)
+        if cached is not None:
+            return ResponseFormatter.format_success_response(cached, 200)
         
         # Validate inputs
         try:
             source, destination = Validator.validate_addresses(source, destination)
         except ValidationError as e:
+            count_error(e)
             logger.warning(f"Validation error: {str(e)}")
             return ResponseFormatter.format_error_response(str(e), 400)
         
         # Geocode addresses
         try:
-            source_coords = geocoder.geocode(source)
+            source_coords = services.geocoder.geocode(source)
         except GeocodingError as e:
+            count_error(e)
             logger.error(f"Failed to geocode source: {str(e)}")
             return ResponseFormatter.format_error_response(str(e), 404)
         
         try:
-            dest_coords = geocoder.geocode(destination)
+            dest_coords = services.geocoder.geocode(destination)
         except GeocodingError as e:
+            count_error(e)
             logger.error(f"Failed to geocode destination: {str(e)}")
             return ResponseFormatter.format_error_response(str(e), 404)
         
-        # Calculate distance
-        distance = DistanceCalculator.calculate_distance_between_addresses(
-            source_coords, dest_coords
+        # Calculate, format and save
+        response, row = _distance_response(services, source, destination, source_coords, dest_coords)
+        _save_query(services, row)
+        
+        return ResponseFormatter.format_success_response(response, 200)
+        
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Unexpected error in calculate_distance: {str(e)}")
+        return ResponseFormatter.format_error_response(
+            'An unexpected error occurred. Please try again.', 500
         )
+
+
+# Steps of calculate-distance shared with the ASGI route (asgi.AsgiApp)
+
+def _request_addresses(data: dict) -> Tuple[str, str]:
+    """Source and destination of a request body, stripped (non-strings are left to validation)"""
+    source = data.get('source') or ''
+    destination = data.get('destination') or ''
+    if isinstance(source, str):
+        source = source.strip()
+    if isinstance(destination, str):
+        destination = destination.strip()
+    return source, destination
+
+
+def _history_row(source: str, destination: str, source_coords: dict, dest_coords: dict,
+                 distance_km: float, distance_miles: float) -> tuple:
+    """Query row in Database.save_queries order"""
+    return (
+        source, destination,
+        source_coords['lat'], source_coords['lon'],
+        dest_coords['lat'], dest_coords['lon'],
+        distance_km, distance_miles
+    )
+
+
+def _cached_distance(services: Services, source: str, destination: str) -> Optional[dict]:
+    """
+    Serve a repeated pair from the pair cache
+    
+    Keys only ever come from validated addresses; the length guard stops
+    oversized input from matching one after whitespace normalization.
+    
+    Returns:
+        The response, or None on a miss
+    """
+    if not (isinstance(source, str) and isinstance(destination, str)):
+        return None
+    if max(len(source), len(destination)) > Config.MAX_ADDRESS_LENGTH:
+        return None
+    
+    cached = services.pair_cache.get(source, destination)
+    if cached is None:
+        return None
+    
+    logger.info(f"Pair cache hit: {source} -> {destination}")
+    cached['source'] = source
+    cached['destination'] = destination
+    return cached
+
+
+def _distance_response(services: Services, source: str, destination: str,
+                       source_coords: dict, dest_coords: dict) -> Tuple[dict, tuple]:
+    """
+    Calculate the distance between geocoded addresses and cache the response
+    
+    Returns:
+        Tuple of (response, history row)
+    """
+    distance = DistanceCalculator.calculate_distance_between_addresses(
+        source_coords, dest_coords
+    )
+    
+    logger.info(f"Calculated distance: {distance['km']:.2f} km / {distance['miles']:.2f} miles")
+    
+    response = ResponseFormatter.format_distance_response(
+        source, destination,
+        source_coords, dest_coords,
+        distance['km'], distance['miles']
+    )
+    services.pair_cache.set(source, destination, response)
+    
+    return response, _history_row(
+        source, destination, source_coords, dest_coords, distance['km'], distance['miles']
+    )
+
+
+@traced('save')
+def _save_query(services: Services, row: tuple):
+    """Save a query row (queued for the background writer when enabled)"""
+    try:
+        if Config.WRITE_BEHIND_ENABLED:
+            services.query_writer.submit(row)
+        else:
+            query_id = services.db.save_query(*row)
+            logger.info(f"Query saved with ID: {query_id}")
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Failed to save query: {str(e)}")
+        # Continue even if saving fails
+
+
+@api.route('/calculate-distances', methods=['POST'])
+def calculate_distances():
+    """
+    Calculate distances for many source/destination pairs
+    
+    Addresses are deduplicated before geocoding, all distances are computed
+    in one pass and successful rows are saved in a single transaction.
+    Failures are reported per pair instead of failing the whole batch.
+    
+    Request Body:
+        {
+            "pairs": [
+                {"source": "Address 1", "destination": "Address 2"}
+            ]
+        }
+    
+    Response:
+        {
+            "results": [
+                {
+                    "index": 0,
+                    "source": "Address 1",
+                    "destination": "Address 2",
+                    "distance_km": 100.5,
+                    "distance_miles": 62.4,
+                    "source_coords": {"lat": 40.7, "lon": -74.0},
+                    "destination_coords": {"lat": 34.0, "lon": -118.2}
+                },
+                {"index": 1, "error": "Source address is required and must be a string", "status": 400}
+            ],
+            "count": 2,
+            "succeeded": 1,
+            "failed": 1
+        }
+    """
+    services = get_services()
+    try:
+        data = request.get_json()
+        
+        if not data:
+            logger.warning("No data provided in request")
+            return ResponseFormatter.format_error_response('No data provided', 400)
         
-        logger.info(f"Calculated distance: {distance['km']:.2f} km / {distance['miles']:.2f} miles")
+        pairs = data.get('pairs')
         
-        # Save to database
-        try:
-            query_id = db.save_query(
+        if not isinstance(pairs, list) or not pairs:
+            return ResponseFormatter.format_error_response('pairs must be a non-empty list', 400)
+        
+        if len(pairs) > Config.MAX_BATCH_PAIRS:
+            return ResponseFormatter.format_error_response(
+                f'pairs must not contain more than {Config.MAX_BATCH_PAIRS} items', 400
+            )
+        
+        results = [None] * len(pairs)
+        valid = []
+        
+        # Validate inputs
+        objects = [pair if isinstance(pair, dict) else {} for pair in pairs]
+        sources = Validator.validate_many([pair.get('source') for pair in objects], "Source address")
+        destinations = Validator.validate_many(
+            [pair.get('destination') for pair in objects], "Destination address"
+        )
+        
+        for index, pair in enumerate(pairs):
+            (source, source_error), (destination, dest_error) = sources[index], destinations[index]
+            if not isinstance(pair, dict):
+                results[index] = {'index': index, 'error': 'Each pair must be an object', 'status': 400}
+            elif source_error or dest_error:
+                results[index] = {'index': index, 'error': source_error or dest_error, 'status': 400}
+            else:
+                valid.append((index, source, destination))
+        
+        # Geocode each unique address once
+        unique = {}
+        for _, source, destination in valid:
+            unique.setdefault(normalize_address(source), source)
+            unique.setdefault(normalize_address(destination), destination)
+        
+        geocoded = services.geocoder.batch_geocode(list(unique.values()))
+        coords_by_key = {key: geocoded.get(address) for key, address in unique.items()}
+        
+        resolved = []
+        for index, source, destination in valid:
+            source_coords = coords_by_key[normalize_address(source)]
+            dest_coords = coords_by_key[normalize_address(destination)]
+            if source_coords is None:
+                results[index] = {'index': index, 'error': f'Could not find address: {source}', 'status': 404}
+            elif dest_coords is None:
+                results[index] = {'index': index, 'error': f'Could not find address: {destination}', 'status': 404}
+            else:
+                resolved.append((index, source, destination, source_coords, dest_coords))
+        
+        # Calculate all distances at once
+        distances_km, distances_miles = DistanceCalculator.haversine_distances(
+            [item[3]['lat'] for item in resolved],
+            [item[3]['lon'] for item in resolved],
+            [item[4]['lat'] for item in resolved],
+            [item[4]['lon'] for item in resolved]
+        )
+        
+        rows = []
+        for (index, source, destination, source_coords, dest_coords), km, miles in zip(
+            resolved, distances_km, distances_miles
+        ):
+            km = round(float(km), 2)
+            miles = round(float(miles), 2)
+            rows.append((
                 source, destination,
                 source_coords['lat'], source_coords['lon'],
                 dest_coords['lat'], dest_coords['lon'],
-                distance['km'], distance['miles']
-            )
-            logger.info(f"Query saved with ID: {query_id}")
+                km, miles
+            ))
+            results[index] = {'index': index}
+            results[index].update(ResponseFormatter.format_distance_response(
+                source, destination, source_coords, dest_coords, km, miles
+            ))
+        
+        logger.info(f"Calculated {len(rows)} of {len(pairs)} distances in batch")
+        
+        # Save all rows in one transaction
+        try:
+            services.db.save_queries(rows)
         except Exception as e:
-            logger.error(f"Failed to save query: {str(e)}")
+            count_error(e)
+            logger.error(f"Failed to save batch queries: {str(e)}")
             # Continue even if saving fails
         
-        # Format and return response
-        response = ResponseFormatter.format_distance_response(
-            source, destination,
-            source_coords, dest_coords,
-            distance['km'], distance['miles']
+        response = ResponseFormatter.format_batch_response(results)
+        return ResponseFormatter.format_success_response(response, 200)
+        
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Unexpected error in calculate_distances: {str(e)}")
+        return ResponseFormatter.format_error_response(
+            'An unexpected error occurred. Please try again.', 500
         )
+
+
+@api.route('/distance-matrix', methods=['POST'])
+def distance_matrix():
+    """
+    Calculate the distance matrix between N origins and M destinations
+    
+    Each unique address is geocoded once. Cells involving an address that
+    could not be geocoded are null (NaN in float32 output).
+    
+    Request Body:
+        {
+            "origins": ["Address 1", "Address 2"],
+            "destinations": ["Address 3"],
+            "unit": "km",
+            "format": "json"
+        }
+    
+    unit is "km" (default) or "miles"; format is "json" (default),
+    "ndjson" or "float32".
+    
+    Response (json):
+        {
+            "origins": ["Address 1", "Address 2"],
+            "destinations": ["Address 3"],
+            "unit": "km",
+            "distances": [[100.5], [null]],
+            "errors": [{"address": "Address 2", "error": "Could not find address: Address 2"}]
+        }
+    
+    Response (ndjson): a header line with origins, destinations, unit and
+    errors, then one {"row": i, "distances": [...]} line per origin,
+    streamed in chunks of MATRIX_CHUNK_ROWS rows.
+    
+    Response (float32): row-major little-endian float32 cells, streamed in
+    row chunks. Shape and unit are in the X-Matrix-Rows, X-Matrix-Cols and
+    X-Matrix-Unit headers.
+    """
+    services = get_services()
+    try:
+        data = request.get_json()
+        
+        if not data:
+            logger.warning("No data provided in request")
+            return ResponseFormatter.format_error_response('No data provided', 400)
+        
+        origins = data.get('origins')
+        destinations = data.get('destinations')
+        unit = data.get('unit', 'km')
+        output_format = data.get('format', 'json')
+        
+        if not isinstance(origins, list) or not origins:
+            return ResponseFormatter.format_error_response('origins must be a non-empty list', 400)
+        if not isinstance(destinations, list) or not destinations:
+            return ResponseFormatter.format_error_response('destinations must be a non-empty list', 400)
+        if max(len(origins), len(destinations)) > Config.MAX_MATRIX_ADDRESSES:
+            return ResponseFormatter.format_error_response(
+                f'origins and destinations must not exceed {Config.MAX_MATRIX_ADDRESSES} items', 400
+            )
+        if unit not in ('km', 'miles'):
+            return ResponseFormatter.format_error_response('unit must be "km" or "miles"', 400)
+        if output_format not in ('json', 'ndjson', 'float32'):
+            return ResponseFormatter.format_error_response(
+                'format must be "json", "ndjson" or "float32"', 400
+            )
+        
+        # Validate inputs
+        try:
+            with VALIDATION_SECONDS.time():
+                origins = [Validator.validate_address(a, f"Origin {i}") for i, a in enumerate(origins)]
+                destinations = [
+                    Validator.validate_address(a, f"Destination {i}") for i, a in enumerate(destinations)
+                ]
+        except ValidationError as e:
+            count_error(e)
+            logger.warning(f"Validation error: {str(e)}")
+            return ResponseFormatter.format_error_response(str(e), 400)
+        
+        # Geocode each unique address once
+        unique = {}
+        for address in origins + destinations:
+            unique.setdefault(normalize_address(address), address)
+        
+        geocoded = services.geocoder.batch_geocode(list(unique.values()))
+        coords_by_key = {key: geocoded.get(address) for key, address in unique.items()}
+        
+        origin_coords = [coords_by_key[normalize_address(a)] for a in origins]
+        dest_coords = [coords_by_key[normalize_address(a)] for a in destinations]
+        errors = [
+            {'address': address, 'error': f'Could not find address: {address}'}
+            for key, address in unique.items() if coords_by_key[key] is None
+        ]
         
+        factor = Config.KM_TO_MILES_FACTOR if unit == 'miles' else 1.0
+        blocks = DistanceCalculator.iter_distance_matrix(origin_coords, dest_coords)
+        
+        logger.info(f"Calculating {len(origins)}x{len(destinations)} distance matrix ({output_format})")
+        
+        if output_format == 'float32':
+            headers = {
+                'X-Matrix-Rows': str(len(origins)),
+                'X-Matrix-Cols': str(len(destinations)),
+                'X-Matrix-Unit': unit
+            }
+            return Response(
+                stream_with_context(_float32_matrix_chunks(blocks, factor)),
+                mimetype='application/octet-stream',
+                headers=headers
+            )
+        
+        if output_format == 'ndjson':
+            header = {'origins': origins, 'destinations': destinations, 'unit': unit, 'errors': errors}
+            return Response(
+                stream_with_context(_ndjson_matrix_chunks(header, blocks, factor)),
+                mimetype='application/x-ndjson'
+            )
+        
+        matrix = [
+            _matrix_row(row, factor)
+            for _, block in blocks
+            for row in block
+        ]
+        response = ResponseFormatter.format_matrix_response(
+            origins, destinations, unit, matrix, errors
+        )
         return ResponseFormatter.format_success_response(response, 200)
         
     except Exception as e:
-        logger.error(f"Unexpected error in calculate_distance: {str(e)}")
+        count_error(e)
+        logger.error(f"Unexpected error in distance_matrix: {str(e)}")
         return ResponseFormatter.format_error_response(
             'An unexpected error occurred. Please try again.', 500
         )
 
 
+def _matrix_row(row, factor: float) -> list:
+    """Convert a row of kilometers to rounded JSON values (None for NaN)"""
+    return [None if math.isnan(km) else round(float(km) * factor, 2) for km in row]
+
+
+def _ndjson_matrix_chunks(header: dict, blocks, factor: float):
+    yield json.dumps(header) + '\n'
+    for start, block in blocks:
+        yield ''.join(
+            json.dumps({'row': start + offset, 'distances': _matrix_row(row, factor)}) + '\n'
+            for offset, row in enumerate(block)
+        )
+
+
+def _float32_matrix_chunks(blocks, factor: float):
+    for _, block in blocks:
+        yield DistanceCalculator.to_float32_bytes(block, factor)
+
+
 @api.route('/history', methods=['GET'])
 def get_history():
     """
-    Retrieve past distance queries
+    Retrieve past distance queries, newest first
     
     Query Parameters:
         limit (int, optional): Maximum number of records to return (default: 50, max: 100)
+        before_id (int, optional): Return queries older than this ID (next page)
+        after_id (int, optional): Return queries newer than this ID (previous page)
+        address (str, optional): Substring of the source or destination address
+        since (str, optional): ISO 8601 start of the time range (inclusive)
+        until (str, optional): ISO 8601 end of the time range (exclusive)
     
     Response:
         {
@@ -132,30 +733,290 @@ def get_history():
                     "timestamp": "2024-02-10 14:30:00"
                 }
             ],
-            "count": 1
+            "count": 1,
+            "next_before_id": null,
+            "prev_after_id": 1
         }
     """
+    services = get_services()
     try:
-        # Get and validate limit parameter
+        # Get and validate parameters
         limit = request.args.get('limit', 50, type=int)
         limit = Validator.validate_limit(limit)
         
-        logger.info(f"Fetching query history (limit: {limit})")
+        try:
+            before_id = Validator.validate_cursor(request.args.get('before_id'), 'before_id')
+            after_id = Validator.validate_cursor(request.args.get('after_id'), 'after_id')
+            since = Validator.validate_timestamp(request.args.get('since'), 'since')
+            until = Validator.validate_timestamp(request.args.get('until'), 'until')
+        except ValidationError as e:
+            count_error(e)
+            logger.warning(f"Validation error: {str(e)}")
+            return ResponseFormatter.format_error_response(str(e), 400)
+        
+        address = request.args.get('address', '').strip()[:Config.MAX_ADDRESS_LENGTH]
+        
+        logger.info(f"Fetching query history (limit: {limit}, before_id: {before_id}, after_id: {after_id})")
         
         # Retrieve history from database
-        queries = db.get_history(limit)
+        queries = services.db.get_history(
+            limit,
+            before_id=before_id,
+            after_id=after_id,
+            address=address or None,
+            since=since,
+            until=until
+        )
         
         # Format and return response
-        response = ResponseFormatter.format_history_response(queries)
+        response = ResponseFormatter.format_history_response(queries, limit)
         return ResponseFormatter.format_success_response(response, 200)
         
     except Exception as e:
+        count_error(e)
         logger.error(f"Error retrieving history: {str(e)}")
         return ResponseFormatter.format_error_response(
             'Failed to retrieve history', 500
         )
 
 
+@api.route('/history/export', methods=['GET'])
+def export_history():
+    """
+    Stream the whole query history, oldest first
+    
+    Unlike /history this is not paged: rows are read from the database and
+    sent in chunks of EXPORT_CHUNK_ROWS, so memory use does not grow with
+    the size of the table. The export is one consistent snapshot.
+    
+    Query Parameters:
+        format (str, optional): "csv" (default), "ndjson", "arrow" (Arrow IPC
+            stream) or "parquet"; arrow and parquet need pyarrow
+        after_id (int, optional): Only export queries with a higher ID (resume)
+        address (str, optional): Substring of the source or destination address
+        since (str, optional): ISO 8601 start of the time range (inclusive)
+        until (str, optional): ISO 8601 end of the time range (exclusive)
+    
+    Response (csv):
+        id,source,destination,source_lat,source_lon,dest_lat,dest_lon,distance_km,distance_miles,timestamp
+        1,Address 1,Address 2,40.7,-74.0,34.0,-118.2,100.5,62.4,2024-02-10 14:30:00
+    
+    Response (ndjson): one object with the same fields per line.
+    Distances are not rounded in any format.
+    """
+    services = get_services()
+    try:
+        output_format = request.args.get('format', 'csv')
+        if not export.format_available(output_format):
+            return ResponseFormatter.format_error_response(
+                f"format must be one of: {', '.join(export.available_formats())}", 400
+            )
+        
+        try:
+            after_id = Validator.validate_cursor(request.args.get('after_id'), 'after_id')
+            since = Validator.validate_timestamp(request.args.get('since'), 'since')
+            until = Validator.validate_timestamp(request.args.get('until'), 'until')
+        except ValidationError as e:
+            count_error(e)
+            logger.warning(f"Validation error: {str(e)}")
+            return ResponseFormatter.format_error_response(str(e), 400)
+        
+        address = request.args.get('address', '').strip()[:Config.MAX_ADDRESS_LENGTH]
+        
+        logger.info(f"Exporting query history ({output_format}, after_id: {after_id})")
+        
+        chunks = services.db.iter_history(
+            after_id=after_id,
+            address=address or None,
+            since=since,
+            until=until
+        )
+        filename = f"history.{export.EXTENSIONS[output_format]}"
+        return Response(
+            stream_with_context(export.encode_chunks(chunks, output_format)),
+            mimetype=export.MIMETYPES[output_format],
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+        
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Error exporting history: {str(e)}")
+        return ResponseFormatter.format_error_response(
+            'Failed to export history', 500
+        )
+
+
+@api.route('/stats', methods=['GET'])
+def history_stats():
+    """
+    Aggregate statistics over the query history
+    
+    Served from the in-memory columnar snapshot (analytics.py), which is
+    loaded on the first call and kept current as queries are saved.
+    
+    Query Parameters:
+        since (str, optional): ISO 8601 start of the time range (inclusive)
+        until (str, optional): ISO 8601 end of the time range (exclusive)
+        top (int, optional): Most frequent pairs to return (default: 10, max: 100)
+        percentiles (str, optional): Comma-separated distance percentiles (default: 50,90,95,99)
+    
+    Response:
+        {
+            "count": 1200,
+            "distance_km": {
+                "min": 0.5, "max": 9500.2, "mean": 812.4,
+                "percentiles": {"p50": 410.3, "p90": 2200.1, "p95": 3944.4, "p99": 8001.7}
+            },
+            "top_pairs": [{"source": "Address 1", "destination": "Address 2", "count": 42}],
+            "per_hour": [{"hour": "2024-02-10 14:00:00", "count": 37}]
+        }
+    
+    distance_km is null when no query matches. Percentiles are accurate to
+    STATS_DISTANCE_RESOLUTION / 2 (0.5% by default).
+    """
+    services = get_services()
+    try:
+        top = request.args.get('top', Config.STATS_DEFAULT_TOP_PAIRS, type=int)
+        top = max(0, min(top, Config.STATS_MAX_TOP_PAIRS))
+        
+        try:
+            since = Validator.validate_timestamp(request.args.get('since'), 'since')
+            until = Validator.validate_timestamp(request.args.get('until'), 'until')
+            percentiles = Validator.validate_percentiles(request.args.get('percentiles'))
+        except ValidationError as e:
+            count_error(e)
+            logger.warning(f"Validation error: {str(e)}")
+            return ResponseFormatter.format_error_response(str(e), 400)
+        
+        logger.info(f"Computing history stats (since: {since}, until: {until})")
+        
+        stats = services.analytics.stats(
+            since=since,
+            until=until,
+            top=top,
+            percentiles=percentiles or (50, 90, 95, 99)
+        )
+        return ResponseFormatter.format_success_response(stats, 200)
+        
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Error computing history stats: {str(e)}")
+        return ResponseFormatter.format_error_response(
+            'Failed to compute history stats', 500
+        )
+
+
+@api.route('/queries/nearby', methods=['GET'])
+def get_nearby_queries():
+    """
+    Find stored queries that start or end within a radius of a point
+    
+    Query Parameters:
+        lat (float): Latitude of the point
+        lon (float): Longitude of the point
+        radius_km (float): Search radius (max: SPATIAL_MAX_RADIUS_KM)
+        endpoint (str, optional): "source", "destination" or "any" (default)
+        limit (int, optional): Maximum number of records to return (default: 50, max: 100)
+    
+    Response:
+        {
+            "queries": [
+                {
+                    "id": 1,
+                    "source": "Address 1",
+                    "destination": "Address 2",
+                    "distance_km": 100.5,
+                    "distance_miles": 62.4,
+                    "source_coords": {"lat": 40.7, "lon": -74.0},
+                    "destination_coords": {"lat": 34.0, "lon": -118.2},
+                    "timestamp": "2024-02-10 14:30:00",
+                    "matched_endpoint": "source",
+                    "match_distance_km": 1.2
+                }
+            ],
+            "count": 1
+        }
+    """
+    services = get_services()
+    try:
+        try:
+            lat, lon = Validator.validate_coordinates(
+                request.args.get('lat'), request.args.get('lon'), 'Search point'
+            )
+            radius_km = Validator.validate_radius(request.args.get('radius_km'))
+        except ValidationError as e:
+            count_error(e)
+            logger.warning(f"Validation error: {str(e)}")
+            return ResponseFormatter.format_error_response(str(e), 400)
+        
+        endpoint = request.args.get('endpoint', 'any')
+        if endpoint not in ('any', 'source', 'destination'):
+            return ResponseFormatter.format_error_response(
+                'endpoint must be "source", "destination" or "any"', 400
+            )
+        
+        limit = Validator.validate_limit(request.args.get('limit', 50, type=int))
+        
+        queries = services.db.find_queries_near(lat, lon, radius_km, endpoint, limit)
+        
+        return ResponseFormatter.format_success_response(
+            {'queries': queries, 'count': len(queries)}, 200
+        )
+        
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Error searching nearby queries: {str(e)}")
+        return ResponseFormatter.format_error_response(
+            'Failed to search queries', 500
+        )
+
+
+@api.route('/locations/nearest', methods=['GET'])
+def get_nearest_locations():
+    """
+    Find the known geocoded locations nearest to a point
+    
+    Query Parameters:
+        lat (float): Latitude of the point
+        lon (float): Longitude of the point
+        k (int, optional): Number of locations to return (default: 10, max: MAX_NEAREST_LOCATIONS)
+    
+    Response:
+        {
+            "locations": [
+                {"address": "Address 1", "lat": 40.7, "lon": -74.0, "distance_km": 1.2}
+            ],
+            "count": 1
+        }
+    """
+    services = get_services()
+    try:
+        try:
+            lat, lon = Validator.validate_coordinates(
+                request.args.get('lat'), request.args.get('lon'), 'Search point'
+            )
+        except ValidationError as e:
+            count_error(e)
+            logger.warning(f"Validation error: {str(e)}")
+            return ResponseFormatter.format_error_response(str(e), 400)
+        
+        k = request.args.get('k', 10, type=int)
+        k = max(1, min(k, Config.MAX_NEAREST_LOCATIONS))
+        
+        locations = services.db.find_nearest_locations(lat, lon, k)
+        
+        return ResponseFormatter.format_success_response(
+            {'locations': locations, 'count': len(locations)}, 200
+        )
+        
+    except Exception as e:
+        count_error(e)
+        logger.error(f"Error finding nearest locations: {str(e)}")
+        return ResponseFormatter.format_error_response(
+            'Failed to find locations', 500
+        )
+
+
 @api.route('/query/<int:query_id>', methods=['GET'])
 def get_query(query_id):
     """
@@ -176,17 +1037,20 @@ def get_query(query_id):
             "timestamp": "2024-02-10 14:30:00"
         }
     """
+    services = get_services()
     try:
-        query = db.get_query_by_id(query_id)
+        query = services.db.get_query_by_id(query_id)
         
         if not query:
             return ResponseFormatter.format_error_response(
                 f'Query with ID {query_id} not found', 404
             )
         
-        return ResponseFormatter.format_success_response(query, 200)
+        # jsonify: a QueryRecord is not a dict, but the JSON provider encodes it
+        return jsonify(query), 200
         
     except Exception as e:
+        count_error(e)
         logger.error(f"Error retrieving query {query_id}: {str(e)}")
         return ResponseFormatter.format_error_response(
             'Failed to retrieve query', 500
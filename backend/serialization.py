@@ -0,0 +1,347 @@
+"""
+JSON serialization
+Flask JSON provider with pluggable encoders (orjson or msgspec when
+installed, the stdlib encoder otherwise) that encodes long list
+responses in chunks while they are sent
+"""
+
+import json
+import logging
+from typing import Callable, Iterator, Optional, Tuple
+
+from flask.json.provider import DefaultJSONProvider
+
+from config import Config
+import records
+from records import Coordinates, QueryMatch, QueryRecord
+
+logger = logging.getLogger(__name__)
+
+# Tried in this order when Config.JSON_BACKEND is 'auto'
+BACKENDS = ('orjson', 'msgspec', 'json')
+
+# Keyword arguments of dumps() the encoders understand; others take the stdlib path
+_ENCODER_ARGS = frozenset({'indent', 'separators', 'sort_keys'})
+
+# The only separators the encoders write: compact, or ': ' after keys when indenting
+_COMPACT_SEPARATORS = (',', ':')
+_INDENT_SEPARATORS = (',', ': ')
+
+
+def _default(o):
+    if isinstance(o, (QueryRecord, Coordinates)):
+        return o.to_dict()
+    return DefaultJSONProvider.default(o)
+
+
+def _orjson_encoder(default: Callable) -> Optional[Callable]:
+    """orjson encoder, or None if orjson is not installed"""
+    try:
+        import orjson
+    except ImportError:
+        return None
+
+    # Datetimes go through default(), which writes HTTP dates like the stdlib path
+    base = orjson.OPT_PASSTHROUGH_DATETIME
+
+    def encode(obj, sort_keys: bool, indent: Optional[int]) -> Optional[bytes]:
+        if indent not in (None, 2):
+            return None
+        option = base
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except orjson.JSONEncodeError:
+            # Non-string keys, integers over 64 bits, unknown types
+            return None
+
+    return encode
+
+
+def _record_structs(msgspec) -> Callable:
+    """
+    Converter from records to msgspec Structs laid out like to_dict()
+
+    msgspec encodes Structs natively, without the nested per-record dicts
+    that to_dict() builds. Fields are declared in sorted order, the order
+    of every other record encoding.
+    """
+    class Coords(msgspec.Struct, gc=False):
+        lat: float
+        lon: float
+
+    class Query(msgspec.Struct, gc=False):
+        destination: str
+        destination_coords: Coords
+        distance_km: float
+        distance_miles: float
+        id: int
+        source: str
+        source_coords: Coords
+        timestamp: Optional[str]
+
+    class Match(msgspec.Struct, gc=False):
+        destination: str
+        destination_coords: Coords
+        distance_km: float
+        distance_miles: float
+        id: int
+        match_distance_km: float
+        matched_endpoint: str
+        source: str
+        source_coords: Coords
+        timestamp: Optional[str]
+
+    def convert(o):
+        if isinstance(o, QueryMatch):
+            return Match(
+                o.destination, Coords(o.dest_lat, o.dest_lon), o.distance_km, o.distance_miles, o.id,
+                o.match_distance_km, o.matched_endpoint, o.source, Coords(o.source_lat, o.source_lon), o.timestamp
+            )
+        if isinstance(o, QueryRecord):
+            return Query(
+                o.destination, Coords(o.dest_lat, o.dest_lon), o.distance_km, o.distance_miles, o.id,
+                o.source, Coords(o.source_lat, o.source_lon), o.timestamp
+            )
+        if isinstance(o, Coordinates):
+            return Coords(o.lat, o.lon)
+        return None
+
+    return convert
+
+
+def _msgspec_encoder(default: Callable) -> Optional[Callable]:
+    """msgspec encoder, or None if msgspec is not installed"""
+    try:
+        import msgspec
+    except ImportError:
+        return None
+
+    to_struct = _record_structs(msgspec)
+
+    def enc_hook(o):
+        struct = to_struct(o)
+        return default(o) if struct is None else struct
+
+    encoders = {
+        False: msgspec.json.Encoder(enc_hook=enc_hook),
+        True: msgspec.json.Encoder(enc_hook=enc_hook, order='sorted'),
+    }
+
+    def encode(obj, sort_keys: bool, indent: Optional[int]) -> Optional[bytes]:
+        try:
+            data = encoders[bool(sort_keys)].encode(obj)
+        except (TypeError, ValueError, OverflowError, msgspec.EncodeError):
+            return None
+        return data if indent is None else msgspec.json.format(data, indent=indent)
+
+    return encode
+
+
+def _json_encoder(default: Callable) -> Callable:
+    """Stdlib encoder; documents holding query records are written by records.dumps"""
+    def encode(obj, sort_keys: bool, indent: Optional[int]) -> bytes:
+        if indent is None and records.has_records(obj):
+            return records.dumps(obj, sort_keys=sort_keys, default=default).encode()
+        separators = (',', ':') if indent is None else None
+        return json.dumps(obj, default=default, sort_keys=sort_keys, indent=indent, separators=separators).encode()
+
+    return encode
+
+
+def _splice_records(encode_records: Callable, encode: Callable) -> Callable:
+    """
+    Encoder for documents holding records
+
+    Records and lists of them are encoded by encode_records; the keys and
+    other values of a dict around them by encode, so those are written as
+    without records (datetimes included). Indented output takes encode.
+    """
+    def splice(obj, sort_keys: bool, indent: Optional[int]) -> Optional[bytes]:
+        if indent is not None:
+            return encode(obj, sort_keys, indent)
+        if not isinstance(obj, dict):
+            return encode_records(obj, sort_keys, indent)
+        # One join at the end: the record lists are large and each concatenation copies them
+        parts = []
+        items = sorted(obj.items()) if sort_keys else obj.items()
+        for key, value in items:
+            data = (splice if records.has_records(value) else encode)(value, sort_keys, None)
+            if data is None:
+                return None
+            parts += (b',' if parts else b'{', encode(str(key), sort_keys, None), b':', data)
+        parts.append(b'}' if parts else b'{}')
+        return b''.join(parts)
+
+    return splice
+
+
+# Encoder factories by Config.JSON_BACKEND name
+ENCODERS = {
+    'orjson': _orjson_encoder,
+    'msgspec': _msgspec_encoder,
+    'json': _json_encoder,
+}
+
+
+def load_encoder(name: str, default: Callable = _default) -> Tuple[str, Callable]:
+    """
+    Create the encoder for a backend name
+
+    An encoder takes (obj, sort_keys, indent) and returns UTF-8 JSON
+    bytes, or None when it cannot encode the document.
+
+    Args:
+        name: 'auto' (first installed of BACKENDS), 'orjson', 'msgspec' or 'json'
+        default: Conversion for objects the encoder does not know
+
+    Returns:
+        Tuple of (backend name, encoder); a named backend that is not
+        installed falls back to 'json'
+
+    Raises:
+        ValueError: If the name is not a known backend
+    """
+    names = BACKENDS if name == 'auto' else (name,)
+    for backend in names:
+        factory = ENCODERS.get(backend)
+        if factory is None:
+            raise ValueError(f"Unknown JSON backend: {backend}")
+        encode = factory(default)
+        if encode is not None:
+            return backend, encode
+        if name != 'auto':
+            logger.warning(f"JSON backend {backend} is not installed, using the stdlib encoder")
+    return 'json', _json_encoder(default)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider encoding with orjson or msgspec when installed
+
+    Output is compact (or indented by 2 in debug mode) with sorted keys,
+    as with the default provider. orjson and msgspec write non-ASCII text
+    as UTF-8 instead of \\u escapes, and msgspec writes datetimes as RFC
+    3339 instead of HTTP dates. Documents the backend rejects (such as
+    dicts with non-string keys) are encoded by the stdlib.
+
+    Query records are encoded without building their dicts: as msgspec
+    Structs by msgspec (also for the records in a document under 'auto'
+    when msgspec is installed, since orjson can only take them as dicts)
+    and directly from the slots by the stdlib backend.
+
+    Responses holding a list of at least stream_min_items items are
+    streamed: the list is encoded stream_chunk_items items at a time as
+    the response is sent, so the whole body is never held in memory.
+    Streamed responses are compact even in debug mode. stream_min_items
+    of 0 turns streaming off.
+    """
+
+    default = staticmethod(_default)
+
+    def __init__(self, app, backend: Optional[str] = None):
+        """
+        Args:
+            app: Flask application
+            backend: Backend name (defaults to Config.JSON_BACKEND)
+        """
+        super().__init__(app)
+        name = backend or Config.JSON_BACKEND
+        self.backend, self._encode = load_encoder(name, self.default)
+        self._fallback = _json_encoder(self.default)
+        # orjson only sees records through default (to_dict); under 'auto'
+        # records take msgspec's Struct path when it is installed
+        self._encode_records = self._encode
+        if name == 'auto' and self.backend == 'orjson':
+            structs = _msgspec_encoder(self.default)
+            if structs is not None:
+                self._encode_records = _splice_records(structs, self._encode)
+        self.stream_min_items = Config.JSON_STREAM_MIN_ITEMS
+        self.stream_chunk_items = Config.JSON_STREAM_CHUNK_ITEMS
+
+    def encode(self, obj, sort_keys: Optional[bool] = None, indent: Optional[int] = None) -> bytes:
+        """
+        Encode a document as UTF-8 JSON
+
+        Args:
+            obj: Document to encode
+            sort_keys: Sort dict keys (defaults to the provider's sort_keys)
+            indent: Indent width, or None for compact output
+
+        Returns:
+            JSON bytes
+        """
+        if sort_keys is None:
+            sort_keys = self.sort_keys
+        encode = self._encode_records if records.has_records(obj) else self._encode
+        data = encode(obj, sort_keys, indent)
+        if data is None:
+            data = self._fallback(obj, sort_keys, indent)
+        return data
+
+    def dumps(self, obj, **kwargs) -> str:
+        separators = kwargs.get('separators')
+        written = _COMPACT_SEPARATORS if kwargs.get('indent') is None else _INDENT_SEPARATORS
+        if not kwargs.keys() <= _ENCODER_ARGS or (separators is not None and tuple(separators) != written):
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj, kwargs.get('sort_keys'), kwargs.get('indent')).decode()
+
+    def _stream_list(self, value) -> bool:
+        return isinstance(value, list) and 0 < self.stream_min_items <= len(value)
+
+    def streamable(self, obj) -> bool:
+        """Whether obj is a long list, or a dict holding one"""
+        if isinstance(obj, dict):
+            return any(self._stream_list(value) for value in obj.values())
+        return self._stream_list(obj)
+
+    def _iter_list(self, items: list, sort_keys: bool) -> Iterator[bytes]:
+        step = self.stream_chunk_items
+        for start in range(0, len(items), step):
+            # Encode the slice as a list and drop its brackets
+            piece = self.encode(items[start:start + step], sort_keys)[1:-1]
+            yield (b'[' if start == 0 else b',') + piece
+        yield b']'
+
+    def iter_encode(self, obj, sort_keys: Optional[bool] = None) -> Iterator[bytes]:
+        """
+        Encode a document as compact JSON in pieces
+
+        Long lists (top level or values of a top level dict) are encoded
+        stream_chunk_items items at a time; everything else in one piece.
+        The pieces join to the output of encode(), plus a trailing newline.
+
+        Args:
+            obj: Document to encode
+            sort_keys: Sort dict keys (defaults to the provider's sort_keys)
+
+        Yields:
+            JSON bytes
+        """
+        if sort_keys is None:
+            sort_keys = self.sort_keys
+        if self._stream_list(obj):
+            yield from self._iter_list(obj, sort_keys)
+        elif isinstance(obj, dict) and self.streamable(obj):
+            items = sorted(obj.items()) if sort_keys else obj.items()
+            for position, (key, value) in enumerate(items):
+                prefix = (b',' if position else b'{') + self.encode(str(key)) + b':'
+                if self._stream_list(value):
+                    yield prefix
+                    yield from self._iter_list(value, sort_keys)
+                else:
+                    yield prefix + self.encode(value, sort_keys)
+            yield b'}'
+        else:
+            yield self.encode(obj, sort_keys)
+        yield b'\n'
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.streamable(obj):
+            return self._app.response_class(self.iter_encode(obj), mimetype=self.mimetype)
+        indent = 2 if (self.compact is None and self._app.debug) or self.compact is False else None
+        return self._app.response_class(self.encode(obj, indent=indent) + b'\n', mimetype=self.mimetype)
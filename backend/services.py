@@ -0,0 +1,168 @@
+import atexit
+import logging
+import threading
+import weakref
+from typing import Optional
+
+from flask import current_app
+
+from analytics import HistorySnapshot
+from cache import FuzzyAddressIndex, GeocodeCache, PairCache
+from config import Config
+from database import Database
+from geocoding import Geocoder
+from writer import QueryWriter
+
+logger = logging.getLogger(__name__)
+
+# Key of the Services instance in app.extensions
+EXTENSION_KEY = 'distance_services'
+
+_instances = weakref.WeakSet()
+
+
+class Services:
+    """
+    Database, caches, geocoder and history writer of one app
+
+    Each service is created the first time it is used rather than when the
+    app is built, so importing and creating the app touches neither the
+    disk nor the network, and a preloaded server forks before any
+    connection or thread exists. Services passed to the constructor are
+    used as they are (tests, benchmarks).
+    """
+
+    NAMES = ('db', 'geocode_cache', 'pair_cache', 'fuzzy_index', 'geocoder', 'query_writer', 'analytics')
+
+    def __init__(self, **services):
+        """
+        Args:
+            **services: Prebuilt services by name (see NAMES)
+
+        Raises:
+            TypeError: If a name is not a known service
+        """
+        unknown = set(services) - set(self.NAMES)
+        if unknown:
+            raise TypeError(f"Unknown services: {', '.join(sorted(unknown))}")
+        self._services = dict(services)
+        # Reentrant: creating the geocoder creates the caches and database
+        self._lock = threading.RLock()
+        _instances.add(self)
+
+    def _get(self, name: str):
+        try:
+            return self._services[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._services:
+                self._services[name] = getattr(self, f"_create_{name}")()
+                logger.info(f"Created service {name}")
+            return self._services[name]
+
+    def created(self, name: str):
+        """
+        Get a service only if it already exists
+
+        Args:
+            name: Service name
+
+        Returns:
+            The service, or None if it was never used
+        """
+        return self._services.get(name)
+
+    @property
+    def db(self) -> Database:
+        return self._get('db')
+
+    @property
+    def geocode_cache(self) -> GeocodeCache:
+        return self._get('geocode_cache')
+
+    @property
+    def pair_cache(self) -> PairCache:
+        return self._get('pair_cache')
+
+    @property
+    def fuzzy_index(self) -> Optional[FuzzyAddressIndex]:
+        return self._get('fuzzy_index')
+
+    @property
+    def geocoder(self) -> Geocoder:
+        return self._get('geocoder')
+
+    @property
+    def query_writer(self) -> QueryWriter:
+        return self._get('query_writer')
+
+    @property
+    def analytics(self) -> HistorySnapshot:
+        return self._get('analytics')
+    
+    def _create_db(self) -> Database:
+        return Database()
+
+    def _create_geocode_cache(self) -> GeocodeCache:
+        return GeocodeCache(self.db)
+
+    def _create_pair_cache(self) -> PairCache:
+        return PairCache(self.geocode_cache)
+
+    def _create_fuzzy_index(self) -> Optional[FuzzyAddressIndex]:
+        return FuzzyAddressIndex(self.geocode_cache) if Config.FUZZY_MATCH_ENABLED else None
+
+    def _create_geocoder(self) -> Geocoder:
+        return Geocoder(cache=self.geocode_cache, fuzzy_index=self.fuzzy_index)
+
+    def _create_query_writer(self) -> QueryWriter:
+        writer = QueryWriter(self.db)
+        atexit.register(writer.close)
+        return writer
+    
+    def _create_analytics(self) -> HistorySnapshot:
+        return HistorySnapshot(self.db)
+
+    def close(self, timeout: float = None):
+        """
+        Flush queued history and close connections of the services in use
+
+        Args:
+            timeout: Seconds to wait for the history writer to drain
+        """
+        writer = self.created('query_writer')
+        if writer is not None:
+            writer.close(timeout=timeout)
+        geocoder = self.created('geocoder')
+        if geocoder is not None:
+            geocoder.close()
+        db = self.created('db')
+        if db is not None:
+            db.close()
+
+
+def instances():
+    """Services of every app alive in this process"""
+    return list(_instances)
+
+
+def init_app(app, services: Services = None) -> Services:
+    """
+    Attach services to an app
+
+    Args:
+        app: Flask application
+        services: Services to use, by default a new lazily built set
+
+    Returns:
+        The app's Services
+    """
+    services = services or Services()
+    app.extensions[EXTENSION_KEY] = services
+    return services
+
+
+def get_services(app=None) -> Services:
+    """Services of the given app, or of the app handling the current request"""
+    return (app or current_app).extensions[EXTENSION_KEY]
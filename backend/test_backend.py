@@ -1,8 +1,46 @@
 import pytest
+import asyncio
+import csv
 import os
+import pstats
+import json
+import logging
+import multiprocessing
+import re
+import runpy
+import sqlite3
+import struct
+import subprocess
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from array import array
 from validation import Validator, ValidationError
 from utils import DistanceCalculator
-from geocoding import Geocoder, GeocodingError
+from geocoding import AsyncGeocoder, Geocoder, GeocodingError, RateLimiter
+from cache import FuzzyAddressIndex, GeocodeCache, PairCache, canonical_address, normalize_address
+from gazetteer import Gazetteer, GazetteerError
+from database import Database
+from config import Config
+from writer import QueryWriter
+import metrics
+import tracing
+from app import create_app, create_asgi_app
+import routes
+import services as services_module
+from services import Services
+from analytics import HistorySnapshot
+from benchmarks.mock_nominatim import MockNominatimServer, fake_coordinates
+from benchmarks import load, suite
+import analytics
+import bulk
+import records
+from records import QueryMatch, QueryRecord
+import export
+import serialization
+from serialization import FastJSONProvider
 
 
 class TestValidator:
@@ -38,7 +76,34 @@ class TestValidator:
         
         with pytest.raises(ValidationError):
             Validator.validate_address("' OR '1'='1")
-    
+
+    def test_combined_matcher_matches_patterns(self):
+        """Test the single-pass matcher agrees with the individual patterns"""
+        samples = [
+            "Paris, France", "Oregon Ave = 5", "Orchard Road, Singapore",
+            "Land's End", "a OR b = c", "x AND\ny = z", "Selection Street",
+            "drop table x", "EXECUTED", "exec sp_who", "Union Square",
+            "Reunion Island", "a -- b", "a /* b", "a */ b", "; b --",
+            "'x' or 'y'='y'", "Portland, OR", "OR\n=", "Store = 2nd Ave",
+            # Multi-line: \s in "'\s*OR\s*'" spans the newlines, "." does not
+            "a'\nOR\n'b=c", "a'\tor\r\n'b\n=c", "a\nAND b\n= c", "x'\n\nOR\n'y' = 'y'",
+        ]
+        for sample in samples:
+            expected = any(
+                re.search(pattern, sample, re.IGNORECASE)
+                for pattern in Validator.SQL_INJECTION_PATTERNS
+            )
+            assert bool(Validator.SQL_INJECTION_RE.search(sample)) == expected, sample
+
+    def test_validate_many(self):
+        """Test batch validation returns per-item results"""
+        results = Validator.validate_many([" Paris ", "", "DROP TABLE x", "Tokyo"])
+
+        assert results[0] == ("Paris", None)
+        assert results[1][0] is None and "required" in results[1][1]
+        assert results[2] == (None, "Address contains invalid characters")
+        assert results[3] == ("Tokyo", None)
+
     def test_whitespace_trimming(self):
         """Test that whitespace is trimmed"""
         address = Validator.validate_address("  Paris, France  ")
@@ -108,6 +173,1772 @@ class TestDistanceCalculator:
         assert 'miles' in result
         assert 3900 < result['km'] < 4000
         assert 2400 < result['miles'] < 2500
+    
+    def test_haversine_distances_matches_scalar(self):
+        """Test that the batch engine agrees with the scalar formula"""
+        src_lats = array('d', [40.7128, 48.8566, 0.0])
+        src_lons = array('d', [-74.0060, 2.3522, 0.0])
+        dst_lats = array('d', [34.0522, 51.5074, 0.0])
+        dst_lons = array('d', [-118.2437, -0.1278, 180.0])
+        
+        km, miles = DistanceCalculator.haversine_distances(
+            src_lats, memoryview(src_lons), list(dst_lats), dst_lons
+        )
+        
+        for i in range(3):
+            expected = DistanceCalculator.haversine_distance(
+                src_lats[i], src_lons[i], dst_lats[i], dst_lons[i]
+            )
+            assert km[i] == pytest.approx(expected)
+            assert miles[i] == pytest.approx(DistanceCalculator.km_to_miles(expected))
+    
+    def test_haversine_distances_python_fallback(self):
+        """Test the pure Python batch engine"""
+        km, miles = DistanceCalculator._haversine_python(
+            [40.7128], [-74.0060], [34.0522], [-118.2437]
+        )
+        assert isinstance(km, array)
+        assert 3900 < km[0] < 4000
+        assert 2400 < miles[0] < 2500
+        
+        with pytest.raises(ValueError):
+            DistanceCalculator._haversine_python([1.0], [1.0], [], [])
+    
+    def test_haversine_distances_length_mismatch(self):
+        """Test that the NumPy engine rejects sequences of different lengths instead of broadcasting"""
+        pytest.importorskip('numpy')
+        with pytest.raises(ValueError):
+            DistanceCalculator._haversine_numpy([1.0], [1.0], [2.0, 3.0], [2.0, 3.0])
+
+
+class TestGeocodeCache:
+    """Test the two-tier geocode cache"""
+    
+    def test_normalize_address(self):
+        """Test cache key normalization"""
+        assert normalize_address("  New   York,  NY ") == "new york, ny"
+    
+    def test_geocode_uses_cache(self, tmp_path, monkeypatch):
+        """Test that repeated lookups are served from the cache"""
+        calls = []
+        geocoder = Geocoder(cache=GeocodeCache(Database(str(tmp_path / "test.db"))))
+        monkeypatch.setattr(
+            geocoder, '_fetch',
+            lambda address: calls.append(address) or {'lat': 48.85, 'lon': 2.35}
+        )
+        
+        assert geocoder.geocode("Paris, France") == {'lat': 48.85, 'lon': 2.35}
+        assert geocoder.geocode("paris,  FRANCE") == {'lat': 48.85, 'lon': 2.35}
+        assert len(calls) == 1
+        
+        stats = geocoder.cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+    
+    def test_negative_results_cached(self, tmp_path, monkeypatch):
+        """Test that failed lookups are cached"""
+        calls = []
+        geocoder = Geocoder(cache=GeocodeCache(Database(str(tmp_path / "test.db"))))
+        monkeypatch.setattr(geocoder, '_fetch', lambda address: calls.append(address))
+        
+        for _ in range(2):
+            with pytest.raises(GeocodingError):
+                geocoder.geocode("XYZ Invalid Place")
+        
+        assert len(calls) == 1
+        assert geocoder.cache.stats()['negative_hits'] == 1
+    
+    def test_lru_eviction(self):
+        """Test that the memory tier evicts least recently used entries"""
+        cache = GeocodeCache(max_size=2)
+        cache.set("a street", {'lat': 1.0, 'lon': 1.0})
+        cache.set("b street", {'lat': 2.0, 'lon': 2.0})
+        cache.get("a street")
+        cache.set("c street", {'lat': 3.0, 'lon': 3.0})
+        
+        assert cache.get("b street") is None
+        assert cache.get("a street") is not None
+        assert cache.stats()['evictions'] == 1
+    
+    def test_persistent_tier(self, tmp_path):
+        """Test that entries survive a fresh memory tier"""
+        db = Database(str(tmp_path / "test.db"))
+        GeocodeCache(db).set("Berlin", {'lat': 52.52, 'lon': 13.40})
+        
+        entry = GeocodeCache(db).get("berlin")
+        assert entry is not None
+        assert entry.coords == {'lat': 52.52, 'lon': 13.40}
+    
+    def test_expired_entries_miss(self):
+        """Test that entries past their TTL are not returned"""
+        cache = GeocodeCache()
+        entry = cache.set("Rome", {'lat': 41.9, 'lon': 12.5})
+        entry.expires_at = 0
+        
+        assert cache.get("Rome") is None
+        assert cache.stats()['expirations'] == 1
+
+
+class TestDatabase:
+    """Test database connection handling"""
+    
+    def test_connection_reused_per_thread(self, tmp_path):
+        """Test that a thread reuses its connection with WAL enabled"""
+        db = Database(str(tmp_path / "test.db"))
+        
+        with db.get_connection() as first:
+            mode = first.execute('PRAGMA journal_mode').fetchone()[0]
+        with db.get_connection() as second:
+            pass
+        
+        assert first is second
+        assert mode == 'wal'
+    
+    def test_concurrent_writers(self, tmp_path):
+        """Test that concurrent threads can write safely"""
+        db = Database(str(tmp_path / "test.db"))
+        
+        def write(_):
+            for _ in range(20):
+                db.save_query("A street", "B street", 1.0, 2.0, 3.0, 4.0, 5.0, 3.1)
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(write, range(8)))
+        
+        with db.get_connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM queries').fetchone()[0] == 160
+        db.close()
+    
+    def test_save_queries(self, tmp_path):
+        """Test batched inserts"""
+        db = Database(str(tmp_path / "test.db"))
+        rows = [("A street", "B street", 1.0, 2.0, 3.0, 4.0, 5.0, 3.1)] * 3
+        
+        assert db.save_queries(rows) == 3
+        assert db.save_queries([]) == 0
+        assert len(db.get_history()) == 3
+
+
+class TestHistoryPagination:
+    """Test keyset pagination and filters on history"""
+    
+    @pytest.fixture
+    def db(self, tmp_path):
+        db = Database(str(tmp_path / "test.db"))
+        rows = [
+            (f"Source {i}", f"Destination {i}", 1.0, 2.0, 3.0, 4.0, 5.0, 3.1)
+            for i in range(1, 11)
+        ]
+        db.save_queries(rows)
+        with db.get_connection() as conn:
+            conn.execute("UPDATE queries SET timestamp = datetime(1704067200 + id * 3600, 'unixepoch')")
+        return db
+    
+    def test_keyset_pages(self, db):
+        """Test paging backwards and forwards with id cursors"""
+        first = db.get_history(4)
+        assert [q['id'] for q in first] == [10, 9, 8, 7]
+        
+        second = db.get_history(4, before_id=first[-1]['id'])
+        assert [q['id'] for q in second] == [6, 5, 4, 3]
+        
+        previous = db.get_history(4, after_id=second[0]['id'])
+        assert [q['id'] for q in previous] == [10, 9, 8, 7]
+    
+    def test_filters(self, db):
+        """Test address substring and time range filters"""
+        assert [q['id'] for q in db.get_history(address='destination 1')] == [10, 1]
+        assert db.get_history(address='100%') == []
+        
+        ranged = db.get_history(since='2024-01-01 03:00:00', until='2024-01-01 05:00:00')
+        assert [q['id'] for q in ranged] == [4, 3]
+    
+    def test_iter_history_chunks(self, db):
+        """Test that the export stream reads fixed-size chunks, oldest first, with filters"""
+        chunks = list(db.iter_history(chunk_size=4))
+        assert [len(rows) for rows in chunks] == [4, 4, 2]
+        assert [row[0] for rows in chunks for row in rows] == list(range(1, 11))
+        assert len(chunks[0][0]) == len(export.EXPORT_COLUMNS)
+        
+        assert [row[0] for rows in db.iter_history(after_id=8) for row in rows] == [9, 10]
+        assert [row[0] for rows in db.iter_history(address='destination 1') for row in rows] == [1, 10]
+    
+    def test_export_endpoint(self, db, monkeypatch):
+        """Test CSV and NDJSON export and format validation"""
+        monkeypatch.setattr(Config, 'EXPORT_CHUNK_ROWS', 3)
+        client = create_app(services=Services(db=db)).test_client()
+        
+        response = client.get('/api/history/export')
+        assert response.mimetype == 'text/csv'
+        assert 'history.csv' in response.headers['Content-Disposition']
+        rows = list(csv.DictReader(response.get_data(as_text=True).splitlines()))
+        assert [int(row['id']) for row in rows] == list(range(1, 11))
+        assert rows[0]['timestamp'] == '2024-01-01 01:00:00'
+        
+        response = client.get('/api/history/export?format=ndjson&since=2024-01-01T03:00:00')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [line['id'] for line in lines] == list(range(3, 11))
+        assert lines[0]['distance_km'] == 5.0
+        
+        assert client.get('/api/history/export?format=xml').status_code == 400
+        assert client.get('/api/history/export?since=yesterday').status_code == 400
+    
+    def test_export_arrow_and_parquet(self, db, monkeypatch):
+        """Test columnar exports round-trip through pyarrow"""
+        pa = pytest.importorskip("pyarrow")
+        import pyarrow.parquet as pq
+        monkeypatch.setattr(Config, 'EXPORT_CHUNK_ROWS', 4)
+        client = create_app(services=Services(db=db)).test_client()
+        
+        table = pa.ipc.open_stream(client.get('/api/history/export?format=arrow').get_data()).read_all()
+        assert table.column_names == list(export.EXPORT_COLUMNS)
+        assert table.column('id').to_pylist() == list(range(1, 11))
+        
+        data = client.get('/api/history/export?format=parquet').get_data()
+        parquet = pq.ParquetFile(pa.BufferReader(data))
+        assert parquet.metadata.num_row_groups == 3
+        assert parquet.read().column('source').to_pylist()[0] == 'Source 1'
+    
+    def test_validate_cursor_and_timestamp(self):
+        """Test validation of pagination parameters"""
+        assert Validator.validate_cursor(None) is None
+        assert Validator.validate_cursor("12") == 12
+        with pytest.raises(ValidationError):
+            Validator.validate_cursor("abc")
+        
+        assert Validator.validate_timestamp("2024-02-10T14:30:00") == "2024-02-10 14:30:00"
+        assert Validator.validate_timestamp("2024-02-10") == "2024-02-10 00:00:00"
+        with pytest.raises(ValidationError):
+            Validator.validate_timestamp("yesterday")
+
+
+class TestQueryRecords:
+    """Test slotted query records and their JSON fast path"""
+    
+    def test_record_json_matches_dict(self):
+        """Test that to_json and records.dumps match json.dumps of the dicts"""
+        record = QueryRecord(7, 'Caf\u00e9 "Nord"', 'B\\C', 1.5, -2.0, 3.0, 4.25, 1234.5678, 767.1)
+        match = QueryMatch(
+            8, 'A', 'B', 1.0, 2.0, 3.0, 4.0, 5.0, 3.1, '2024-01-01 00:00:00',
+            matched_endpoint='source', match_distance_km=0.1234
+        )
+        for item in (record, match):
+            assert item.to_json() == json.dumps(item.to_dict(), sort_keys=True, separators=(',', ':'))
+        
+        document = {'queries': [record, match], 'count': 2, 'next_before_id': None}
+        assert json.loads(records.dumps(document)) == {
+            'queries': [record.to_dict(), match.to_dict()], 'count': 2, 'next_before_id': None
+        }
+        
+        # Item access and comparison as with the dicts they replace
+        assert record['distance_km'] == 1234.57
+        assert record['source_coords']['lat'] == 1.5
+        assert record.destination_coords == {'lat': 3.0, 'lon': 4.25}
+        assert match['matched_endpoint'] == 'source'
+        assert record == record.to_dict()
+        with pytest.raises(KeyError):
+            record['source_lat_lon']
+    
+    def test_endpoints_serialize_records(self, tmp_path):
+        """Test history, query and nearby responses, compact and pretty-printed"""
+        db = Database(str(tmp_path / "test.db"))
+        db.save_queries([
+            ("Times Square", "Hollywood", 40.7580, -73.9855, 34.0928, -118.3287, 3950.004, 2454.4),
+            ("Central Park", "Paris", 40.7812, -73.9665, 48.8566, 2.3522, 5840.0, 3628.8),
+        ])
+        app = create_app(services=Services(db=db))
+        client = app.test_client()
+        
+        history = client.get('/api/history?limit=2').get_json()
+        assert [q['id'] for q in history['queries']] == [2, 1]
+        assert history['queries'][1]['distance_km'] == 3950.0
+        assert history['queries'][1]['source_coords'] == {'lat': 40.7580, 'lon': -73.9855}
+        assert history['next_before_id'] == 1
+        
+        query = client.get('/api/query/1').get_json()
+        assert query == db.get_query_by_id(1).to_dict()
+        
+        nearby = client.get('/api/queries/nearby?lat=40.7700&lon=-73.9750&radius_km=5').get_json()
+        assert [q['matched_endpoint'] for q in nearby['queries']] == ['source', 'source']
+        
+        app.debug = True
+        assert client.get('/api/history?limit=2').get_json() == history
+
+
+class TestJSONProvider:
+    """Test the pluggable JSON provider and streamed list responses"""
+    
+    @pytest.fixture
+    def document(self):
+        record = QueryRecord(7, 'Caf\u00e9', 'B', 1.5, -2.0, 3.0, 4.25, 1234.5678, 767.1, '2024-01-01 00:00:00')
+        return {
+            'queries': [record, record],
+            'count': 2,
+            'unit': 'km',
+            'distances': [[1.5, None], [2.25, 0.0]],
+            'created': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        }
+    
+    @pytest.mark.parametrize('backend', serialization.BACKENDS)
+    def test_backends_encode_alike(self, document, backend):
+        """Test that every backend matches the stdlib output, falling back where needed"""
+        app = create_app()
+        provider = FastJSONProvider(app, backend)
+        stdlib = FastJSONProvider(app, 'json')
+        if provider.backend != backend:
+            pytest.skip(f"{backend} is not installed")
+        
+        expected = json.loads(stdlib.encode(document))
+        assert expected['created'] == 'Tue, 02 Jan 2024 03:04:05 GMT'
+        if backend == 'msgspec':
+            # msgspec writes datetimes itself, as RFC 3339
+            expected['created'] = '2024-01-02T03:04:05Z'
+        assert json.loads(provider.encode(document)) == expected
+        assert json.loads(provider.dumps(document, indent=2)) == expected
+        assert provider.encode({'b': 1, 'a': [1, 2]}) == b'{"a":[1,2],"b":1}'
+        assert provider.dumps({'b': 1, 'a': [1, 2]}, separators=(',', ':')) == '{"a":[1,2],"b":1}'
+        assert provider.dumps({'b': 1, 'a': [1, 2]}, separators=(', ', ': ')) == '{"a": [1, 2], "b": 1}'
+        
+        # Documents the fast encoders reject are encoded by the stdlib
+        assert json.loads(provider.encode({2: 'a', 1: 2 ** 70})) == {'1': 2 ** 70, '2': 'a'}
+        with pytest.raises(TypeError):
+            provider.encode({'a': object()})
+        with pytest.raises(ValueError):
+            FastJSONProvider(app, 'simplejson')
+    
+    def test_records_skip_to_dict_under_auto(self, document, monkeypatch):
+        """Test that records are encoded from their slots, not through to_dict, on the default backend"""
+        pytest.importorskip('msgspec')
+        del document['created']
+        app = create_app()
+        expected = FastJSONProvider(app, 'json').encode(document)
+        
+        def to_dict(self):
+            raise AssertionError("to_dict called")
+        monkeypatch.setattr(QueryRecord, 'to_dict', to_dict)
+        monkeypatch.setattr(records.Coordinates, 'to_dict', to_dict)
+        provider = FastJSONProvider(app, 'auto')
+        assert json.loads(provider.encode(document)) == json.loads(expected)
+        assert json.loads(provider.encode(QueryMatch(*range(9), None, matched_endpoint='source', match_distance_km=1.0)))['matched_endpoint'] == 'source'
+    
+    def test_iter_encode_matches_encode(self, document):
+        """Test that streamed pieces join to the whole document"""
+        provider = FastJSONProvider(create_app())
+        provider.stream_min_items, provider.stream_chunk_items = 2, 1
+        
+        assert provider.streamable(document)
+        assert not provider.streamable({'queries': document['queries'][:1]})
+        pieces = list(provider.iter_encode(document))
+        assert len(pieces) > 5
+        assert b''.join(pieces) == provider.encode(document) + b'\n'
+        assert b''.join(provider.iter_encode([1, 2, 3])) == b'[1,2,3]\n'
+        
+        provider.stream_min_items = 0
+        assert not provider.streamable(document)
+    
+    def test_long_list_responses_stream(self, tmp_path):
+        """Test that responses holding long lists are streamed"""
+        db = Database(str(tmp_path / "test.db"))
+        db.save_queries([("A St", "B St", 1.0, 2.0, 3.0, 4.0, 10.0, 6.2)] * 5)
+        app = create_app(services=Services(db=db))
+        client = app.test_client()
+        
+        short = client.get('/api/history?limit=5')
+        assert short.content_length == len(short.data)
+        
+        app.json.stream_min_items, app.json.stream_chunk_items = 5, 2
+        streamed = client.get('/api/history?limit=5')
+        assert streamed.content_length is None
+        assert streamed.mimetype == 'application/json'
+        assert streamed.get_json() == short.get_json()
+
+
+class TestAnalytics:
+    """Test the columnar history snapshot and /api/stats"""
+    
+    @pytest.fixture
+    def db(self, tmp_path):
+        db = Database(str(tmp_path / "test.db"))
+        # Distances 1..100 km; pair i % 3 so pairs 1, 2 and 0 have 34, 33 and 33 queries
+        rows = [
+            (f"Source {i % 3}", f"Destination {i % 3}", 1.0, 2.0, 3.0, 4.0, float(i), i * 0.621371)
+            for i in range(1, 101)
+        ]
+        db.save_queries(rows)
+        with db.get_connection() as conn:
+            # Ten queries per hour from 2024-01-01 00:00 UTC
+            conn.execute("UPDATE queries SET timestamp = datetime(1704067200 + (id - 1) * 360, 'unixepoch')")
+        return db
+    
+    def test_aggregates(self, db, monkeypatch):
+        """Test exact counts and extremes, histogram percentiles, top pairs and hours"""
+        snapshot = HistorySnapshot(db)
+        stats = snapshot.stats(top=2, percentiles=(50, 99))
+        
+        assert stats['count'] == 100
+        assert stats['distance_km']['min'] == 1.0
+        assert stats['distance_km']['max'] == 100.0
+        assert stats['distance_km']['mean'] == 50.5
+        assert stats['distance_km']['percentiles']['p50'] == pytest.approx(50, rel=0.005)
+        assert stats['distance_km']['percentiles']['p99'] == pytest.approx(99, rel=0.005)
+        assert stats['top_pairs'] == [
+            {'source': 'Source 1', 'destination': 'Destination 1', 'count': 34},
+            {'source': 'Source 2', 'destination': 'Destination 2', 'count': 33},
+        ]
+        assert stats['per_hour'][0] == {'hour': '2024-01-01 00:00:00', 'count': 10}
+        assert len(stats['per_hour']) == 10
+        
+        ranged = snapshot.stats(since='2024-01-01 01:00:00', until='2024-01-01 03:00:00')
+        assert ranged['count'] == 20
+        assert ranged['distance_km']['min'] == 11.0
+        assert snapshot.stats(since='2025-01-01 00:00:00')['distance_km'] is None
+        
+        # Range queries over the columns agree with the running totals, and
+        # the pure Python fallback agrees with NumPy
+        everything = snapshot.stats(since='2024-01-01 00:00:00', top=2, percentiles=(50, 99))
+        assert everything == stats
+        monkeypatch.setattr(analytics, '_numpy', lambda: None)
+        assert snapshot.stats(since='2024-01-01 00:00:00', top=2, percentiles=(50, 99)) == stats
+        assert snapshot.stats(since='2024-01-01 01:00:00', until='2024-01-01 03:00:00') == ranged
+        
+        # Timestamps out of id order are filtered with a mask instead of bisection
+        with db.get_connection() as conn:
+            conn.execute("UPDATE queries SET timestamp = datetime(1704067200 + (100 - id) * 360, 'unixepoch')")
+        unordered = HistorySnapshot(db)
+        python_result = unordered.stats(since='2024-01-01 01:00:00', until='2024-01-01 03:00:00')
+        monkeypatch.undo()
+        numpy_result = unordered.stats(since='2024-01-01 01:00:00', until='2024-01-01 03:00:00')
+        assert python_result == numpy_result
+        assert numpy_result['count'] == 20
+        assert numpy_result['distance_km']['min'] == 71.0
+    
+    def test_follows_writes(self, db, tmp_path, monkeypatch):
+        """Test that saves feed the snapshot and other writers are caught up"""
+        snapshot = HistorySnapshot(db)
+        assert snapshot.stats()['count'] == 100
+        
+        reads = []
+        original = db.iter_stats_rows
+        monkeypatch.setattr(db, 'iter_stats_rows', lambda **kwargs: reads.append(kwargs) or original(**kwargs))
+        
+        db.save_query("Source 1", "Destination 1", 1.0, 2.0, 3.0, 4.0, 500.0, 310.7)
+        db.save_queries([("Far", "Away", 1.0, 2.0, 3.0, 4.0, 1000.0, 621.4)] * 2)
+        stats = snapshot.stats(top=1)
+        assert stats['count'] == 103
+        assert stats['distance_km']['max'] == 1000.0
+        assert stats['top_pairs'][0]['count'] == 35
+        assert reads == []
+        
+        # Another process writing to the same file
+        Database(str(tmp_path / "test.db")).save_query("A", "B", 1.0, 2.0, 3.0, 4.0, 2.0, 1.2)
+        assert snapshot.stats()['count'] == 104
+        assert len(reads) == 1
+        
+        db.clear_history()
+        assert snapshot.stats()['count'] == 0
+        db.save_query("A", "B", 1.0, 2.0, 3.0, 4.0, 2.0, 1.2)
+        assert snapshot.stats()['count'] == 1
+    
+    def test_stats_endpoint(self, db):
+        """Test /api/stats parameters and validation"""
+        client = create_app(services=Services(db=db)).test_client()
+        
+        response = client.get('/api/stats?since=2024-01-01T05:00:00&top=1&percentiles=10,90')
+        data = response.get_json()
+        assert response.status_code == 200
+        assert data['count'] == 50
+        assert set(data['distance_km']['percentiles']) == {'p10', 'p90'}
+        assert len(data['top_pairs']) == 1
+        
+        assert client.get('/api/stats?percentiles=150').status_code == 400
+        assert client.get('/api/stats?percentiles=fifty').status_code == 400
+        assert client.get('/api/stats?until=tomorrow').status_code == 400
+
+
+class TestSpatialIndex:
+    """Test radius and nearest-location lookups"""
+    
+    @pytest.fixture
+    def db(self, tmp_path):
+        db = Database(str(tmp_path / "test.db"))
+        db.save_queries([
+            ("Times Square", "Hollywood", 40.7580, -73.9855, 34.0928, -118.3287, 3950.0, 2454.4),
+            ("Central Park", "Paris", 40.7812, -73.9665, 48.8566, 2.3522, 5840.0, 3628.8),
+            ("Fiji", "Samoa", -17.7134, 179.9, -13.7590, -172.1046, 1150.0, 714.6),
+        ])
+        return db
+    
+    def test_queries_near(self, db):
+        """Test radius search with haversine refinement"""
+        near = db.find_queries_near(40.7700, -73.9750, 5)
+        assert [q['source'] for q in near] == ["Central Park", "Times Square"]
+        assert all(q['matched_endpoint'] == 'source' for q in near)
+        
+        assert db.find_queries_near(40.7700, -73.9750, 5, endpoint='destination') == []
+        assert [q['destination'] for q in db.find_queries_near(34.1, -118.3, 10)] == ["Hollywood"]
+    
+    def test_queries_near_antimeridian(self, db):
+        """Test that boxes crossing the antimeridian are split"""
+        near = db.find_queries_near(-17.7, -179.9, 50)
+        assert [q['source'] for q in near] == ["Fiji"]
+    
+    def test_nearest_locations(self, db):
+        """Test expanding nearest-location search"""
+        nearest = db.find_nearest_locations(40.7590, -73.9845, k=3)
+        assert [loc['address'] for loc in nearest] == ["Times Square", "Central Park", "Hollywood"]
+        assert nearest[0]['distance_km'] < 1
+    
+    def test_repeated_locations_grouped(self, db):
+        """Test that many queries from one location count as one candidate"""
+        db.save_queries([
+            ("Times Square", "Central Park", 40.7580, -73.9855, 40.7812, -73.9665, 2.9, 1.8)
+        ] * 200)
+        nearest = db.find_nearest_locations(40.7590, -73.9845, k=3)
+        assert [loc['address'] for loc in nearest] == ["Times Square", "Central Park", "Hollywood"]
+        
+        near = db.find_queries_near(40.7580, -73.9855, 1, limit=5)
+        assert len(near) == 5
+        assert all(q['match_distance_km'] < 0.01 for q in near)
+    
+    def test_index_follows_deletes(self, db):
+        """Test that clearing history empties the spatial index"""
+        db.clear_history()
+        assert db.find_queries_near(40.7700, -73.9750, 5) == []
+    
+    def test_existing_rows_backfilled(self, tmp_path):
+        """Test that rows stored before the index existed are indexed"""
+        path = str(tmp_path / "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute("""
+            CREATE TABLE queries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, source_address TEXT NOT NULL,
+                destination_address TEXT NOT NULL, source_lat REAL NOT NULL,
+                source_lon REAL NOT NULL, dest_lat REAL NOT NULL, dest_lon REAL NOT NULL,
+                distance_km REAL NOT NULL, distance_miles REAL NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute(
+            "INSERT INTO queries (source_address, destination_address, source_lat, source_lon,"
+            " dest_lat, dest_lon, distance_km, distance_miles)"
+            " VALUES ('Berlin', 'Rome', 52.52, 13.40, 41.9, 12.5, 1180.0, 733.2)"
+        )
+        conn.commit()
+        conn.close()
+        
+        assert len(Database(path).find_queries_near(41.9, 12.5, 1)) == 1
+
+
+class TestQueryWriter:
+    """Test the write-behind history queue"""
+    
+    ROW = ("A street", "B street", 1.0, 2.0, 3.0, 4.0, 5.0, 3.1)
+    
+    class BlockedDatabase:
+        """Database stand-in whose writes wait until released"""
+        
+        def __init__(self):
+            self.release = threading.Event()
+            self.rows = []
+        
+        def save_queries(self, rows):
+            self.release.wait(5)
+            self.rows.extend(rows)
+            return len(rows)
+    
+    def test_flushes_in_batches(self, tmp_path):
+        """Test that queued rows are saved in batches and drained on close"""
+        db = Database(str(tmp_path / "test.db"))
+        writer = QueryWriter(db, batch_size=10, flush_interval=0.05)
+        
+        for _ in range(25):
+            assert writer.submit(self.ROW)
+        writer.close(timeout=5)
+        
+        stats = writer.stats()
+        assert stats['written'] == 25
+        assert stats['queue_depth'] == 0
+        assert stats['flushes'] >= 3
+        assert len(db.get_history(100)) == 25
+    
+    def test_flushes_on_interval(self, tmp_path):
+        """Test that a partial batch is flushed after the interval"""
+        db = Database(str(tmp_path / "test.db"))
+        writer = QueryWriter(db, batch_size=100, flush_interval=0.05)
+        writer.submit(self.ROW)
+        
+        deadline = time.monotonic() + 5
+        while writer.stats()['written'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        assert writer.stats()['written'] == 1
+        writer.close()
+    
+    def test_drop_oldest_policy(self):
+        """Test that a full queue discards its oldest rows"""
+        db = self.BlockedDatabase()
+        writer = QueryWriter(db, max_queue=2, batch_size=1, policy='drop_oldest')
+        
+        for i in range(6):
+            writer.submit(self.ROW[:-1] + (i,))
+        db.release.set()
+        writer.close(timeout=5)
+        
+        stats = writer.stats()
+        assert stats['dropped'] >= 1
+        assert stats['written'] + stats['dropped'] == 6
+        assert db.rows[-1][-1] == 5
+    
+    def test_spill_policy(self, tmp_path):
+        """Test that overflow is spilled to disk and replayed"""
+        db = self.BlockedDatabase()
+        spill_path = str(tmp_path / "spill.jsonl")
+        writer = QueryWriter(db, max_queue=1, batch_size=1, policy='spill', spill_path=spill_path)
+        
+        for _ in range(5):
+            assert writer.submit(self.ROW)
+        assert writer.stats()['spilled'] >= 1
+        db.release.set()
+        writer.close(timeout=5)
+        
+        assert len(db.rows) == 5
+        assert db.rows[0] == self.ROW
+        assert not os.path.exists(spill_path)
+    
+    def test_failed_replay_keeps_spilled_rows(self, tmp_path):
+        """Test that rows of a failed flush are spilled and survive a replay that fails too"""
+        class FailingDatabase:
+            def save_queries(self, rows):
+                raise sqlite3.OperationalError("database is locked")
+        
+        spill_path = str(tmp_path / "spill.jsonl")
+        writer = QueryWriter(FailingDatabase(), batch_size=1, policy='spill', spill_path=spill_path)
+        for i in range(3):
+            writer.submit(self.ROW[:-1] + (i,))
+        writer.close(timeout=5)
+        
+        stats = writer.stats()
+        assert stats['written'] == 0
+        assert stats['spilled'] == 3
+        assert stats['dropped'] == 0
+        with open(spill_path + ".replay") as f:
+            assert len(f.readlines()) == 3
+        
+        db = self.BlockedDatabase()
+        db.release.set()
+        QueryWriter(db, policy='spill', spill_path=spill_path).close(timeout=5)
+        assert sorted(row[-1] for row in db.rows) == [0, 1, 2]
+        assert os.listdir(tmp_path) == []
+    
+    def test_claimed_orphan_retried_after_failed_replay(self, tmp_path, monkeypatch):
+        """Test that a spill file claimed from an exited process is kept until it is written"""
+        monkeypatch.setattr(Config, 'WRITE_BEHIND_SPILL_PATH', str(tmp_path / "queries.spill.jsonl"))
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        with open(tmp_path / f"queries.spill.{exited.pid}.jsonl", 'w') as f:
+            f.write(json.dumps(list(self.ROW)) + "\n")
+        
+        class FlakyDatabase(self.BlockedDatabase):
+            def save_queries(self, rows):
+                if not self.release.is_set():
+                    raise sqlite3.OperationalError("database is locked")
+                return super().save_queries(rows)
+        
+        db = FlakyDatabase()
+        writer = QueryWriter(db, policy='spill')
+        writer._replay_spill()
+        assert db.rows == [] and len(os.listdir(tmp_path)) == 1
+        
+        db.release.set()
+        writer._replay_spill()
+        assert db.rows == [self.ROW]
+        assert os.listdir(tmp_path) == []
+    
+    def test_replay_error_keeps_writer_running(self, tmp_path):
+        """Test that an unreadable spill file is logged and the writer keeps saving rows"""
+        db = self.BlockedDatabase()
+        db.release.set()
+        spill_path = str(tmp_path / "spill.jsonl")
+        os.mkdir(spill_path + ".replay")
+        writer = QueryWriter(db, batch_size=1, flush_interval=0.05, policy='spill', spill_path=spill_path)
+        
+        writer.submit(self.ROW)
+        time.sleep(0.2)
+        assert writer._thread.is_alive()
+        writer.submit(self.ROW)
+        writer.close(timeout=5)
+        assert len(db.rows) == 2
+    
+    def test_claims_spill_files_of_exited_processes(self, tmp_path, monkeypatch):
+        """Test that each process spills to its own file and replays files of exited ones"""
+        template = str(tmp_path / "queries.spill.jsonl")
+        monkeypatch.setattr(Config, 'WRITE_BEHIND_SPILL_PATH', template)
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        orphan = str(tmp_path / f"queries.spill.{exited.pid}.jsonl")
+        with open(orphan, 'w') as f:
+            f.write(json.dumps(list(self.ROW)) + "\n")
+        
+        db = self.BlockedDatabase()
+        db.release.set()
+        writer = QueryWriter(db, policy='spill')
+        assert writer.spill_path == str(tmp_path / f"queries.spill.{os.getpid()}.jsonl")
+        writer.close(timeout=5)
+        
+        assert db.rows == [self.ROW]
+        assert os.listdir(tmp_path) == []
+    
+    def test_close_reports_unwritten_rows(self, caplog):
+        """Test that close reports the rows left when the thread does not finish in time"""
+        db = self.BlockedDatabase()
+        writer = QueryWriter(db, batch_size=1)
+        for _ in range(3):
+            writer.submit(self.ROW)
+        
+        with caplog.at_level(logging.WARNING, logger='writer'):
+            writer.close(timeout=0.1)
+        assert "queries left unwritten" in caplog.text
+        db.release.set()
+
+
+class TestBatchEndpoint:
+    """Test the bulk calculate-distances endpoint"""
+    
+    COORDS = {
+        'new york, ny': {'lat': 40.7128, 'lon': -74.0060},
+        'los angeles, ca': {'lat': 34.0522, 'lon': -118.2437},
+        'paris, france': {'lat': 48.8566, 'lon': 2.3522},
+    }
+    
+    @pytest.fixture
+    def client(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(Config, 'WRITE_BEHIND_ENABLED', False)
+        return self.make_client(tmp_path, monkeypatch)
+    
+    def make_client(self, tmp_path, monkeypatch):
+        calls = []
+        db = Database(str(tmp_path / "test.db"))
+        geocoder = Geocoder(cache=GeocodeCache(db))
+        monkeypatch.setattr(
+            geocoder, '_fetch',
+            lambda address: calls.append(address) or self.COORDS.get(normalize_address(address))
+        )
+        services = Services(
+            db=db, geocoder=geocoder, geocode_cache=geocoder.cache, pair_cache=PairCache(geocoder.cache)
+        )
+        client = create_app(services=services).test_client()
+        client.services = services
+        client.geocode_calls = calls
+        client.db = db
+        return client
+    
+    def test_history_reads_own_writes(self, tmp_path, monkeypatch):
+        """Test that with the default config a calculation is in the history read right after it"""
+        client = self.make_client(tmp_path, monkeypatch)
+        response = client.post('/api/calculate-distance', json={
+            'source': 'New York, NY', 'destination': 'Paris, France'
+        })
+        assert response.status_code == 200
+        
+        history = client.get('/api/history').get_json()
+        assert history['count'] == 1
+        assert history['queries'][0]['destination'] == 'Paris, France'
+    
+    def test_batch_results(self, client):
+        """Test per-item results, deduplication and persistence"""
+        response = client.post('/api/calculate-distances', json={'pairs': [
+            {'source': 'New York, NY', 'destination': 'Los Angeles, CA'},
+            {'source': 'new york,  ny', 'destination': 'Los Angeles, CA'},
+            {'source': 'New York, NY', 'destination': 'Nowhere Special'},
+            {'source': 'DROP TABLE queries', 'destination': 'Los Angeles, CA'},
+            'not a pair',
+        ]})
+        data = response.get_json()
+        
+        assert response.status_code == 200
+        assert data['count'] == 5
+        assert data['succeeded'] == 2
+        assert data['failed'] == 3
+        assert 3900 < data['results'][0]['distance_km'] < 4000
+        assert data['results'][1]['source'] == 'new york,  ny'
+        assert data['results'][2]['status'] == 404
+        assert data['results'][3]['status'] == 400
+        assert data['results'][4]['status'] == 400
+        assert len(client.geocode_calls) == 3
+        assert len(client.db.get_history()) == 2
+    
+    def test_repeated_pair_served_from_cache(self, client):
+        """Test that an exact repeat skips geocoding and the history insert"""
+        body = {'source': 'New York, NY', 'destination': 'Los Angeles, CA'}
+        first = client.post('/api/calculate-distance', json=body).get_json()
+        second = client.post('/api/calculate-distance', json={
+            'source': 'new york,  NY', 'destination': 'Los Angeles, CA'
+        }).get_json()
+        
+        assert second['distance_km'] == first['distance_km']
+        assert second['source'] == 'new york,  NY'
+        assert len(client.geocode_calls) == 2
+        assert client.services.pair_cache.stats()['hits'] == 1
+        assert len(client.db.get_history()) == 1
+        
+        reversed_body = {'source': 'Los Angeles, CA', 'destination': 'New York, NY'}
+        client.post('/api/calculate-distance', json=reversed_body)
+        assert client.services.pair_cache.stats()['hits'] == 1
+    
+    def test_batch_requires_pairs(self, client):
+        """Test that an empty batch is rejected"""
+        response = client.post('/api/calculate-distances', json={'pairs': []})
+        assert response.status_code == 400
+    
+    def test_distance_matrix_json(self, client):
+        """Test the matrix endpoint geocodes each address once"""
+        response = client.post('/api/distance-matrix', json={
+            'origins': ['New York, NY', 'Paris, France'],
+            'destinations': ['Los Angeles, CA', 'new york, ny', 'Nowhere Special'],
+        })
+        data = response.get_json()
+        
+        assert response.status_code == 200
+        assert 3900 < data['distances'][0][0] < 4000
+        assert data['distances'][0][1] == 0
+        assert data['distances'][1][2] is None
+        assert data['errors'] == [
+            {'address': 'Nowhere Special', 'error': 'Could not find address: Nowhere Special'}
+        ]
+        assert len(client.geocode_calls) == 4
+    
+    def test_distance_matrix_streaming(self, client):
+        """Test NDJSON and float32 matrix output"""
+        body = {'origins': ['New York, NY', 'Paris, France'], 'destinations': ['Los Angeles, CA']}
+        
+        response = client.post('/api/distance-matrix', json=dict(body, format='ndjson', unit='miles'))
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert lines[0]['unit'] == 'miles'
+        assert [line['row'] for line in lines[1:]] == [0, 1]
+        assert 2400 < lines[1]['distances'][0] < 2500
+        
+        response = client.post('/api/distance-matrix', json=dict(body, format='float32'))
+        cells = array('f', response.get_data())
+        assert response.headers['X-Matrix-Rows'] == '2'
+        assert len(cells) == 2
+        assert 3900 < cells[0] < 4000
+
+
+class TestConcurrentGeocoder:
+    """Test concurrent batch geocoding against a local stub server"""
+    
+    def test_batch_geocode_concurrent(self):
+        """Test that lookups run concurrently and duplicates are coalesced"""
+        with MockNominatimServer(latency=0.1) as server:
+            geocoder = Geocoder(base_url=server.url, rate_limiter=RateLimiter(rate=0))
+            addresses = [f"Street {i}" for i in range(8)] + ["Street 0", "Nowhere Special"]
+            
+            results = geocoder.batch_geocode(addresses, max_workers=8)
+        
+        assert results["Street 3"] == dict(zip(('lat', 'lon'), fake_coordinates("Street 3")))
+        assert results["Nowhere Special"] is None
+        assert server.requests["Street 0"] == 1
+        assert server.max_active > 1
+    
+    def test_inflight_requests_coalesced(self):
+        """Test that concurrent lookups of one address share a request"""
+        with MockNominatimServer(latency=0.2) as server:
+            geocoder = Geocoder(base_url=server.url, rate_limiter=RateLimiter(rate=0))
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(geocoder.geocode, ["Main St", "main st", "Main St ", "MAIN ST"]))
+        
+        assert all(result == results[0] for result in results)
+        assert sum(server.requests.values()) == 1
+    
+    def test_async_owner_cancel_keeps_joined_lookup(self):
+        """Test that cancelling the task that started a lookup does not fail a task joined to it"""
+        pytest.importorskip("aiohttp")
+        async_geocoder = AsyncGeocoder(Geocoder(cache=GeocodeCache(), rate_limiter=RateLimiter(rate=0)))
+        fetches = []
+        
+        async def fetch(address):
+            fetches.append(address)
+            await asyncio.sleep(0.05)
+            return {'lat': 1.0, 'lon': 2.0}
+        async_geocoder._fetch = fetch
+        
+        async def run():
+            owner = asyncio.create_task(async_geocoder.geocode("Main St"))
+            await asyncio.sleep(0.01)
+            joined = asyncio.create_task(async_geocoder.geocode("main st"))
+            await asyncio.sleep(0.01)
+            owner.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await owner
+            return await joined
+        
+        assert asyncio.run(run()) == {'lat': 1.0, 'lon': 2.0}
+        assert fetches == ["Main St"]
+        assert async_geocoder.geocoder.cache.get("Main St").coords == {'lat': 1.0, 'lon': 2.0}
+    
+    def test_rate_limiter_spaces_requests(self):
+        """Test that the token bucket enforces its rate"""
+        limiter = RateLimiter(rate=20, burst=1)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.acquire()
+        assert time.monotonic() - start >= 0.19
+    
+    def test_connections_reused(self):
+        """Test that the pooled session keeps connections alive"""
+        with MockNominatimServer() as server:
+            geocoder = Geocoder(base_url=server.url, rate_limiter=RateLimiter(rate=0))
+            for i in range(5):
+                geocoder.geocode(f"Street {i}")
+            stats = geocoder.connection_stats()
+            geocoder.close()
+        
+        assert stats['requests'] == 5
+        assert stats['connections_opened'] == 1
+        assert stats['connections_reused'] == 4
+    
+    def test_retries_on_server_errors(self, monkeypatch):
+        """Test that 5xx responses are retried with backoff"""
+        monkeypatch.setattr(Config, 'NOMINATIM_BACKOFF_BASE', 0.01)
+        with MockNominatimServer(failures=2) as server:
+            geocoder = Geocoder(base_url=server.url, rate_limiter=RateLimiter(rate=0))
+            coords = geocoder.geocode("Main St")
+            stats = geocoder.connection_stats()
+        
+        assert coords == dict(zip(('lat', 'lon'), fake_coordinates("Main St")))
+        assert stats['retries'] == 2
+    
+    def test_retries_exhausted(self, monkeypatch):
+        """Test that a persistently failing provider raises GeocodingError"""
+        monkeypatch.setattr(Config, 'NOMINATIM_BACKOFF_BASE', 0.01)
+        with MockNominatimServer(failures=10) as server:
+            geocoder = Geocoder(base_url=server.url, rate_limiter=RateLimiter(rate=0))
+            geocoder.max_retries = 1
+            with pytest.raises(GeocodingError):
+                geocoder.geocode("Main St")
+    
+    def test_retries_on_failure_rate(self, monkeypatch):
+        """Test that randomly injected 503s are retried and counted by the stub"""
+        monkeypatch.setattr(Config, 'NOMINATIM_BACKOFF_BASE', 0.01)
+        with MockNominatimServer(failure_rate=0.3, seed=1) as server:
+            geocoder = Geocoder(base_url=server.url, rate_limiter=RateLimiter(rate=0))
+            for i in range(20):
+                assert geocoder.geocode(f"Street {i}") == dict(zip(('lat', 'lon'), fake_coordinates(f"Street {i}")))
+            stats = geocoder.connection_stats()
+        
+        assert server.failed > 0
+        assert stats['retries'] == server.failed
+    
+    def test_shared_limiter_per_provider(self):
+        """Test that geocoders for the same provider share one limiter"""
+        assert Geocoder().rate_limiter is Geocoder().rate_limiter
+
+
+class TestAsgiApp:
+    """Test the async execution mode against a local stub server"""
+    
+    @pytest.fixture
+    def asgi(self, tmp_path, monkeypatch):
+        pytest.importorskip("aiohttp")
+        server = MockNominatimServer(latency=0.2).start()
+        db = Database(str(tmp_path / "test.db"))
+        geocoder = Geocoder(
+            cache=GeocodeCache(db), base_url=server.url, rate_limiter=RateLimiter(rate=0)
+        )
+        services = Services(
+            db=db, geocoder=geocoder, geocode_cache=geocoder.cache, pair_cache=PairCache(geocoder.cache)
+        )
+        monkeypatch.setattr(Config, 'WRITE_BEHIND_ENABLED', False)
+        
+        def request(method, path, body=None):
+            """Drive the ASGI app directly, returning (status, decoded body)"""
+            app = create_asgi_app(services=services)
+            payload = json.dumps(body).encode() if body is not None else b''
+            messages = []
+            
+            async def receive():
+                return {'type': 'http.request', 'body': payload, 'more_body': False}
+            
+            async def send(message):
+                messages.append(message)
+            
+            async def call():
+                scope = {
+                    'type': 'http', 'http_version': '1.1', 'method': method, 'path': path, 'query_string': b'',
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())],
+                }
+                await app(scope, receive, send)
+                await app.geocoder.aclose()
+            
+            asyncio.run(call())
+            status = messages[0]['status']
+            text = b''.join(message.get('body', b'') for message in messages[1:]).decode()
+            return status, text
+        
+        request.server = server
+        request.db = db
+        yield request
+        server.stop()
+    
+    def test_geocodes_concurrently(self, asgi):
+        """Test that both addresses are looked up at once and the query is saved"""
+        start = time.monotonic()
+        status, text = asgi('POST', '/api/calculate-distance', {
+            'source': 'Main St', 'destination': 'High St'
+        })
+        elapsed = time.monotonic() - start
+        
+        assert status == 200
+        assert json.loads(text)['source_coords'] == dict(zip(('lat', 'lon'), fake_coordinates("Main St")))
+        assert asgi.server.max_active == 2
+        assert elapsed < 0.4
+        assert asgi.db.get_history(10)[0]['source'] == 'Main St'
+    
+    def test_repeated_pair_served_from_cache(self, asgi):
+        """Test that the async route shares the Flask route's pair cache and does not save repeats"""
+        body = {'source': ' Main St ', 'destination': 'High St'}
+        first = asgi('POST', '/api/calculate-distance', body)
+        second = asgi('POST', '/api/calculate-distance', body)
+        
+        assert first == second
+        assert sum(asgi.server.requests.values()) == 2
+        history = asgi.db.get_history(10)
+        assert [q['source'] for q in history] == ['Main St']
+        assert history[0]['distance_km'] == json.loads(first[1])['distance_km']
+    
+    def test_errors_match_flask_route(self, asgi):
+        """Test validation and geocoding failures"""
+        status, _ = asgi('POST', '/api/calculate-distance', {'source': 'NY', 'destination': 'High St'})
+        assert status == 400
+        
+        status, text = asgi('POST', '/api/calculate-distance', {
+            'source': 'Main St', 'destination': 'Nowhere Special'
+        })
+        assert status == 404
+        assert json.loads(text) == {'error': 'Could not find address: Nowhere Special'}
+    
+    def test_other_routes_served_by_flask(self, asgi):
+        """Test that non-async routes go through the WSGI bridge"""
+        status, text = asgi('GET', '/api/health')
+        assert (status, json.loads(text)) == (200, {'status': 'healthy'})
+        
+        status, text = asgi('POST', '/api/distance-matrix', {
+            'origins': ['Main St'], 'destinations': ['High St', 'Low St'], 'format': 'ndjson'
+        })
+        assert status == 200
+        assert len(text.strip().splitlines()) == 2
+
+
+class TestAppFactory:
+    """Test that services are per app and created on first use"""
+    
+    def test_services_created_on_first_use(self, tmp_path, monkeypatch):
+        """Test that creating the app touches neither the disk nor the network"""
+        monkeypatch.setattr(Config, 'DATABASE_NAME', str(tmp_path / "lazy.db"))
+        monkeypatch.setattr(Config, 'WRITE_BEHIND_ENABLED', False)
+        app = create_app()
+        services = services_module.get_services(app)
+        
+        assert all(services.created(name) is None for name in Services.NAMES)
+        assert not (tmp_path / "lazy.db").exists()
+        
+        assert app.test_client().get('/api/health').status_code == 200
+        assert services.created('db') is None
+        
+        assert app.test_client().get('/api/history').status_code == 200
+        assert services.created('db') is not None
+        assert services.created('geocoder') is None
+        assert (tmp_path / "lazy.db").exists()
+        services.close()
+    
+    def test_stats_requests_create_no_services(self, tmp_path, monkeypatch):
+        """Test that metrics scrapes and cache stats report only services already in use"""
+        monkeypatch.setattr(Config, 'DATABASE_NAME', str(tmp_path / "lazy.db"))
+        app = create_app()
+        services = services_module.get_services(app)
+        client = app.test_client()
+        
+        assert client.get('/api/metrics').status_code == 200
+        assert client.get('/api/cache/stats').get_json() == {}
+        assert all(services.created(name) is None for name in Services.NAMES)
+        
+        services.pair_cache
+        assert sorted(client.get('/api/cache/stats').get_json()) == ['geocode', 'pairs']
+        assert 'cache="pairs"' in client.get('/api/metrics').get_data(as_text=True)
+        assert services.created('geocoder') is None
+        services.close()
+    
+    def test_services_are_per_app(self, tmp_path):
+        """Test that each app gets its own services unless some are passed in"""
+        db = Database(str(tmp_path / "test.db"))
+        services = Services(db=db)
+        
+        assert services_module.get_services(create_app()) is not services_module.get_services(create_app())
+        assert services_module.get_services(create_app(services=services)).db is db
+        with pytest.raises(TypeError):
+            Services(database=db)
+    
+    def test_optional_dependencies_imported_on_use(self):
+        """Test that importing the app does not import NumPy or aiohttp"""
+        code = (
+            "import sys, app; "
+            "print(sorted(m for m in ('numpy', 'aiohttp') if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        )
+        assert result.stdout.strip() == '[]'
+    
+    def test_csv_export_does_not_import_pyarrow(self, tmp_path):
+        """Test that a CSV export request checks for pyarrow without importing it"""
+        pytest.importorskip('pyarrow')
+        code = (
+            "import sys; from config import Config; "
+            f"Config.DATABASE_NAME = {str(tmp_path / 'export.db')!r}; "
+            "from app import create_app; client = create_app().test_client(); "
+            "assert client.get('/api/history/export?format=csv').status_code == 200; "
+            "assert client.get('/api/history/export?format=xml').status_code == 400; "
+            "print('pyarrow' in sys.modules)"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        )
+        assert result.stdout.strip() == 'False'
+
+
+class TestServerConfig:
+    """Test the gunicorn settings and worker lifecycle hooks"""
+
+    CONF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+    class FakeServer:
+        """Stand-in for the gunicorn arbiter passed to hooks"""
+
+        def __init__(self, num_workers):
+            self.num_workers = num_workers
+            self.log = logging.getLogger('gunicorn.test')
+
+    class FakeWorker:
+        pid = 12345
+
+    @pytest.fixture
+    def services(self, tmp_path, monkeypatch):
+        db = Database(str(tmp_path / "test.db"))
+        geocoder = Geocoder(cache=GeocodeCache(db), rate_limiter=RateLimiter(rate=1.0))
+        writer = QueryWriter(db, flush_interval=60)
+        services = Services(db=db, geocoder=geocoder, query_writer=writer)
+        monkeypatch.setattr(services_module, 'instances', lambda: [services])
+        monkeypatch.setattr(Config, 'NOMINATIM_RATE_LIMIT', 1.0)
+        return db, geocoder, writer
+
+    def test_settings_from_config(self, monkeypatch):
+        """Test that the config module follows Config and WEB_CONCURRENCY"""
+        monkeypatch.delenv('WEB_CONCURRENCY', raising=False)
+        settings = runpy.run_path(self.CONF_PATH)
+        assert settings['workers'] == (Config.SERVER_WORKERS or multiprocessing.cpu_count())
+        assert settings['threads'] == Config.SERVER_THREADS
+        assert settings['preload_app'] is Config.SERVER_PRELOAD
+        assert settings['wsgi_app'] == 'app:create_app()'
+
+        monkeypatch.setenv('WEB_CONCURRENCY', '3')
+        monkeypatch.setattr(Config, 'SERVER_WORKER_CLASS', 'uvicorn')
+        settings = runpy.run_path(self.CONF_PATH)
+        assert settings['workers'] == 3
+        assert settings['worker_class'] == 'uvicorn_worker.UvicornWorker'
+        assert settings['wsgi_app'] == 'app:create_asgi_app()'
+
+        monkeypatch.setattr(Config, 'SERVER_WORKER_CLASS', 'eventlet')
+        with pytest.raises(ValueError):
+            runpy.run_path(self.CONF_PATH)
+
+    def test_post_fork_reinitializes_services(self, services):
+        """Test that a forked worker gets fresh connections and its rate share"""
+        db, geocoder, _ = services
+        hooks = runpy.run_path(self.CONF_PATH)
+        inherited_conn = db._thread_connection()
+        inherited_session = geocoder.session
+
+        hooks['pre_fork'](self.FakeServer(4), self.FakeWorker())
+        assert db._connections == {}
+        hooks['post_fork'](self.FakeServer(4), self.FakeWorker())
+
+        assert db._thread_connection() is not inherited_conn
+        assert geocoder.session is not inherited_session
+        assert geocoder.rate_limiter.rate == 0.25
+        assert Config.NOMINATIM_RATE_LIMIT == 0.25
+
+    def test_worker_exit_flushes_history(self, services):
+        """Test that a stopping worker saves its queued queries"""
+        db, _, writer = services
+        hooks = runpy.run_path(self.CONF_PATH)
+        for _ in range(3):
+            writer.submit(("A street", "B street", 1.0, 2.0, 3.0, 4.0, 5.0, 3.1))
+
+        hooks['worker_exit'](self.FakeServer(1), self.FakeWorker())
+
+        assert writer.stats()['written'] == 3
+        assert len(db.get_history(10)) == 3
+
+
+class TestMetrics:
+    """Test the in-process metrics registry and /api/metrics"""
+
+    @pytest.fixture
+    def client(self, tmp_path, monkeypatch):
+        db = Database(str(tmp_path / "test.db"))
+        geocoder = Geocoder(cache=GeocodeCache(db))
+        monkeypatch.setattr(
+            geocoder, '_fetch',
+            lambda address: None if 'nowhere' in address.lower() else {'lat': 48.85, 'lon': 2.35}
+        )
+        services = Services(
+            db=db, geocoder=geocoder, geocode_cache=geocoder.cache, pair_cache=PairCache(geocoder.cache)
+        )
+        monkeypatch.setattr(Config, 'WRITE_BEHIND_ENABLED', False)
+        metrics.registry.clear()
+        yield create_app(services=services).test_client()
+        metrics.registry.clear()
+
+    @staticmethod
+    def sample(text, name):
+        """Value of one sample line in exposition text"""
+        for line in text.splitlines():
+            if line.startswith(f"{name} "):
+                return float(line.rsplit(' ', 1)[1])
+        raise AssertionError(f"{name} not found")
+
+    def test_histogram_exposition(self):
+        """Test cumulative buckets, sum, count and label escaping"""
+        registry = metrics.Registry()
+        histogram = registry.register(metrics.Histogram('op_seconds', 'Op latency', (0.1, 1.0), ('kind',)))
+        child = histogram.labels('a"b')
+        for value in (0.05, 0.5, 0.5, 5.0):
+            child.observe(value)
+
+        text = registry.render()
+
+        assert '# TYPE op_seconds histogram' in text
+        assert 'op_seconds_bucket{kind="a\\"b",le="0.1"} 1' in text
+        assert 'op_seconds_bucket{kind="a\\"b",le="1"} 3' in text
+        assert 'op_seconds_bucket{kind="a\\"b",le="+Inf"} 4' in text
+        assert 'op_seconds_sum{kind="a\\"b"} 6.05' in text
+        assert 'op_seconds_count{kind="a\\"b"} 4' in text
+        with pytest.raises(ValueError):
+            histogram.labels()
+
+    def test_timed_decorator(self, monkeypatch):
+        """Test that calls are timed, errors included, and skipped when disabled"""
+        histogram = metrics.Histogram('call_seconds', 'Call latency', metrics.FAST_BUCKETS)
+
+        @metrics.timed(histogram)
+        def fail():
+            raise ValueError("boom")
+
+        @metrics.timed(histogram)
+        async def wait():
+            await asyncio.sleep(0)
+            return 1
+
+        with pytest.raises(ValueError):
+            fail()
+        assert asyncio.run(wait()) == 1
+        assert histogram.labels().count == 2
+
+        monkeypatch.setattr(metrics.registry, 'enabled', False)
+        assert asyncio.run(wait()) == 1
+        assert histogram.labels().count == 2
+
+    def test_metrics_endpoint(self, client):
+        """Test hot path histograms, error counts and cache ratios after requests"""
+        pair = {'source': 'Paris, France', 'destination': 'Lyon, France'}
+        assert client.post('/api/calculate-distance', json=pair).status_code == 200
+        assert client.post('/api/calculate-distance', json={
+            'source': 'Paris, France', 'destination': 'Nowhere Special'
+        }).status_code == 404
+        assert client.post('/api/calculate-distance', json={
+            'source': 'DROP TABLE queries', 'destination': 'Lyon, France'
+        }).status_code == 400
+
+        response = client.get('/api/metrics')
+        text = response.get_data(as_text=True)
+
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        assert self.sample(text, 'distance_validation_seconds_count') == 3
+        assert self.sample(text, 'distance_geocode_seconds_count{mode="sync"}') == 4
+        assert self.sample(text, 'distance_haversine_seconds_count{mode="scalar"}') == 1
+        assert self.sample(text, 'distance_db_write_seconds_count{operation="save_query"}') == 1
+        assert self.sample(text, 'distance_errors_total{type="GeocodingError"}') == 1
+        assert self.sample(text, 'distance_errors_total{type="ValidationError"}') == 1
+        assert self.sample(
+            text, 'distance_http_request_seconds_count{endpoint="api.calculate_distance"}'
+        ) == 3
+        # Paris was cached by the first request; Lyon and Nowhere were fetched
+        assert self.sample(text, 'distance_cache_hit_ratio{cache="geocode"}') == pytest.approx(0.25)
+
+
+class TestTracing:
+    """Test request spans, the slow request log and the sampling profiler"""
+
+    @pytest.fixture
+    def client(self, tmp_path, monkeypatch):
+        db = Database(str(tmp_path / "test.db"))
+        geocoder = Geocoder(cache=GeocodeCache(db))
+        monkeypatch.setattr(geocoder, '_fetch', lambda address: {'lat': 48.85, 'lon': 2.35})
+        services = Services(
+            db=db, geocoder=geocoder, geocode_cache=geocoder.cache, pair_cache=PairCache(geocoder.cache)
+        )
+        monkeypatch.setattr(routes, 'profiler', tracing.SamplingProfiler(str(tmp_path / "profiles"), 0.0, 2))
+        monkeypatch.setattr(Config, 'WRITE_BEHIND_ENABLED', False)
+        return create_app(services=services).test_client()
+
+    def test_spans_nest_and_skip_untraced_calls(self):
+        """Test span depth, concurrent tasks and no-op calls outside a trace"""
+        calls = []
+
+        @tracing.traced('inner')
+        def inner():
+            calls.append(1)
+
+        @tracing.traced('lookup')
+        async def lookup():
+            await asyncio.sleep(0)
+
+        inner()
+        assert tracing.current_trace() is None
+
+        async def request():
+            trace = tracing.start_trace('GET /test')
+            with tracing.span('outer'):
+                inner()
+            await asyncio.gather(lookup(), lookup())
+            return tracing.finish_trace(trace)
+
+        trace = asyncio.run(request())
+
+        assert calls == [1, 1]
+        assert [(name, depth) for name, depth, _, _ in trace.spans] == [
+            ('inner', 1), ('outer', 0), ('lookup', 0), ('lookup', 0)
+        ]
+        assert trace.duration is not None
+
+    def test_slow_request_logs_breakdown(self, client, monkeypatch, caplog):
+        """Test that a request over the threshold logs its spans"""
+        pair = {'source': 'Paris, France', 'destination': 'Lyon, France'}
+        monkeypatch.setattr(Config, 'TRACE_SLOW_REQUEST_MS', 10000)
+        with caplog.at_level(logging.WARNING, logger='tracing'):
+            client.post('/api/calculate-distance', json=pair)
+        assert 'Slow request' not in caplog.text
+
+        monkeypatch.setattr(Config, 'TRACE_SLOW_REQUEST_MS', 0)
+        with caplog.at_level(logging.WARNING, logger='tracing'):
+            client.post('/api/calculate-distance', json={**pair, 'destination': 'Nice, France'})
+
+        log = caplog.text
+        assert 'Slow request: POST /api/calculate-distance' in log
+        for name in ('validate', 'geocode', 'db.get_geocode', 'haversine', 'db.save_query', 'serialize'):
+            assert f" {name} " in log, name
+
+    def test_sampling_profiler_writes_dumps(self, client, tmp_path):
+        """Test that sampled requests are dumped and old dumps pruned"""
+        routes.profiler.set_sample_rate(1.0)
+        for i in range(3):
+            client.post('/api/calculate-distance', json={
+                'source': f"{i} Rue de Paris", 'destination': 'Lyon, France'
+            })
+
+        dumps = sorted((tmp_path / "profiles").glob("*.prof"))
+        assert len(dumps) == 2
+        assert 'api.calculate_distance' in dumps[0].name
+        stats = pstats.Stats(str(dumps[-1]))
+        assert any(func[2] == 'calculate_distance' for func in stats.stats)
+        assert routes.profiler.stats()['profiled'] == 3
+
+    def test_profiling_control_endpoint(self, client, monkeypatch):
+        """Test that the runtime switch is off by default and validates input"""
+        assert client.put('/api/debug/profiling', json={'sample_rate': 0.5}).status_code == 404
+
+        monkeypatch.setattr(Config, 'PROFILE_CONTROL_ENABLED', True)
+        response = client.put('/api/debug/profiling', json={'sample_rate': 0.5})
+        assert response.status_code == 200
+        assert response.get_json()['sample_rate'] == 0.5
+        assert client.put('/api/debug/profiling', json={'sample_rate': 2}).status_code == 400
+        assert client.put('/api/debug/profiling', json={}).status_code == 400
+        assert client.get('/api/debug/profiling').get_json()['sample_rate'] == 0.5
+
+
+class TestBenchmarkSuite:
+    """Test the load plan and the baseline comparison of the benchmark suite"""
+    
+    @staticmethod
+    def _results(**values):
+        return {'meta': {}, 'metrics': {
+            name: suite._metric(value, 'ms' if name.endswith('latency') else 'ops/s', not name.endswith('latency'))
+            for name, value in values.items()
+        }}
+    
+    def test_plan_is_reproducible(self):
+        """Test that the traffic mix depends only on the seed"""
+        first = load.plan(1000, history_ratio=0.2, hot_ratio=0.5, seed=7)
+        second = load.plan(1000, history_ratio=0.2, hot_ratio=0.5, seed=7)
+        
+        assert [endpoint for endpoint, _ in first] == [endpoint for endpoint, _ in second]
+        assert 150 < sum(endpoint == 'history' for endpoint, _ in first) < 250
+        hot = [payload for endpoint, payload in first if endpoint == 'calculate-distance' and 'Hot' in payload['source']]
+        assert len({payload['source'] for payload in hot}) <= load.HOT_PAIRS
+    
+    def test_compare_detects_regressions(self):
+        """Test direction-aware comparison against a baseline"""
+        baseline = self._results(throughput=1000, latency=10, removed=1)
+        current = self._results(throughput=700, latency=5, added=1)
+        
+        rows = {row['name']: row for row in suite.compare(current, baseline)}
+        
+        assert rows['throughput']['status'] == 'regression'
+        assert rows['throughput']['change'] == pytest.approx(-0.3)
+        assert rows['latency']['status'] == 'improved'
+        assert rows['added']['status'] == 'new'
+        assert rows['removed']['status'] == 'missing'
+    
+    def test_compare_tolerance(self):
+        """Test that per-metric tolerances apply unless overridden"""
+        baseline = self._results(throughput=1000, latency=10)
+        current = self._results(throughput=900, latency=12)
+        current['metrics']['latency']['tolerance'] = 0.5
+        
+        rows = {row['name']: row['status'] for row in suite.compare(current, baseline)}
+        assert rows == {'throughput': 'ok', 'latency': 'ok'}
+        
+        rows = {row['name']: row['status'] for row in suite.compare(current, baseline, tolerance=0.05)}
+        assert rows == {'throughput': 'regression', 'latency': 'regression'}
+
+
+class TestPairCache:
+    """Test the source/destination result cache"""
+    
+    PAYLOAD = {'source': 'A street', 'destination': 'B street', 'distance_km': 1.0}
+    
+    def test_expires_with_geocode_entries(self):
+        """Test that a pair expires with the earlier geocode entry"""
+        geocode_cache = GeocodeCache()
+        pairs = PairCache(geocode_cache)
+        geocode_cache.set("A street", {'lat': 1.0, 'lon': 1.0})
+        geocode_cache.set("B street", {'lat': 2.0, 'lon': 2.0})
+        
+        assert pairs.set("A street", "B street", self.PAYLOAD)
+        assert pairs.get("a  street", "B STREET") == self.PAYLOAD
+        assert pairs.get("B street", "A street") is None
+        
+        geocode_cache.set("Z street", {'lat': 3.0, 'lon': 3.0}).expires_at = 0
+        assert pairs.set("A street", "Z street", self.PAYLOAD)
+        assert pairs.get("A street", "Z street") is None
+        assert pairs.stats()['expirations'] == 1
+    
+    def test_invalidated_with_geocode_entries(self):
+        """Test that invalidating an address drops its pairs"""
+        geocode_cache = GeocodeCache()
+        pairs = PairCache(geocode_cache)
+        geocode_cache.set("A street", {'lat': 1.0, 'lon': 1.0})
+        geocode_cache.set("B street", {'lat': 2.0, 'lon': 2.0})
+        pairs.set("A street", "B street", self.PAYLOAD)
+        
+        geocode_cache.invalidate("B street")
+        assert pairs.get("A street", "B street") is None
+        assert pairs.stats()['invalidations'] == 1
+    
+    def test_requires_cached_geocodes(self):
+        """Test that pairs are only cached while both geocodes are cached"""
+        pairs = PairCache(GeocodeCache())
+        assert not pairs.set("A street", "B street", self.PAYLOAD)
+
+
+class TestFuzzyAddressIndex:
+    """Test near-duplicate address matching"""
+
+    NYC = {'lat': 40.7128, 'lon': -74.0060}
+
+    @pytest.fixture
+    def index(self):
+        geocode_cache = GeocodeCache()
+        geocode_cache.set("New York, NY", self.NYC)
+        geocode_cache.set("1600 Amphitheatre Parkway, Mountain View, CA", {'lat': 37.42, 'lon': -122.08})
+        index = FuzzyAddressIndex(geocode_cache, threshold=0.8)
+        index.add("New York, NY")
+        index.add("1600 Amphitheatre Parkway, Mountain View, CA")
+        return index
+
+    def test_canonical_address(self):
+        """Test that punctuation and case variants share a canonical form"""
+        variants = ["New York, NY", "new york ny", "New York,NY ", "NEW-YORK NY."]
+        assert {canonical_address(variant) for variant in variants} == {"new york ny"}
+
+    def test_matches_near_duplicates(self, index):
+        """Test exact canonical and similar spellings resolve to the cached geocode"""
+        assert index.lookup("new york ny") == self.NYC
+        assert index.lookup("New York,  NY.") == self.NYC
+        assert index.lookup("1600 Amphitheatre Parkway Mountain View CA USA") == {'lat': 37.42, 'lon': -122.08}
+        assert index.lookup("New Haven, CT") is None
+        assert index.lookup("1601 Amphitheatre Parkway, Mountain View, CA") is None
+
+        stats = index.stats()
+        assert stats['exact_hits'] == 2
+        assert stats['fuzzy_hits'] == 1
+        assert stats['misses'] == 2
+
+    def test_follows_geocode_cache(self, index):
+        """Test that invalidated or expired geocodes are no longer matched"""
+        index.geocode_cache.invalidate("New York, NY")
+        assert index.lookup("new york ny") is None
+        assert index.stats()['size'] == 1
+
+        index.geocode_cache.set("Boston, MA", {'lat': 42.36, 'lon': -71.06}).expires_at = 0
+        index.add("Boston, MA")
+        assert index.lookup("boston ma") is None
+        assert index.stats()['size'] == 1
+
+    def test_geocoder_skips_remote_on_fuzzy_hit(self, monkeypatch):
+        """Test that a near-duplicate of a fetched address avoids Nominatim"""
+        calls = []
+        geocode_cache = GeocodeCache()
+        geocoder = Geocoder(cache=geocode_cache, fuzzy_index=FuzzyAddressIndex(geocode_cache))
+        monkeypatch.setattr(geocoder, '_fetch', lambda address: calls.append(address) or self.NYC)
+
+        assert geocoder.geocode("New York, NY") == self.NYC
+        assert geocoder.geocode("new york ny") == self.NYC
+        assert geocoder.geocode("NEW YORK,NY ") == self.NYC
+        assert calls == ["New York, NY"]
+
+
+class TestBulkImport:
+    """Test the streaming bulk import job and its checkpoints"""
+    
+    PAIRS = 250
+    
+    @pytest.fixture
+    def job(self, tmp_path, monkeypatch):
+        db = Database(str(tmp_path / "test.db"))
+        geocoder = Geocoder(cache=GeocodeCache(db))
+        calls = []
+        monkeypatch.setattr(
+            geocoder, '_fetch',
+            lambda address: calls.append(address) or (
+                None if 'nowhere' in address.lower() else dict(zip(('lat', 'lon'), fake_coordinates(address)))
+            )
+        )
+        source = tmp_path / "pairs.csv"
+        with open(source, 'w', newline='', encoding='utf-8') as f:
+            f.write('id,source,destination\n')
+            for i in range(self.PAIRS):
+                f.write(f'{i},{i % 40} Main Street,"{i % 60} High\nStreet"\n')
+            f.write('x,NY,High Street\n')
+            f.write('y,Main Street,Nowhere Road\n')
+        
+        def run(output="out.csv", **kwargs):
+            kwargs.setdefault('chunk_size', 50)
+            return bulk.run_import(str(source), str(tmp_path / output), Services(db=db, geocoder=geocoder), **kwargs)
+        
+        run.db = db
+        run.calls = calls
+        run.tmp_path = tmp_path
+        return run
+    
+    @staticmethod
+    def _read(path):
+        with open(path, newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+    
+    def test_import_to_file_and_database(self, job):
+        """Test results, per-row errors, address deduplication and saved rows"""
+        stats = job(save_to_db=True)
+        rows = self._read(job.tmp_path / "out.csv")
+        
+        assert stats == {'rows': self.PAIRS + 2, 'succeeded': self.PAIRS, 'failed': 2, 'saved': self.PAIRS}
+        assert rows[3]['destination'] == '3 High\nStreet'
+        expected = DistanceCalculator.calculate_distance_between_addresses(
+            dict(zip(('lat', 'lon'), fake_coordinates('3 Main Street'))),
+            dict(zip(('lat', 'lon'), fake_coordinates('3 High\nStreet')))
+        )
+        assert float(rows[3]['distance_km']) == expected['km']
+        assert rows[-2]['error'] == 'Source must be at least 3 characters long'
+        assert rows[-1]['error'] == 'Could not find address: Nowhere Road'
+        assert len(job.calls) == 40 + 60 + 2
+        assert len(job.db.get_history(100)) == 100
+        assert not (job.tmp_path / "out.csv.checkpoint").exists()
+    
+    def test_resume_after_crash(self, job, monkeypatch):
+        """Test that a resumed job matches an uninterrupted one, without duplicates"""
+        job(output="expected.ndjson")
+        expected = (job.tmp_path / "expected.ndjson").read_text()
+        
+        # Crash after the database commit of the third chunk, before its checkpoint
+        write_checkpoint = bulk._write_checkpoint
+        written = []
+        
+        def crash(path, state):
+            if len(written) == 2:
+                raise KeyboardInterrupt
+            written.append(state['rows_done'])
+            write_checkpoint(path, state)
+        
+        monkeypatch.setattr(bulk, '_write_checkpoint', crash)
+        with pytest.raises(KeyboardInterrupt):
+            job(output="out.ndjson", save_to_db=True)
+        monkeypatch.setattr(bulk, '_write_checkpoint', write_checkpoint)
+        
+        with pytest.raises(bulk.BulkImportError):
+            job(output="out.ndjson", save_to_db=True)
+        stats = job(output="out.ndjson", save_to_db=True, resume=True)
+        
+        assert (job.tmp_path / "out.ndjson").read_text() == expected
+        assert stats['rows'] == self.PAIRS + 2
+        with job.db.get_connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM queries').fetchone()[0] == self.PAIRS
+    
+    def test_resume_rejects_changed_input(self, job, monkeypatch):
+        """Test that a checkpoint is only used for the same input file"""
+        process_chunk = bulk.process_chunk
+        chunks = []
+        
+        def crash(*args):
+            if chunks:
+                raise KeyboardInterrupt
+            chunks.append(args)
+            return process_chunk(*args)
+        
+        monkeypatch.setattr(bulk, 'process_chunk', crash)
+        with pytest.raises(KeyboardInterrupt):
+            job()
+        monkeypatch.setattr(bulk, 'process_chunk', process_chunk)
+        with open(job.tmp_path / "pairs.csv", 'a', encoding='utf-8') as f:
+            f.write('z,Main Street,High Street\n')
+        
+        with pytest.raises(bulk.BulkImportError, match='input_size'):
+            job(resume=True)
+
+
+class TestGazetteer:
+    """Test the offline gazetteer backend"""
+
+    ROWS = [
+        # geonameid, name, asciiname, alternatenames, lat, lon, ..., population
+        (1, "Paris", "Paris", 48.8566, 2.3522, 2138551),
+        (2, "Paris", "Paris", 33.6609, -95.5555, 24171),
+        (3, "Parma", "Parma", 44.8015, 10.3279, 146299),
+        (4, "München", "Munchen", 48.1374, 11.5755, 1260391),
+        (5, "Tokyo", "Tokyo", 35.6895, 139.6917, 8336599),
+    ]
+
+    @staticmethod
+    def write_source(path, rows):
+        with open(path, 'w', encoding='utf-8') as f:
+            for geonameid, name, asciiname, lat, lon, population in rows:
+                fields = [str(geonameid), name, asciiname, '', str(lat), str(lon)] + [''] * 8
+                fields += [str(population), '', '', 'Europe/Paris', '2024-01-01']
+                f.write('\t'.join(fields) + '\n')
+        return str(path)
+    
+    @pytest.fixture
+    def source(self, tmp_path):
+        return self.write_source(tmp_path / "cities.tsv", self.ROWS)
+
+    def test_exact_and_prefix_lookup(self, source, tmp_path):
+        """Test lookups against an index built in small sorted runs"""
+        index_path = str(tmp_path / "cities.idx")
+        assert Gazetteer.build(source, index_path, chunk_rows=2) == 5
+
+        gazetteer = Gazetteer(index_path)
+        assert len(gazetteer) == 5
+        assert gazetteer.exact("  PARIS ") == {'lat': 48.8566, 'lon': 2.3522}
+        assert gazetteer.exact("munchen") == gazetteer.exact("München")
+        assert gazetteer.exact("Pari") is None
+        assert [place['name'] for place in gazetteer.prefix("par")] == ['paris', 'parma']
+        assert gazetteer.prefix("par", limit=1)[0]['lat'] == 48.8566
+        assert gazetteer.prefix("zzz") == []
+        gazetteer.close()
+
+    def test_open_builds_index_from_csv(self, tmp_path):
+        """Test that opening a source file builds and reuses an index"""
+        path = tmp_path / "places.csv"
+        path.write_text("name,latitude,longitude\nOslo,59.9139,10.7522\nBad,x,1\n", encoding='utf-8')
+
+        gazetteer = Gazetteer.open(str(path))
+        assert gazetteer.path == f"{path}.idx"
+        assert gazetteer.exact("oslo") == {'lat': 59.9139, 'lon': 10.7522}
+        assert len(gazetteer) == 1
+        gazetteer.close()
+
+        with pytest.raises(GazetteerError):
+            Gazetteer(str(path))
+
+    def test_locality_and_ambiguous_names(self, tmp_path):
+        """Test the locality fallback for full addresses and that ambiguous names miss"""
+        source = self.write_source(tmp_path / "cities.tsv", self.ROWS + [
+            (6, "Springfield", "Springfield", 39.8017, -89.6437, 114394),
+            (7, "Springfield", "Springfield", 37.2153, -93.2982, 169176),
+            (8, "Texas", "Texas", 31.2504, -99.2506, 29145505),
+        ])
+        gazetteer = Gazetteer.open(source)
+        
+        assert gazetteer.lookup("Paris, France") == {'lat': 48.8566, 'lon': 2.3522}
+        assert gazetteer.lookup("Tokyo, Japan") == gazetteer.exact("Tokyo")
+        assert gazetteer.lookup("Paris, Texas") is None
+        assert gazetteer.lookup("Pari, France") is None
+        
+        assert not gazetteer.ambiguous("Paris")
+        assert gazetteer.ambiguous("Springfield")
+        assert gazetteer.exact("Springfield") == {'lat': 37.2153, 'lon': -93.2982}
+        assert gazetteer.lookup("Springfield") is None
+        assert gazetteer.lookup("Springfield, Illinois") is None
+        gazetteer.close()
+    
+    def test_index_is_little_endian(self, source, tmp_path):
+        """Test that the index is written little-endian and built through a temporary file"""
+        index_path = str(tmp_path / "cities.idx")
+        Gazetteer.build(source, index_path)
+        
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        _, count, _ = struct.unpack_from('<8sQQ', data)
+        lats = struct.unpack_from(f'<{count}d', data, 24 + (count + 1) * 8)
+        assert 48.8566 in lats
+        assert sorted(os.listdir(tmp_path)) == ["cities.idx", "cities.tsv"]
+    
+    def test_truncated_index_rejected(self, source, tmp_path):
+        """Test that a truncated index fails to open instead of failing in a lookup"""
+        index_path = f"{source}.idx"
+        Gazetteer.build(source, index_path)
+        with open(index_path, 'r+b') as f:
+            f.truncate(os.path.getsize(index_path) - 3)
+        
+        with pytest.raises(GazetteerError, match="truncated"):
+            Gazetteer(index_path)
+        
+        gazetteer = Gazetteer.open(source)
+        assert gazetteer.exact("Tokyo") == {'lat': 35.6895, 'lon': 139.6917}
+        gazetteer.close()
+    
+    def test_geocoder_tries_local_backend_first(self, source, monkeypatch):
+        """Test that local hits skip Nominatim and misses fall back to it"""
+        remote = []
+        gazetteer = Gazetteer.open(source)
+        geocoder = Geocoder(cache=GeocodeCache(), backends=[gazetteer])
+        monkeypatch.setattr(
+            geocoder, '_fetch',
+            lambda address: remote.append(address) or {'lat': 1.0, 'lon': 2.0}
+        )
+
+        assert geocoder.geocode("Tokyo") == {'lat': 35.6895, 'lon': 139.6917}
+        assert geocoder.geocode("Kyoto, Japan") == {'lat': 1.0, 'lon': 2.0}
+        assert geocoder.batch_geocode(["Parma", "Kyoto, Japan"])["Parma"]['lat'] == 44.8015
+        assert remote == ["Kyoto, Japan"]
+        assert geocoder.connection_stats()['local_hits'] == 2
+
+        geocoder.remote_enabled = False
+        with pytest.raises(GeocodingError):
+            geocoder.geocode("Atlantis")
+        geocoder.close()
 
 
 class TestGeocoder:
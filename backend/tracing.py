@@ -0,0 +1,256 @@
+import os
+import time
+import random
+import inspect
+import cProfile
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """
+    Spans recorded while serving one request
+
+    A span is (name, depth, start offset, duration) in seconds relative to
+    the start of the request. Spans from concurrent tasks of the same
+    request (asyncio.gather, asyncio.to_thread) land in the same trace.
+    """
+
+    __slots__ = ('name', 'start', 'duration', 'spans', 'dropped')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.dropped = 0
+
+    def add(self, name: str, depth: int, start: float, duration: float):
+        if len(self.spans) < Config.TRACE_MAX_SPANS:
+            self.spans.append((name, depth, start - self.start, duration))
+        else:
+            self.dropped += 1
+
+    def breakdown(self) -> str:
+        """Render the spans as an indented timeline, one line per span"""
+        lines = [f"{self.name} {self.duration * 1000:.1f} ms"]
+        for name, depth, offset, duration in sorted(self.spans, key=lambda span: span[2]):
+            indent = '  ' * (depth + 1)
+            lines.append(f"{indent}{name} {duration * 1000:.2f} ms (at +{offset * 1000:.1f} ms)")
+        if self.dropped:
+            lines.append(f"  ... {self.dropped} more spans")
+        return '\n'.join(lines)
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+_depth: ContextVar[int] = ContextVar('trace_depth', default=0)
+
+
+def start_trace(name: str) -> Optional[Trace]:
+    """
+    Start tracing the current request
+
+    Args:
+        name: Request label used in the slow request log
+
+    Returns:
+        The new Trace, or None when tracing is disabled
+    """
+    if not Config.TRACE_ENABLED:
+        return None
+    trace = Trace(name)
+    _trace.set(trace)
+    _depth.set(0)
+    return trace
+
+
+def finish_trace(trace: Optional[Trace]) -> Optional[Trace]:
+    """
+    Stop tracing and log the span breakdown if the request was slow
+
+    Args:
+        trace: Value returned by start_trace
+
+    Returns:
+        The finished Trace, or None if there was none
+    """
+    if trace is None:
+        return None
+    if _trace.get() is trace:
+        _trace.set(None)
+
+    trace.duration = time.perf_counter() - trace.start
+    if trace.duration * 1000 >= Config.TRACE_SLOW_REQUEST_MS:
+        logger.warning(f"Slow request: {trace.breakdown()}")
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """Record the with block as a span of the current trace (no-op outside one)"""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, depth, start, time.perf_counter() - start)
+        _depth.reset(token)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator recording each call as a span of the current trace
+
+    Calls outside a traced request go straight through. Coroutine
+    functions are recorded until they return.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _trace.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            depth = _depth.get()
+            token = _depth.set(depth + 1)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.add(name, depth, start, time.perf_counter() - start)
+                _depth.reset(token)
+        return wrapper
+    return decorator
+
+
+class SamplingProfiler:
+    """
+    Profiles a sample of requests with cProfile and writes the stats to disk
+
+    Off unless sample_rate is above zero; the rate can be changed at
+    runtime. One request is profiled at a time per process (cProfile on
+    Python 3.12+ is process-wide), so concurrent sampled requests are
+    skipped rather than queued. Dumps are pstats files named after the
+    request, e.g. `20240210-143000-123456-api.calculate_distance-812ms.prof`,
+    and only the newest max_files are kept.
+    """
+
+    def __init__(self, directory: str = "", sample_rate: float = None, max_files: int = 0):
+        self.directory = directory or Config.PROFILE_DIR
+        self.sample_rate = Config.PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.max_files = max_files or Config.PROFILE_MAX_FILES
+        self._busy = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'profiled': 0, 'skipped_busy': 0}
+
+    def set_sample_rate(self, sample_rate: float):
+        """
+        Change the fraction of requests profiled
+
+        Raises:
+            ValueError: If sample_rate is not between 0 and 1
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.sample_rate = sample_rate
+        logger.info(f"Profiling sample rate set to {sample_rate}")
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """
+        Maybe start profiling the current request
+
+        Returns:
+            Running profiler to pass to stop(), or None if not sampled
+        """
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            self._count('skipped_busy')
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already active
+            self._busy.release()
+            self._count('skipped_busy')
+            return None
+        return profiler
+
+    def stop(self, profiler: Optional[cProfile.Profile], name: str, duration: float) -> Optional[str]:
+        """
+        Stop a profiler returned by start() and write its stats
+
+        Args:
+            profiler: Value returned by start()
+            name: Request label for the file name
+            duration: Request duration in seconds
+
+        Returns:
+            Path of the dump, or None
+        """
+        if profiler is None:
+            return None
+        try:
+            profiler.disable()
+        finally:
+            self._busy.release()
+
+        safe_name = ''.join(c if c.isalnum() or c in '._-' else '_' for c in name)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        filename = f"{stamp}-{time.time_ns() // 1000 % 1000000:06d}-{safe_name}-{duration * 1000:.0f}ms.prof"
+        path = os.path.join(self.directory, filename)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(path)
+            self._prune()
+        except OSError as e:
+            logger.error(f"Failed to write profile {path}: {str(e)}")
+            return None
+
+        self._count('profiled')
+        logger.info(f"Wrote profile {path}")
+        return path
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['sample_rate'] = self.sample_rate
+        stats['directory'] = self.directory
+        return stats
+
+    def _prune(self):
+        """Delete the oldest dumps beyond max_files"""
+        dumps = sorted(name for name in os.listdir(self.directory) if name.endswith('.prof'))
+        for name in dumps[:-self.max_files]:
+            os.remove(os.path.join(self.directory, name))
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+
+profiler = SamplingProfiler()
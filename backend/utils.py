@@ -1,10 +1,30 @@
-from math import radians, cos, sin, asin, sqrt
+from array import array
+from math import radians, degrees, cos, sin, asin, sqrt, nan
 import logging
+import sys
+from typing import Iterator, List, Optional, Tuple
 
 from config import Config
+from metrics import HAVERSINE_SECONDS, timed
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
+# NumPy is optional and slow to import, so it is loaded on first batch call
+_np = False
+
+
+def _numpy():
+    """The numpy module, imported on first use, or None if it is not installed"""
+    global _np
+    if _np is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _np = numpy
+    return _np
+
 
 class DistanceCalculator:
     """Calculator for geographic distances"""
@@ -35,10 +55,235 @@ class DistanceCalculator:
         # Distance in kilometers
         distance = c * Config.EARTH_RADIUS_KM
         
-        logger.debug(f"Calculated distance: {distance:.2f} km between ({lat1}, {lon1}) and ({lat2}, {lon2})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Calculated distance: {distance:.2f} km between ({lat1}, {lon1}) and ({lat2}, {lon2})")
         
         return distance
     
+    @staticmethod
+    @traced('haversine_batch')
+    @timed(HAVERSINE_SECONDS.labels('batch'))
+    def haversine_distances(src_lats, src_lons, dst_lats, dst_lons) -> Tuple:
+        """
+        Calculate great circle distances for many coordinate pairs in one pass
+        
+        Inputs may be NumPy arrays, array.array/memoryview buffers of doubles
+        or plain sequences, all of the same length. NumPy is used when
+        installed, otherwise a pure Python loop is used.
+        
+        Args:
+            src_lats: Source latitudes (decimal degrees)
+            src_lons: Source longitudes (decimal degrees)
+            dst_lats: Destination latitudes (decimal degrees)
+            dst_lons: Destination longitudes (decimal degrees)
+            
+        Returns:
+            Tuple of (km, miles) as NumPy arrays, or array.array('d') without NumPy
+        """
+        if _numpy() is not None:
+            return DistanceCalculator._haversine_numpy(src_lats, src_lons, dst_lats, dst_lons)
+        return DistanceCalculator._haversine_python(src_lats, src_lons, dst_lats, dst_lons)
+    
+    @staticmethod
+    def _haversine_numpy(src_lats, src_lons, dst_lats, dst_lons) -> Tuple:
+        np = _numpy()
+        lat1 = np.radians(np.asarray(src_lats, dtype=np.float64))
+        lon1 = np.radians(np.asarray(src_lons, dtype=np.float64))
+        lat2 = np.radians(np.asarray(dst_lats, dtype=np.float64))
+        lon2 = np.radians(np.asarray(dst_lons, dtype=np.float64))
+        # Broadcasting would pair a length-1 array with every other coordinate
+        if not (lat1.shape == lon1.shape == lat2.shape == lon2.shape):
+            raise ValueError("Coordinate sequences must have the same length")
+        
+        a = np.sin((lat2 - lat1) * 0.5)
+        a *= a
+        b = np.sin((lon2 - lon1) * 0.5)
+        b *= b
+        b *= np.cos(lat1)
+        b *= np.cos(lat2)
+        a += b
+        np.minimum(a, 1.0, out=a)
+        
+        km = np.sqrt(a, out=a)
+        km = np.arcsin(km, out=km)
+        km *= 2 * Config.EARTH_RADIUS_KM
+        
+        return km, km * Config.KM_TO_MILES_FACTOR
+    
+    @staticmethod
+    def _haversine_python(src_lats, src_lons, dst_lats, dst_lons) -> Tuple:
+        if not (len(src_lats) == len(src_lons) == len(dst_lats) == len(dst_lons)):
+            raise ValueError("Coordinate sequences must have the same length")
+        
+        diameter = 2 * Config.EARTH_RADIUS_KM
+        factor = Config.KM_TO_MILES_FACTOR
+        km = array('d')
+        
+        for lat1, lon1, lat2, lon2 in zip(src_lats, src_lons, dst_lats, dst_lons):
+            lat1 = radians(lat1)
+            lat2 = radians(lat2)
+            a = sin((lat2 - lat1) * 0.5) ** 2 + cos(lat1) * cos(lat2) * sin(radians(lon2 - lon1) * 0.5) ** 2
+            km.append(diameter * asin(sqrt(a)))
+        
+        return km, array('d', [d * factor for d in km])
+    
+    @staticmethod
+    def distance_matrix(origins: List[Optional[dict]], destinations: List[Optional[dict]]):
+        """
+        Calculate the full origin x destination distance matrix
+        
+        Args:
+            origins: Origin coordinates (dicts with 'lat' and 'lon', or None)
+            destinations: Destination coordinates (dicts with 'lat' and 'lon', or None)
+            
+        Returns:
+            Matrix in kilometers as a 2D NumPy array, or a list of array.array('d')
+            rows without NumPy. Cells involving a None coordinate are NaN.
+        """
+        chunks = [block for _, block in DistanceCalculator.iter_distance_matrix(origins, destinations)]
+        np = _numpy()
+        if np is not None:
+            return np.vstack(chunks) if chunks else np.empty((0, len(destinations)))
+        return [row for block in chunks for row in block]
+    
+    @staticmethod
+    def iter_distance_matrix(
+        origins: List[Optional[dict]],
+        destinations: List[Optional[dict]],
+        chunk_rows: int = 0
+    ) -> Iterator[Tuple[int, object]]:
+        """
+        Calculate the distance matrix in blocks of rows
+        
+        Each block is computed with broadcasting (one origin column against all
+        destinations), so large matrices never have to be held in memory at once.
+        
+        Args:
+            origins: Origin coordinates (dicts with 'lat' and 'lon', or None)
+            destinations: Destination coordinates (dicts with 'lat' and 'lon', or None)
+            chunk_rows: Number of origin rows per block
+            
+        Yields:
+            Tuples of (first_row_index, block) where block is a 2D NumPy array,
+            or a list of array.array('d') rows without NumPy
+        """
+        chunk_rows = chunk_rows or Config.MATRIX_CHUNK_ROWS
+        src_lats, src_lons = DistanceCalculator._split_coordinates(origins)
+        dst_lats, dst_lons = DistanceCalculator._split_coordinates(destinations)
+        diameter = 2 * Config.EARTH_RADIUS_KM
+        
+        np = _numpy()
+        if np is not None:
+            src_lats = np.radians(np.asarray(src_lats, dtype=np.float64))[:, None]
+            src_lons = np.radians(np.asarray(src_lons, dtype=np.float64))[:, None]
+            dst_lats = np.radians(np.asarray(dst_lats, dtype=np.float64))[None, :]
+            dst_lons = np.radians(np.asarray(dst_lons, dtype=np.float64))[None, :]
+            src_cos = np.cos(src_lats)
+            dst_cos = np.cos(dst_lats)
+            
+            for start in range(0, len(origins), chunk_rows):
+                end = start + chunk_rows
+                a = np.sin((dst_lats - src_lats[start:end]) * 0.5)
+                a *= a
+                b = np.sin((dst_lons - src_lons[start:end]) * 0.5)
+                b *= b
+                b *= src_cos[start:end]
+                b *= dst_cos
+                a += b
+                np.minimum(a, 1.0, out=a)
+                km = np.arcsin(np.sqrt(a, out=a), out=a)
+                km *= diameter
+                yield start, km
+            return
+        
+        dst_lats = [radians(lat) for lat in dst_lats]
+        dst_lons = [radians(lon) for lon in dst_lons]
+        dst_cos = [cos(lat) for lat in dst_lats]
+        
+        for start in range(0, len(origins), chunk_rows):
+            block = []
+            for lat1, lon1 in zip(src_lats[start:start + chunk_rows], src_lons[start:start + chunk_rows]):
+                row = array('d')
+                if lat1 != lat1:
+                    row.extend([nan] * len(dst_lats))
+                else:
+                    lat1 = radians(lat1)
+                    lon1 = radians(lon1)
+                    cos1 = cos(lat1)
+                    for lat2, lon2, cos2 in zip(dst_lats, dst_lons, dst_cos):
+                        if lat2 != lat2:
+                            row.append(nan)
+                            continue
+                        a = sin((lat2 - lat1) * 0.5) ** 2 + cos1 * cos2 * sin((lon2 - lon1) * 0.5) ** 2
+                        row.append(diameter * asin(sqrt(min(a, 1.0))))
+                block.append(row)
+            yield start, block
+    
+    @staticmethod
+    def to_float32_bytes(block, factor: float = 1.0) -> bytes:
+        """
+        Encode a matrix block as row-major little-endian float32
+        
+        Args:
+            block: Block yielded by iter_distance_matrix
+            factor: Multiplier applied to every cell (e.g. km to miles)
+            
+        Returns:
+            Encoded bytes
+        """
+        np = _numpy()
+        if np is not None:
+            return (np.asarray(block) * factor).astype('<f4').tobytes()
+        
+        cells = array('f', (km * factor for row in block for km in row))
+        if sys.byteorder != 'little':
+            cells.byteswap()
+        return cells.tobytes()
+    
+    @staticmethod
+    def _split_coordinates(coords: List[Optional[dict]]) -> Tuple[array, array]:
+        lats = array('d', (c['lat'] if c is not None else nan for c in coords))
+        lons = array('d', (c['lon'] if c is not None else nan for c in coords))
+        return lats, lons
+    
+    @staticmethod
+    def bounding_boxes(lat: float, lon: float, radius_km: float) -> List[Tuple[float, float, float, float]]:
+        """
+        Bounding boxes covering every point within radius_km of (lat, lon)
+        
+        Boxes that cross the antimeridian are split in two; boxes that reach
+        a pole span all longitudes.
+        
+        Args:
+            lat: Latitude of the centre (decimal degrees)
+            lon: Longitude of the centre (decimal degrees)
+            radius_km: Radius in kilometers
+            
+        Returns:
+            List of (min_lat, max_lat, min_lon, max_lon) tuples
+        """
+        angular = radius_km / Config.EARTH_RADIUS_KM
+        dlat = degrees(angular)
+        min_lat = lat - dlat
+        max_lat = lat + dlat
+        
+        if min_lat <= -90 or max_lat >= 90:
+            return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+        
+        ratio = sin(angular) / cos(radians(lat))
+        if ratio >= 1:
+            return [(min_lat, max_lat, -180.0, 180.0)]
+        
+        dlon = degrees(asin(ratio))
+        min_lon = lon - dlon
+        max_lon = lon + dlon
+        
+        if min_lon < -180:
+            return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+        if max_lon > 180:
+            return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+        return [(min_lat, max_lat, min_lon, max_lon)]
+    
     @staticmethod
     def km_to_miles(km: float) -> float:
         """
@@ -66,6 +311,8 @@ class DistanceCalculator:
         return miles / Config.KM_TO_MILES_FACTOR
     
     @staticmethod
+    @traced('haversine')
+    @timed(HAVERSINE_SECONDS.labels('scalar'))
     def calculate_distance_between_addresses(
         source_coords: dict,
         dest_coords: dict
@@ -99,6 +346,7 @@ class ResponseFormatter:
     """Formatter for API responses"""
     
     @staticmethod
+    @traced('format')
     def format_distance_response(
         source: str,
         destination: str,
@@ -159,17 +407,73 @@ class ResponseFormatter:
         return data, status_code
     
     @staticmethod
-    def format_history_response(queries: list) -> dict:
+    @traced('format')
+    def format_batch_response(results: list) -> dict:
         """
-        Format a history response
+        Format a batch distance response
         
         Args:
-            queries: List of query dictionaries
+            results: Per-pair result dictionaries, failures carry an 'error' key
             
         Returns:
             Formatted response dictionary
         """
+        failed = sum(1 for result in results if 'error' in result)
+        return {
+            'results': results,
+            'count': len(results),
+            'succeeded': len(results) - failed,
+            'failed': failed
+        }
+    
+    @staticmethod
+    @traced('format')
+    def format_matrix_response(
+        origins: list,
+        destinations: list,
+        unit: str,
+        distances: list,
+        errors: list
+    ) -> dict:
+        """
+        Format a distance matrix response
+        
+        Args:
+            origins: Origin addresses (rows)
+            destinations: Destination addresses (columns)
+            unit: Distance unit ('km' or 'miles')
+            distances: Matrix rows, None where an address was not found
+            errors: Addresses that could not be geocoded
+            
+        Returns:
+            Formatted response dictionary
+        """
+        return {
+            'origins': origins,
+            'destinations': destinations,
+            'unit': unit,
+            'distances': distances,
+            'errors': errors
+        }
+    
+    @staticmethod
+    @traced('format')
+    def format_history_response(queries: list, limit: int = None) -> dict:
+        """
+        Format a history response
+        
+        Args:
+            queries: List of QueryRecords, newest first
+            limit: Page size the queries were fetched with
+            
+        Returns:
+            Formatted response dictionary with keyset cursors for the
+            next (older) and previous (newer) pages; the records are kept
+            as they are and encoded by the JSON provider's fast path
+        """
         return {
             'queries': queries,
-            'count': len(queries)
+            'count': len(queries),
+            'next_before_id': queries[-1].id if queries and len(queries) == limit else None,
+            'prev_after_id': queries[0].id if queries else None
         }
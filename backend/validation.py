@@ -1,8 +1,11 @@
 import re
 import logging
-from typing import Tuple
+from datetime import datetime
+from typing import List, Optional, Tuple
 
 from config import Config
+from metrics import VALIDATION_SECONDS, timed
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +27,19 @@ class Validator:
         r"('\s*OR\s*'.*=)",
     ]
     
+    # Single-pass equivalent of SQL_INJECTION_PATTERNS: keywords share one
+    # word-boundary alternation, ";.*--" is implied by "--", and "[^=\n]*="
+    # stops at the first "=" instead of backtracking from the end of the
+    # line like ".*=" does. "'\s*OR\s*'.*=" keeps its own branch because
+    # \s also matches newlines around the OR, which "OR.*=" does not cover
+    SQL_INJECTION_RE = re.compile(
+        r"\b(?:(?:SELECT|INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|EXECUTE|EXEC|UNION)\b"
+        r"|(?:OR|AND)\b[^=\n]*=)"
+        r"|'\s*OR\s*'[^=\n]*="
+        r"|--|/\*|\*/",
+        re.IGNORECASE
+    )
+    
     @staticmethod
     def validate_address(address: str, field_name: str = "Address") -> str:
         """
@@ -54,10 +70,9 @@ class Validator:
                 f"{field_name} must not exceed {Config.MAX_ADDRESS_LENGTH} characters"
             )
         
-        for pattern in Validator.SQL_INJECTION_PATTERNS:
-            if re.search(pattern, address, re.IGNORECASE):
-                logger.warning(f"Potential SQL injection attempt detected in {field_name}: {address}")
-                raise ValidationError(f"{field_name} contains invalid characters")
+        if Validator.SQL_INJECTION_RE.search(address):
+            logger.warning(f"Potential SQL injection attempt detected in {field_name}: {address}")
+            raise ValidationError(f"{field_name} contains invalid characters")
 
         if '\x00' in address:
             raise ValidationError(f"{field_name} contains invalid characters")
@@ -65,6 +80,31 @@ class Validator:
         return address
     
     @staticmethod
+    @traced('validate')
+    @timed(VALIDATION_SECONDS)
+    def validate_many(addresses: List[str], field_name: str = "Address") -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Validate many addresses, collecting errors instead of raising
+        
+        Args:
+            addresses: Address strings to validate
+            field_name: Name of the field for error messages
+            
+        Returns:
+            List of (cleaned_address, None) or (None, error_message) tuples,
+            in input order
+        """
+        results = []
+        for address in addresses:
+            try:
+                results.append((Validator.validate_address(address, field_name), None))
+            except ValidationError as e:
+                results.append((None, str(e)))
+        return results
+    
+    @staticmethod
+    @traced('validate')
+    @timed(VALIDATION_SECONDS)
     def validate_addresses(source: str, destination: str) -> Tuple[str, str]:
         """
         Validate both source and destination addresses
@@ -110,6 +150,115 @@ class Validator:
         
         return min(limit, Config.MAX_HISTORY_LIMIT)
     
+    @staticmethod
+    def validate_cursor(value, name: str = "Cursor") -> Optional[int]:
+        """
+        Validate a keyset pagination cursor (a query ID)
+        
+        Args:
+            value: Raw parameter value, or None if absent
+            name: Parameter name for error messages
+            
+        Returns:
+            Cursor as an int, or None if absent
+            
+        Raises:
+            ValidationError: If the cursor is not a non-negative integer
+        """
+        if value is None or value == '':
+            return None
+        
+        try:
+            cursor = int(value)
+        except (ValueError, TypeError):
+            raise ValidationError(f"{name} must be an integer")
+        
+        if cursor < 0:
+            raise ValidationError(f"{name} must not be negative")
+        
+        return cursor
+    
+    @staticmethod
+    def validate_timestamp(value, name: str = "Timestamp") -> Optional[str]:
+        """
+        Validate an ISO 8601 date or datetime
+        
+        Args:
+            value: Raw parameter value, or None if absent
+            name: Parameter name for error messages
+            
+        Returns:
+            Timestamp in the database format ('YYYY-MM-DD HH:MM:SS'), or None if absent
+            
+        Raises:
+            ValidationError: If the value is not an ISO 8601 date or datetime
+        """
+        if value is None or value == '':
+            return None
+        
+        try:
+            parsed = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+        except ValueError:
+            raise ValidationError(f"{name} must be an ISO 8601 date or datetime")
+        
+        return parsed.strftime('%Y-%m-%d %H:%M:%S')
+    
+    @staticmethod
+    def validate_percentiles(value) -> Optional[tuple]:
+        """
+        Validate a comma-separated list of percentiles
+        
+        Args:
+            value: Raw parameter value such as "50,95,99.9", or None if absent
+            
+        Returns:
+            Tuple of floats, or None if absent
+            
+        Raises:
+            ValidationError: If an item is not a number between 0 and 100, or
+                there are more than 20
+        """
+        if value is None or value == '':
+            return None
+        
+        try:
+            percentiles = tuple(float(item) for item in str(value).split(','))
+        except ValueError:
+            raise ValidationError("Percentiles must be comma-separated numbers")
+        
+        if len(percentiles) > 20:
+            raise ValidationError("At most 20 percentiles can be requested")
+        if any(not 0 < p <= 100 for p in percentiles):
+            raise ValidationError("Percentiles must be greater than 0 and at most 100")
+        
+        return percentiles
+    
+    @staticmethod
+    def validate_radius(radius) -> float:
+        """
+        Validate a search radius in kilometers
+        
+        Args:
+            radius: Requested radius
+            
+        Returns:
+            Radius as a float
+            
+        Raises:
+            ValidationError: If the radius is not a number in (0, SPATIAL_MAX_RADIUS_KM]
+        """
+        try:
+            radius = float(radius)
+        except (ValueError, TypeError):
+            raise ValidationError("radius_km must be numeric")
+        
+        if not (0 < radius <= Config.SPATIAL_MAX_RADIUS_KM):
+            raise ValidationError(
+                f"radius_km must be greater than 0 and at most {Config.SPATIAL_MAX_RADIUS_KM}"
+            )
+        
+        return radius
+    
     @staticmethod
     def validate_coordinates(lat: float, lon: float, location_name: str = "Location") -> Tuple[float, float]:
         """
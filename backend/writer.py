@@ -0,0 +1,413 @@
+import os
+import glob
+import json
+import time
+import queue
+import threading
+import logging
+from typing import Dict, List, Optional
+
+from config import Config
+from metrics import count_error
+
+logger = logging.getLogger(__name__)
+
+
+POLICIES = ('block', 'drop_oldest', 'spill')
+
+_STOP = object()
+
+
+class QueryWriter:
+    """
+    Write-behind queue for query history
+
+    Completed queries are queued by the request thread and saved by a
+    background thread in batched transactions, flushed when batch_size rows
+    are waiting or flush_interval seconds have passed. When the queue is
+    full the backpressure policy decides what happens:
+
+    - block: wait up to block_timeout seconds for space, then drop the row
+    - drop_oldest: discard the oldest queued row to make room
+    - spill: append the row to a JSON lines file, replayed once the queue drains
+
+    With the configured spill path every process spills to its own file
+    (the pid is added to the name), so gunicorn workers never replay each
+    other's rows. Files left by processes that have exited are claimed by
+    renaming them, which only one worker can do, and replayed.
+    """
+
+    def __init__(
+        self,
+        database,
+        max_queue: int = 0,
+        batch_size: int = 0,
+        flush_interval: float = 0,
+        policy: str = "",
+        spill_path: str = ""
+    ):
+        self.database = database
+        self.batch_size = batch_size or Config.WRITE_BEHIND_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.WRITE_BEHIND_FLUSH_INTERVAL
+        self.policy = policy or Config.WRITE_BEHIND_POLICY
+        # Per-process file unless a path is given
+        self._spill_template = None if spill_path else Config.WRITE_BEHIND_SPILL_PATH
+        self.spill_path = spill_path or _process_path(Config.WRITE_BEHIND_SPILL_PATH, os.getpid())
+        self.block_timeout = Config.WRITE_BEHIND_BLOCK_TIMEOUT
+
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown write-behind policy: {self.policy}")
+
+        self._queue = queue.Queue(maxsize=max_queue or Config.WRITE_BEHIND_QUEUE_SIZE)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        self._stopping = threading.Event()
+        self._orphans_claimed = False
+        self._claimed = []  # spill files of exited processes not yet replayed
+        self._stats = {
+            'submitted': 0,
+            'written': 0,
+            'dropped': 0,
+            'spilled': 0,
+            'failed': 0,
+            'flushes': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    def submit(self, row: tuple) -> bool:
+        """
+        Queue a query row for saving
+
+        Args:
+            row: Tuple in Database.save_queries order
+
+        Returns:
+            True if the row was queued or spilled, False if it was dropped
+        """
+        if self._closed:
+            raise RuntimeError("QueryWriter is closed")
+
+        self._ensure_started()
+        self._count('submitted')
+
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            pass
+
+        if self.policy == 'spill':
+            return self._spill([row])
+
+        if self.policy == 'drop_oldest':
+            while True:
+                try:
+                    self._queue.get_nowait()
+                    self._count('dropped')
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(row)
+                    return True
+                except queue.Full:
+                    continue
+
+        try:
+            self._queue.put(row, timeout=self.block_timeout)
+            return True
+        except queue.Full:
+            logger.warning("Write-behind queue full, dropping query")
+            self._count('dropped')
+            return False
+
+    def close(self, timeout: float = None):
+        """
+        Stop accepting rows and flush everything that is queued or spilled
+
+        Args:
+            timeout: Seconds to wait for the background thread to finish
+        """
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+
+        if thread is not None and thread.is_alive():
+            # The thread checks the event whenever the queue runs empty; the
+            # sentinel only wakes it early and is skipped if the queue is full
+            self._stopping.set()
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.warning(
+                    f"Write-behind queue not drained after {timeout}s, "
+                    f"{self._queue.qsize()} queries left unwritten"
+                )
+                return
+        else:
+            self._drain()
+
+        logger.info("Write-behind queue drained")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get queue counters
+
+        Returns:
+            Dictionary with queue depth, row counters and flush latency
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        total_flush_ms = stats.pop('total_flush_ms')
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_flush_ms'] = round(total_flush_ms / stats['flushes'], 3) if stats['flushes'] else 0.0
+        stats['policy'] = self.policy
+        return stats
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='query-writer', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = []
+            stop = False
+
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    self._drain()
+                    return
+                self._replay_spill()
+                continue
+
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            self._flush(batch)
+
+            if stop or (self._stopping.is_set() and self._queue.empty()):
+                self._drain()
+                return
+
+            if self._queue.empty():
+                self._replay_spill()
+
+    def _drain(self):
+        """Flush everything left in the queue and the spill file"""
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        self._flush(batch)
+        self._replay_spill()
+
+    def _flush(self, rows: List[tuple], replaying: bool = False) -> bool:
+        """
+        Save rows in one transaction
+
+        Rows that fail are spilled for another try under the spill policy
+        and counted as dropped otherwise. Replayed rows are left to the
+        caller, which keeps them in their spill file.
+
+        Returns:
+            True if the rows were written
+        """
+        if not rows:
+            return True
+
+        start = time.perf_counter()
+        try:
+            self.database.save_queries(rows)
+            written, failed = len(rows), 0
+        except Exception as e:
+            count_error(e)
+            logger.error(f"Failed to flush {len(rows)} queued queries: {str(e)}")
+            written, failed = 0, len(rows)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._stats_lock:
+            self._stats['written'] += written
+            self._stats['failed'] += failed
+            self._stats['flushes'] += 1
+            self._stats['last_flush_ms'] = round(elapsed_ms, 3)
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], round(elapsed_ms, 3))
+            self._stats['total_flush_ms'] += elapsed_ms
+
+        if failed and not replaying:
+            if self.policy == 'spill':
+                self._spill(rows)
+            else:
+                self._count('dropped', failed)
+        return not failed
+
+    def _spill(self, rows: List[tuple]) -> bool:
+        """Append rows to the spill file, counting them as dropped if that fails"""
+        try:
+            with self._spill_lock:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(list(row)) + '\n' for row in rows))
+        except OSError as e:
+            count_error(e)
+            logger.error(f"Failed to spill {len(rows)} queries to {self.spill_path}: {str(e)}")
+            self._count('dropped', len(rows))
+            return False
+        self._count('spilled', len(rows))
+        return True
+
+    def _replay_spill(self):
+        """Save spilled rows, including files left by processes that have exited"""
+        try:
+            paths = self._claim_spill_files()
+        except OSError as e:
+            count_error(e)
+            logger.error(f"Failed to claim spilled queries: {str(e)}")
+            return
+
+        for path in paths:
+            try:
+                if self._replay_file(path):
+                    os.remove(path)
+                    if path in self._claimed:
+                        self._claimed.remove(path)
+            except OSError as e:
+                count_error(e)
+                logger.error(f"Failed to replay spilled queries from {path}: {str(e)}")
+
+    def _claim_spill_files(self) -> List[str]:
+        """Spill files this writer replays now, renamed so no one else appends to or claims them"""
+        # A replay file left by a failed replay is finished before new spills
+        replay_path = f"{self.spill_path}.replay"
+        with self._spill_lock:
+            if not os.path.exists(replay_path) and os.path.exists(self.spill_path):
+                os.replace(self.spill_path, replay_path)
+        paths = [replay_path] if os.path.exists(replay_path) else []
+
+        if self._spill_template is not None and not self._orphans_claimed:
+            self._orphans_claimed = True
+            self._claimed.extend(self._claim_orphans())
+        return paths + self._claimed
+
+    def _claim_orphans(self) -> List[str]:
+        """Rename the spill files of exited processes to this writer's name"""
+        root, ext = os.path.splitext(self._spill_template)
+        claimed = []
+        for path in glob.glob(f"{glob.escape(root)}.*{glob.escape(ext)}*"):
+            if path.endswith('.tmp'):
+                # Partial rewrite of a failed replay; its source file is still there
+                continue
+            pid = _spill_pid(path, root)
+            if pid is None or pid == os.getpid() or _pid_alive(pid):
+                continue
+            target = f"{self.spill_path}.{os.path.basename(path)}"
+            try:
+                os.replace(path, target)
+            except FileNotFoundError:
+                # Claimed by another worker first
+                continue
+            logger.info(f"Claimed spilled queries of exited process {pid}: {path}")
+            claimed.append(target)
+        return claimed
+
+    def _replay_file(self, path: str) -> bool:
+        """
+        Save the rows of a spill file
+
+        Replay stops at the first batch that fails; that batch and the rows
+        after it are written back to the file for the next attempt.
+
+        Returns:
+            True if every row was written and the file can be removed
+        """
+        logger.info(f"Replaying spilled queries from {path}")
+        with open(path, encoding='utf-8') as f:
+            batch = []
+            for line in f:
+                try:
+                    batch.append(tuple(json.loads(line)))
+                except ValueError:
+                    logger.error(f"Skipping unreadable spilled query in {path}")
+                    self._count('dropped')
+                    continue
+                if len(batch) >= self.batch_size:
+                    if not self._flush(batch, replaying=True):
+                        self._keep_unwritten(path, batch, f)
+                        return False
+                    batch = []
+            if not self._flush(batch, replaying=True):
+                self._keep_unwritten(path, batch, f)
+                return False
+        return True
+
+    def _keep_unwritten(self, path: str, batch: List[tuple], rest):
+        """Replace a spill file with a failed batch and its unread lines"""
+        partial = f"{path}.tmp"
+        with open(partial, 'w', encoding='utf-8') as out:
+            out.write(''.join(json.dumps(list(row)) + '\n' for row in batch))
+            for line in rest:
+                out.write(line)
+        os.replace(partial, path)
+        logger.warning(f"Kept unwritten spilled queries in {path} for the next replay")
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+
+def _process_path(path: str, pid: int) -> str:
+    """Spill path of one process: name.jsonl -> name.<pid>.jsonl"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{pid}{ext}"
+
+
+def _spill_pid(path: str, root: str) -> Optional[int]:
+    """Pid of the process a spill file (or its replay/claimed copies) belongs to"""
+    pid = path[len(root) + 1:].split('.', 1)[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to someone else (PermissionError), or unknown
+        return True
+    return True